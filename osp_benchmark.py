@@ -0,0 +1,457 @@
+##############################################################################
+##############################################################################
+# Open Sonar Benchmarks
+##############################################################################
+##############################################################################
+# Measures throughput, peak memory and per call latency of the Open Sonar
+# Library readers, conversions and acquisition loop on synthetic survey logs
+#
+# Usage:
+#   python osp_benchmark.py                      (10^3 to 10^6 lines)
+#   python osp_benchmark.py --sizes 1000 10000000
+#   python osp_benchmark.py --output bench_output.txt
+#   python osp_benchmark.py --repeats 5           (calls per whole log function)
+#   python osp_benchmark.py --import-budget 200   (fails if import is slower)
+##############################################################################
+##############################################################################
+
+import argparse
+import datetime as dt
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+import pynmea2
+
+import osplib
+
+#########################################
+#########################################
+# Fake sensors
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+class ReplayGNSS:
+# Class standing in for osplib.GNSS, handing out pre-parsed NMEA messages
+    def __init__(self, sentences):
+        self.messages = [pynmea2.parse(sentence) for sentence in sentences]
+        self.index = 0
+        self.gps_found = True
+
+    def get_nmea(self):
+        msg = self.messages[self.index % len(self.messages)]
+        self.index += 1
+        ping = msg.sentence_type in ('GGA', 'RMC', 'GLL')
+        return dt.datetime.utcnow().time(), msg, ping
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class ReplaySonar(osplib.Sonar):
+# Class standing in for osplib.Sonar without a Ping1D behind it
+    def __init__(self):
+        self.sonar_found = True
+
+    def send_ping(self):
+        self.distance = {'distance': 12.345, 'confidence': 100,
+                         'transmit_duration': 50, 'scan_start': 0,
+                         'scan_length': 30000, 'gain_setting': 2}
+        self.time = dt.datetime.utcnow().time()
+        return self.time, self.distance
+
+    def set_sound_speed(self, soundspeed):
+        self.sound_speed = soundspeed
+        return True
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class ReplaySVP(osplib.Speed):
+# Class standing in for osplib.Speed, handing out the given sound speeds in turn
+    def __init__(self, speeds):
+        self.speeds = list(speeds)
+        self.index = 0
+        self.svp_found = True
+
+    def get_surface_sound_speed(self):
+        speed = self.speeds[self.index % len(self.speeds)]
+        self.index += 1
+        return speed
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Synthetic logs
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+# Metadata used for synthetic logs
+SYNTHETIC_METADATA = {
+    'Survey': ['Synthetic Survey', '2022-01-17', 'Open Sonar'],
+    'Geodetics': [4326.0, 0.0],
+    'Vessel': ['Synthetic Vessel'],
+    'GNSS': ['Synthetic', 'GNSS', 1.5, 0.0, 0.0, 0.0],
+    'Sonar': ['Synthetic', 'Ping1D', 0.3, 0.2, 0.5, 0.0],
+    'SVP': ['Synthetic', 'SVP', 0.3],
+    'GNSS_Com': ['COM', 'SIM0', 115200],
+    'Sonar_Com': ['COM', 'SIM1', 115200],
+    'SVP_Com': ['COM', 'SIM2', 9600],
+    }
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def synthetic_track(epochs, rate=5.0, start=(45.5, -63.5), start_time=43200.0,
+                    line_length=400.0, seed=0):
+    # Function to simulate a vessel running survey lines back and forth at
+    # 2 m/s over an undulating seabed, one row per GNSS epoch
+    rng = numpy.random.default_rng(seed)
+    elapsed = numpy.arange(epochs)/rate
+    line_time = line_length/2.0
+    heading = numpy.where((elapsed // line_time) % 2 == 0, 0.0, 180.0)
+    heading = heading + rng.normal(0, 1.0, epochs)
+    step = 2.0/rate
+    x = numpy.cumsum(step*numpy.sin(numpy.deg2rad(heading))) +\
+        10.0*(elapsed // (2*line_time))
+    y = numpy.cumsum(step*numpy.cos(numpy.deg2rad(heading)))
+    lat, long = osplib.local_latlong(x, y, start)
+
+    depth = 10 + 5*numpy.sin(x/200) + 2*numpy.cos(y/150) + rng.normal(0, 0.05, epochs)
+    spikes = rng.random(epochs) < 0.001
+    depth[spikes] = depth[spikes]*rng.uniform(0.2, 3.0, spikes.sum())
+
+    track = {}
+    track['time'] = numpy.mod(start_time + elapsed, 86400)
+    track['lat'] = lat
+    track['long'] = long
+    track['heading'] = numpy.mod(heading, 360)
+    track['speed_kt'] = numpy.full(epochs, 2.0*3600/1852)
+    track['ortho_height'] = 20.0 + rng.normal(0, 0.02, epochs)
+    track['geoid_sep'] = numpy.full(epochs, -21.5)
+    track['depth'] = depth
+    track['confidence'] = numpy.where(spikes, rng.integers(0, 50, epochs), 100)
+    track['sound_speed'] = 1485.0 + numpy.cumsum(rng.normal(0, 0.001, epochs))
+    return track
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_synthetic_raw_log(filename, lines, metadata=None, rate=5.0, seed=0,
+                            chunk_size=10000):
+    # Function to write a raw log of about the given number of body lines.
+    # Each GNSS epoch has GGA, RMC, VTG and GLL sentences and, as in
+    # take_observation, a $DEPTH line after each GGA, RMC and GLL
+    if metadata is None:
+        metadata = SYNTHETIC_METADATA
+    metadata = dict(metadata)
+    metadata['filetype'] = ['OSP_RAW_LOG']
+    osplib.write_meta_header(filename, metadata)
+
+    epochs = -(-lines // 7)
+    track = synthetic_track(epochs, rate=rate, seed=seed)
+    written = 0
+    with open(filename, 'a', newline='') as file:
+        for first in range(0, epochs, chunk_size):
+            chunk = {key: value[first:first+chunk_size] for key, value in track.items()}
+            body = synthetic_raw_lines(chunk, metadata)
+            body = body[:lines-written]
+            written += len(body)
+            file.write(''.join(body))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def synthetic_raw_lines(track, metadata):
+    # Function to format a section of a synthetic track as raw log lines
+    times = osplib.format_time_column(track['time'])
+    ping_times = [osplib.format_time_column(track['time'] + 0.02*(k+1)) for k in range(3)]
+    micro = numpy.round(track['time']*100).astype(numpy.int64)
+    utc = ['%02d%02d%02d.%02d' % (t // 360000, t // 6000 % 60, t // 100 % 60, t % 100)
+           for t in micro.tolist()]
+    lat = nmea_format(track['lat'], 2)
+    long = nmea_format(track['long'], 3)
+    distance = track['depth'] - metadata['Sonar'][2]
+
+    lines = []
+    for i in range(len(times)):
+        lat_i, lat_hem = lat[i]
+        long_i, long_hem = long[i]
+        gga = nmea_sentence('GNGGA,%s,%s,%s,%s,%s,4,12,0.8,%.3f,M,%.3f,M,1.0,0000' %
+                            (utc[i], lat_i, lat_hem, long_i, long_hem,
+                             track['ortho_height'][i], track['geoid_sep'][i]))
+        rmc = nmea_sentence('GNRMC,%s,A,%s,%s,%s,%s,%.3f,%.1f,170122,,,D,V' %
+                            (utc[i], lat_i, lat_hem, long_i, long_hem,
+                             track['speed_kt'][i], track['heading'][i]))
+        vtg = nmea_sentence('GNVTG,%.1f,T,,M,%.3f,N,%.3f,K,D' %
+                            (track['heading'][i], track['speed_kt'][i],
+                             track['speed_kt'][i]*1.852))
+        gll = nmea_sentence('GNGLL,%s,%s,%s,%s,%s,A,D' %
+                            (lat_i, lat_hem, long_i, long_hem, utc[i]))
+        pings = ['%s,$DEPTH,%.3f,%d,50,0,%d,2,%.3f\n' %
+                 (ping_times[k][i], distance[i], track['confidence'][i],
+                  1000*max(20, int(distance[i]*2)), track['sound_speed'][i])
+                 for k in range(3)]
+        lines.extend([times[i]+','+gga+'\n', pings[0],
+                      times[i]+','+rmc+'\n', pings[1],
+                      times[i]+','+vtg+'\n',
+                      times[i]+','+gll+'\n', pings[2]])
+    return lines
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_synthetic_simple_log(filename, lines, metadata=None, rate=5.0, seed=0):
+    # Function to write a simple log with the given number of soundings
+    if metadata is None:
+        metadata = SYNTHETIC_METADATA
+    track = synthetic_track(lines, rate=rate, seed=seed)
+    soundings = numpy.zeros(lines, dtype=osplib.SIMPLE_LOG_FIELDS)
+    soundings['time'] = track['time']
+    soundings['lat'] = track['lat']
+    soundings['long'] = track['long']
+    soundings['depth'] = numpy.round(track['depth'], 3)
+    soundings['height'] = numpy.round(track['ortho_height'] + track['geoid_sep'] -
+                                      track['depth'] - metadata['GNSS'][2], 3)
+    soundings['speed'] = track['sound_speed']
+    osplib.write_simple_log_columns(filename, metadata, soundings)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def nmea_sentence(body):
+    # Function to add the $ and *checksum to the body of an NMEA sentence
+    checksum = 0
+    for char in body.encode():
+        checksum ^= char
+    return '$%s*%02X' % (body, checksum)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def nmea_format(dd, width):
+    # Function to format decimal degrees as NMEA ddmm.mmmmmm and hemisphere
+    # pairs, width is 2 for latitude and 3 for longitude. Minutes are rounded
+    # before splitting so 59.9999996 carries into the degrees
+    hemispheres = ('N', 'S') if width == 2 else ('E', 'W')
+    micro = numpy.round(numpy.abs(dd)*60000000).astype(numpy.int64)
+    degrees, micro = numpy.divmod(micro, 60000000)
+    minutes, micro = numpy.divmod(micro, 1000000)
+    return [('%0*d%02d.%06d' % (width, d, m, u), hemispheres[negative])
+            for d, m, u, negative in zip(degrees.tolist(), minutes.tolist(),
+                                         micro.tolist(), (dd < 0).tolist())]
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Benchmarks
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+def measure(function, rows, repeats=3):
+    # Function to time repeated calls and then one more under tracemalloc for
+    # the peak memory, returns rows/s of the median call, latency percentiles
+    # of the calls in microseconds and peak MB
+    latencies = numpy.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        latencies[i] = time.perf_counter() - start
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    elapsed = numpy.median(latencies)
+    result = {'rows_per_s': rows/elapsed, 'seconds': elapsed, 'peak_mb': peak/1e6}
+    result.update(latency_percentiles(latencies))
+    return result
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def measure_calls(function, arguments):
+    # Function to time every call separately, returns rows/s and latency
+    # percentiles in microseconds
+    latencies = numpy.empty(len(arguments))
+    start = time.perf_counter()
+    for i, argument in enumerate(arguments):
+        call_start = time.perf_counter()
+        function(argument)
+        latencies[i] = time.perf_counter() - call_start
+    elapsed = time.perf_counter() - start
+
+    result = {'rows_per_s': len(arguments)/elapsed, 'seconds': elapsed}
+    result.update(latency_percentiles(latencies))
+    return result
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def latency_percentiles(latencies):
+    # Function to summarise call times in seconds as percentiles in
+    # microseconds
+    result = {}
+    for percentile in (50, 90, 99):
+        result[f'p{percentile}_us'] = numpy.percentile(latencies, percentile)*1e6
+    result['max_us'] = latencies.max()*1e6
+    return result
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def benchmark_size(lines, directory, per_row_limit, repeats=3):
+    # Function to run every benchmark on logs of the given number of lines,
+    # functions taking the whole log are called repeats times
+    raw_file = os.path.join(directory, f'raw_{lines}.csv')
+    write_synthetic_raw_log(raw_file, lines)
+    raw_columns = osplib.read_raw_log_columns(raw_file)
+    rmc = raw_columns['Data']['RMC']
+    results = {}
+
+    results['generic_reader'] = measure(
+        lambda: osplib.generic_reader(raw_file, ',', 'Header_End', None), lines, repeats)
+    results['read_raw_log'] = measure(
+        lambda: osplib.read_raw_log(raw_file), lines, repeats)
+    results['read_raw_log_columns'] = measure(
+        lambda: osplib.read_raw_log_columns(raw_file), lines, repeats)
+    compressed_file = os.path.join(directory, f'raw_{lines}_compressed.csv')
+    osplib.write_raw_log_columns(compressed_file, raw_columns, compress=True)
+    results['read_raw_log_columns_compressed'] = measure(
+        lambda: osplib.read_raw_log_columns(compressed_file), lines, repeats)
+
+    count = min(len(rmc), per_row_limit)
+    lat = osplib.nmea_to_dd_array(rmc['lat'][:count], rmc['lat_hem'][:count])
+    long = osplib.nmea_to_dd_array(rmc['long'][:count], rmc['long_hem'][:count])
+    course = rmc['tmg_true'][:count]
+    rows = [{'Lat': a, 'Long': b, 'Course': c} for a, b, c in
+            zip(lat.tolist(), long.tolist(), course.tolist())]
+    offset = [0.2, 0.5]
+    results['compute_horizontal_offsets'] = measure(
+        lambda: osplib.compute_horizontal_offsets(offset, rows), count, repeats)
+    results['compute_horizontal_offsets_array'] = measure(
+        lambda: osplib.compute_horizontal_offsets_array(offset, lat, long, course),
+        count, repeats)
+
+    dms = ['%s%02d:%02d:%02d' % ('-' if value < 0 else '', abs(value),
+                                 abs(value)*60 % 60, abs(value)*3600 % 60)
+           for value in long.tolist()]
+    results['dms_to_dd'] = measure_calls(osplib.dms_to_dd, dms)
+    results['dms_to_dd_array'] = measure(
+        lambda: osplib.dms_to_dd_array(dms), count, repeats)
+    lat_strings = rmc['lat'][:count].astype(str)
+    results['nmea_to_dd_array'] = measure(
+        lambda: osplib.nmea_to_dd_array(lat_strings, rmc['lat_hem'][:count]), count,
+        repeats)
+
+    depth = raw_columns['Data']['DEPTH']
+    results['flag_depths'] = measure(
+        lambda: osplib.flag_depths(depth), len(depth), repeats)
+
+    sentences = []
+    for row in osplib.iter_generic_reader(raw_file, ',', 'Header_End', None):
+        if row[1].startswith('$GN'):
+            sentences.append(','.join(row[1:]))
+        if len(sentences) == 200:
+            break
+    results['take_observation'] = benchmark_take_observation(
+        raw_columns['Metadata'], sentences, min(lines, per_row_limit))
+    return results
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def benchmark_take_observation(metadata, sentences, count):
+    # Function to time the acquisition loop against replayed sensors with
+    # in-memory logs
+    gnss = ReplayGNSS(sentences)
+    sonar = ReplaySonar()
+    raw_log = io.StringIO()
+    simple_log = io.StringIO()
+    console = osplib.Console(interval=3600)
+    state = {'obs_numb': 0, 'speed': 1485.0}
+
+    def observe(i):
+        state['obs_numb'], state['speed'] = osplib.take_observation(
+            metadata, gnss, sonar, None, state['speed'], False,
+            state['obs_numb'], simple_log, raw_log, console=console)
+
+    return measure_calls(observe, range(count))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Most ms importing osplib may take, by default
+IMPORT_BUDGET_MS = 250.0
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def benchmark_import(repeats=5):
+    # Function to time importing osplib in fresh interpreters, returns the
+    # fastest import in ms and any sensor libraries the import loaded
+    code = ('import sys, osplib; print(",".join(m for m in '
+            '("serial", "brping", "pynmea2", "geopy") if m in sys.modules))')
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for i in range(repeats + 1):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=directory, capture_output=True, text=True,
+                                check=True)
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == 'osplib':
+                times.append(int(fields[1])/1000)
+    loaded = result.stdout.strip()
+    # The first run may be compiling osplib, so it is not counted
+    return {'import_ms': min(times[1:]), 'loaded': loaded.split(',') if loaded else []}
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def format_results(lines, results):
+    # Function to format the results of one log size as a table
+    text = [f'{lines} lines',
+            '%-34s %14s %10s %10s %10s %10s %10s' % ('function', 'rows/s', 'peak MB',
+                                                    'p50 us', 'p90 us', 'p99 us', 'max us')]
+    for name, result in results.items():
+        columns = [result.get(key) for key in
+                   ('peak_mb', 'p50_us', 'p90_us', 'p99_us', 'max_us')]
+        text.append('%-34s %14.0f ' % (name, result['rows_per_s']) +
+                    ' '.join('%10s' % ('-' if value is None else '%.1f' % value)
+                             for value in columns))
+    return '\n'.join(text) + '\n'
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Open Sonar Library benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='raw log sizes in lines')
+    parser.add_argument('--per-row-limit', type=int, default=100000,
+                        help='most rows given to the one row at a time functions')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='timed calls of each function taking the whole log')
+    parser.add_argument('--output', help='file to append the results to')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_MS,
+                        help='most ms importing osplib may take')
+    args = parser.parse_args()
+
+    result = benchmark_import()
+    over_budget = result['import_ms'] > args.import_budget or result['loaded']
+    text = 'import osplib %.1f ms, budget %.1f ms, sensor libraries loaded: %s%s\n' % (
+        result['import_ms'], args.import_budget, ', '.join(result['loaded']) or 'none',
+        ' OVER BUDGET' if over_budget else '')
+    print(text)
+    if args.output:
+        with open(args.output, 'a') as file:
+            file.write(text + '\n')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for lines in args.sizes:
+            results = benchmark_size(lines, directory, args.per_row_limit,
+                                     args.repeats)
+            text = format_results(lines, results)
+            print(text)
+            if args.output:
+                with open(args.output, 'a') as file:
+                    file.write(text + '\n')
+    if over_budget:
+        sys.exit(1)
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+##############################################################################
+##############################################################################
+# Open Sonar Sensor Replay
+##############################################################################
+##############################################################################
+# Serves a recorded raw log over local pseudo-terminals so the acquisition
+# code can be run without a boat: the NMEA sentences on a GNSS port, a Ping1D
+# protocol responder answering with the logged depths on a sonar port and
+# the logged sound speed on an SVP port. The log is replayed at real time or
+# at N times speed
+#
+# Usage:
+#   python osp_replay.py raw_log.csv
+#   python osp_replay.py raw_log.csv --speed 10 --config replay_config.csv
+#
+# The port names are printed on start up, or written into a copy of the log
+# metadata with --config so connect_gnss, connect_sonar and connect_speed can
+# be pointed at them unchanged. Linux and macOS only
+##############################################################################
+##############################################################################
+
+import argparse
+import os
+import struct
+import threading
+import time
+import tty
+
+from brping import definitions
+from brping import pingmessage
+
+import osplib
+
+# Ping1D message layouts, the combined brping table reuses some of their ids
+# for other devices
+PING1D_PAYLOADS = {**definitions.payload_dict_common,
+                   **definitions.payload_dict_ping1d}
+
+#########################################
+#########################################
+# Ports
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+class PtyPort:
+# Class to manage one pseudo-terminal standing in for a serial port. Writes
+# never block, anything the reader has not kept up with is dropped and
+# counted the way a real serial port overruns
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.name = os.ttyname(self.slave)
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        # Function to write bytes to the port, returns False if they were dropped
+        with self.lock:
+            try:
+                os.write(self.master, data)
+                return True
+            except (BlockingIOError, OSError):
+                self.dropped += 1
+                return False
+
+    def read(self):
+        # Function to read whatever bytes are waiting on the port
+        try:
+            return os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return b''
+
+    def close(self):
+        # Function to close both ends of the pseudo-terminal
+        os.close(self.master)
+        os.close(self.slave)
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Replay
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+class Replay:
+# Class to replay a raw log over a GNSS, a sonar and an SVP pseudo-terminal
+# on their own threads, all following one replay clock
+    def __init__(self, filename, speed=1.0, svp_interval=1.0, loop=False):
+        self.filename = filename
+        self.metadata = osplib.read_config_file(filename)
+        self.speed = speed
+        self.svp_interval = svp_interval
+        self.loop = loop
+        self.gnss_port = PtyPort()
+        self.sonar_port = PtyPort()
+        self.svp_port = PtyPort()
+        # Until the first logged depth the sonar answers with no confidence,
+        # as it does while starting up
+        self.depth = {'distance': 0, 'confidence': 0, 'transmit_duration': 0,
+                      'scan_start': 0, 'scan_length': 0, 'gain_setting': 0}
+        self.sound_speed = None
+        self.sonar_speed = 1500000
+        self.ping_interval = 100
+        self.ping_enable = 1
+        self.continuous = set()
+        self.ping_number = 0
+        self.depth_requested = True
+        self.counts = {'sentences': 0, 'depths': 0, 'pings': 0,
+                       'requests': 0, 'missed_pings': 0, 'svp': 0,
+                       'max_lag': 0.0}
+        self.finished = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self):
+        # Function to start the replay clock and the port threads
+        self.start_wall = time.perf_counter()
+        self.start_log = None
+        self.threads = [threading.Thread(target=self.log_loop, daemon=True),
+                        threading.Thread(target=self.sonar_loop, daemon=True),
+                        threading.Thread(target=self.svp_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        # Function to stop the threads and close the ports
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        for port in (self.gnss_port, self.sonar_port, self.svp_port):
+            port.close()
+
+    def stats(self):
+        # Function to get the replay counters, including the sentences
+        # dropped because the acquisition side did not read them in time
+        stats = dict(self.counts)
+        stats['gnss_dropped'] = self.gnss_port.dropped
+        stats['sonar_dropped'] = self.sonar_port.dropped
+        stats['svp_dropped'] = self.svp_port.dropped
+        return stats
+
+    def ports(self):
+        # Function to get the pseudo-terminal name of each sensor
+        return {'GNSS_Com': self.gnss_port.name,
+                'Sonar_Com': self.sonar_port.name,
+                'SVP_Com': self.svp_port.name}
+
+    def write_config(self, filename):
+        # Function to write the log metadata as a config file with the com
+        # ports swapped for the pseudo-terminals
+        metadata = dict(self.metadata)
+        metadata['filetype'] = ['OSP_CONFIG']
+        for key, name in self.ports().items():
+            metadata[key] = [metadata[key][0], name, metadata[key][2]]
+        osplib.write_meta_header(filename, metadata)
+
+    def wait_until(self, log_time):
+        # Function to sleep until the replay clock reaches a log time,
+        # returns how late the clock already was in log seconds
+        if self.start_log is None:
+            self.start_log = log_time
+        due = self.start_wall + (log_time - self.start_log)/self.speed
+        lag = time.perf_counter() - due
+        if lag < 0:
+            self.stopping.wait(-lag)
+        return max(lag, 0.0)*self.speed
+
+    def log_loop(self):
+        # Thread walking the raw log in time order, writing the NMEA
+        # sentences to the GNSS port and making each depth current for the
+        # sonar when its time comes
+        offset = 0.0
+        previous = None
+        while not self.stopping.is_set():
+            first = True
+            for row in osplib.iter_generic_reader(self.filename, ',',
+                                                  'Header_End', None):
+                if self.stopping.is_set():
+                    return
+                log_time = osplib.time_to_seconds(row[0]) + offset
+                if first and previous is not None:
+                    # Each loop carries on a second after the last one ended
+                    offset += previous + 1.0 - log_time
+                    log_time = previous + 1.0
+                elif previous is not None and log_time < previous - 43200:
+                    offset += 86400
+                    log_time += 86400
+                first = False
+                previous = log_time
+                lag = self.wait_until(log_time)
+                self.counts['max_lag'] = max(self.counts['max_lag'], lag)
+                if row[1] == '$DEPTH':
+                    self.new_depth(row)
+                else:
+                    sentence = ','.join(row[1:]) + '\r\n'
+                    if self.gnss_port.write(sentence.encode('ascii')):
+                        self.counts['sentences'] += 1
+            if not self.loop:
+                break
+        self.finished.set()
+
+    def new_depth(self, row):
+        # Function to make a logged depth the current sonar reading
+        if not self.depth_requested:
+            self.counts['missed_pings'] += 1
+        self.depth = {'distance': round(float(row[2])*1000),
+                      'confidence': int(float(row[3])),
+                      'transmit_duration': int(float(row[4])),
+                      'scan_start': int(float(row[5])),
+                      'scan_length': int(float(row[6])),
+                      'gain_setting': int(float(row[7]))}
+        if len(row) > 8 and row[8] not in ('', 'None'):
+            self.sound_speed = float(row[8])
+        self.counts['depths'] += 1
+        self.depth_requested = False
+        if self.ping_enable and self.continuous & {definitions.PING1D_DISTANCE,
+                                                   definitions.PING1D_PROFILE}:
+            self.send(definitions.PING1D_DISTANCE)
+
+    def sonar_loop(self):
+        # Thread answering Ping1D requests and commands on the sonar port
+        parser = PingFrameParser()
+        while not self.stopping.is_set():
+            data = self.sonar_port.read()
+            if not data:
+                self.stopping.wait(0.001)
+                continue
+            for message_id, payload in parser.parse(data):
+                self.handle(message_id, payload)
+
+    def handle(self, message_id, payload):
+        # Function to apply a command from the acquisition side or answer
+        # its request
+        self.counts['requests'] += 1
+        if message_id == definitions.COMMON_GENERAL_REQUEST:
+            self.send(struct.unpack('<H', payload[:2])[0])
+        elif message_id == definitions.PING1D_SET_SPEED_OF_SOUND:
+            self.sonar_speed = struct.unpack('<I', payload[:4])[0]
+        elif message_id == definitions.PING1D_SET_PING_INTERVAL:
+            self.ping_interval = struct.unpack('<H', payload[:2])[0]
+        elif message_id == definitions.PING1D_SET_PING_ENABLE:
+            self.ping_enable = payload[0]
+        elif message_id == definitions.PING1D_CONTINUOUS_START:
+            self.continuous.add(struct.unpack('<H', payload[:2])[0])
+        elif message_id == definitions.PING1D_CONTINUOUS_STOP:
+            self.continuous.discard(struct.unpack('<H', payload[:2])[0])
+        elif not payload:
+            # Legacy requests are the requested id with an empty payload
+            self.send(message_id)
+
+    def send(self, message_id):
+        # Function to send one Ping1D message built from the current state
+        if message_id == definitions.PING1D_DISTANCE:
+            self.ping_number += 1
+            self.depth_requested = True
+            self.counts['pings'] += 1
+            fields = dict(self.depth, ping_number=self.ping_number)
+        elif message_id == definitions.PING1D_DISTANCE_SIMPLE:
+            self.depth_requested = True
+            self.counts['pings'] += 1
+            fields = {'distance': self.depth['distance'],
+                      'confidence': self.depth['confidence']}
+        elif message_id == definitions.COMMON_PROTOCOL_VERSION:
+            fields = {'version_major': 1, 'version_minor': 0, 'version_patch': 0}
+        elif message_id == definitions.PING1D_GENERAL_INFO:
+            fields = {'firmware_version_major': 3, 'firmware_version_minor': 29,
+                      'voltage_5': 5000, 'ping_interval': self.ping_interval,
+                      'gain_setting': 2, 'mode_auto': 1}
+        elif message_id == definitions.PING1D_SPEED_OF_SOUND:
+            fields = {'speed_of_sound': self.sonar_speed}
+        elif message_id == definitions.PING1D_PING_INTERVAL:
+            fields = {'ping_interval': self.ping_interval}
+        elif message_id == definitions.PING1D_PING_ENABLE:
+            fields = {'ping_enabled': self.ping_enable}
+        else:
+            message = pingmessage.PingMessage(definitions.COMMON_NACK,
+                                                payload_dict=PING1D_PAYLOADS)
+            message.nacked_id = message_id
+            message.nack_message = b'Not replayed'
+            message.pack_msg_data()
+            self.sonar_port.write(bytes(message.msg_data))
+            return
+        message = pingmessage.PingMessage(message_id, payload_dict=PING1D_PAYLOADS)
+        for key, value in fields.items():
+            setattr(message, key, value)
+        message.pack_msg_data()
+        self.sonar_port.write(bytes(message.msg_data))
+
+    def svp_loop(self):
+        # Thread writing the current logged sound speed to the SVP port
+        # every svp_interval seconds of replay time, as the probe would
+        while not self.stopping.wait(self.svp_interval/self.speed):
+            if self.sound_speed is None:
+                continue
+            line = '%.3f\r\n' % (self.sound_speed*1000)
+            if self.svp_port.write(line.encode('ascii')):
+                self.counts['svp'] += 1
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class PingFrameParser:
+# Class to split the bytes arriving on the sonar port into Ping protocol
+# frames, returning the message id and payload of those with a good checksum
+    def __init__(self):
+        self.buffer = b''
+        self.errors = 0
+
+    def parse(self, data):
+        # Function to add bytes and return every complete (message id, payload)
+        self.buffer += data
+        messages = []
+        while True:
+            start = self.buffer.find(b'BR')
+            if start < 0:
+                self.buffer = self.buffer[-1:]
+                return messages
+            self.buffer = self.buffer[start:]
+            if len(self.buffer) < 8:
+                return messages
+            length, message_id = struct.unpack('<HH', self.buffer[2:6])
+            end = 8 + length
+            if len(self.buffer) < end + 2:
+                return messages
+            checksum = struct.unpack('<H', self.buffer[end:end + 2])[0]
+            if checksum == sum(self.buffer[:end]) & 0xFFFF:
+                messages.append((message_id, self.buffer[8:end]))
+                self.buffer = self.buffer[end + 2:]
+            else:
+                self.errors += 1
+                self.buffer = self.buffer[2:]
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Open Sonar sensor replay')
+    parser.add_argument('raw_log', help='raw log to replay')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed, 1 is real time')
+    parser.add_argument('--svp-interval', type=float, default=1.0,
+                        help='seconds of log time between SVP readings')
+    parser.add_argument('--loop', action='store_true',
+                        help='start the log again when it ends')
+    parser.add_argument('--config', help='config file to write with the replay ports')
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help='seconds between printing the replay counters')
+    args = parser.parse_args()
+
+    replay = Replay(args.raw_log, args.speed, args.svp_interval, args.loop)
+    for key, name in replay.ports().items():
+        print(f'{key}: {name}')
+    if args.config:
+        replay.write_config(args.config)
+    replay.start()
+    try:
+        while not replay.finished.wait(args.stats_interval):
+            print(replay.stats())
+    except KeyboardInterrupt:
+        pass
+    replay.stop()
+    print(replay.stats())
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main()
@@ -11,17 +11,26 @@
 ##############################################################################
 ##############################################################################
 
+import collections
 import csv
+import glob
+import gzip
 import os
 import io
+import json
+import math
+import struct
 import numpy
 import datetime as dt
-import serial
+import queue
+import threading
+import traceback
+import zlib
+from time import perf_counter
 
-import geopy.distance
-
-from brping import Ping1D
-import pynmea2
+# The sensor libraries (serial, brping, pynmea2), geopy and the process pool
+# are imported by the functions that use them, so the readers, writers and
+# conversions load quickly and work without the sensor libraries installed
 
 #########################################
 #########################################
@@ -38,6 +47,7 @@ class GNSS:
     
     def connect_gnss(self):
         # Function to connect to the GNSS serial port
+        import serial
         try:
             self.gps_ser = serial.Serial(self.gps_com, self.gps_baud, timeout=0.1)
             self.gps_sio = io.TextIOWrapper(io.BufferedRWPair(self.gps_ser, self.gps_ser))
@@ -53,14 +63,25 @@ class GNSS:
         # Function to close serial port to GNSS
         if not self.gps_found:
             return
+        self.stop_stream()
         self.gps_ser.close()
         self.gps_found = False
             
     def get_nmea(self):
-        # Function to get GGA strings with timestamp attached
+        # Function to get GGA strings with timestamp attached. While streaming
+        # an exception that stopped the reader thread is raised here once the
+        # buffer is empty
+        import pynmea2
         if not self.gps_found:
             gps_error = [['No','GNSS Found'],True]
             return gps_error
+        if self.streaming():
+            with self.stream_ready:
+                while not self.stream_unread:
+                    if self.stream_error is not None:
+                        raise self.stream_error
+                    self.stream_ready.wait(0.1)
+                return self.stream_unread.popleft()
         while True:
             ping = False
             try:
@@ -79,6 +100,89 @@ class GNSS:
                 return time, msg, ping
             except:
                 pass
+
+    def start_stream(self, buffer_size=1000):
+        # Function to start a thread reading the GNSS port continuously,
+        # framing complete sentences and timestamping them as they arrive
+        if not self.gps_found or self.streaming():
+            return
+        self.stream_unread = collections.deque(maxlen=buffer_size)
+        self.stream_latest = {}
+        self.stream_ready = threading.Condition()
+        self.stream_stop = threading.Event()
+        self.stream_counts = {'sentences': 0, 'bad': 0, 'overflow': 0}
+        self.stream_error = None
+        self.stream_thread = threading.Thread(target=self.stream_loop, daemon=True)
+        self.stream_thread.start()
+
+    def stop_stream(self):
+        # Function to stop the continuous reader thread
+        if not self.streaming():
+            return
+        self.stream_stop.set()
+        self.stream_thread.join()
+        self.stream_thread = None
+
+    def streaming(self):
+        # Function to check if the continuous reader thread is running
+        return getattr(self, 'stream_thread', None) is not None
+
+    def stream_loop(self):
+        # Thread filling the sentence buffer from the serial port, an
+        # exception such as the port going away stops the thread and is kept
+        # for get_nmea to raise
+        partial = b''
+        try:
+            while not self.stream_stop.is_set():
+                chunk = self.gps_ser.read(self.gps_ser.in_waiting or 1)
+                if not chunk:
+                    continue
+                time = dt.datetime.utcnow().time()
+                lines = (partial + chunk).split(b'\n')
+                partial = lines.pop()
+                for line in lines:
+                    self.stream_sentence(time, line)
+        except Exception as error:
+            with self.stream_ready:
+                self.stream_error = error
+                self.stream_ready.notify_all()
+
+    def stream_sentence(self, time, line):
+        # Function to parse one framed sentence and add it to the buffer
+        import pynmea2
+        try:
+            msg = pynmea2.parse(line.decode('ascii').strip())
+        except (UnicodeDecodeError, pynmea2.ParseError):
+            self.stream_counts['bad'] += 1
+            return
+        ping = isinstance(msg, (pynmea2.types.talker.GGA,
+                                pynmea2.types.talker.RMC,
+                                pynmea2.types.talker.GLL))
+        with self.stream_ready:
+            if len(self.stream_unread) == self.stream_unread.maxlen:
+                self.stream_counts['overflow'] += 1
+            self.stream_unread.append((time, msg, ping))
+            sentence_type = getattr(msg, 'sentence_type', type(msg).__name__)
+            self.stream_latest[sentence_type] = (time, msg)
+            self.stream_counts['sentences'] += 1
+            self.stream_ready.notify_all()
+
+    def get_latest(self, sentence_type='GGA'):
+        # Function to get the most recent (time, message) of a sentence type
+        # from the continuous reader, or None if none has arrived
+        if not self.streaming():
+            return
+        with self.stream_ready:
+            return self.stream_latest.get(sentence_type)
+
+    def get_sentences(self):
+        # Function to get every (time, message, ping) read since the last call
+        if not self.streaming():
+            return []
+        with self.stream_ready:
+            sentences = list(self.stream_unread)
+            self.stream_unread.clear()
+        return sentences
 #-----------------------------------------------------------------------------
 # This is a change
 #-----------------------------------------------------------------------------
@@ -90,6 +194,7 @@ class Sonar:
         
     def connect_sonar(self):
         # Function to connect to the sonar
+        from brping import Ping1D
         try:
             self.myping = Ping1D()
             self.myping.connect_serial(self.sonar_com, self.sonar_baud)
@@ -102,9 +207,22 @@ class Sonar:
             return self.sonar_found
         
     def send_ping(self):
-        # Function to take a single ping from sonar
+        # Function to take a single ping from sonar, or while streaming the
+        # newest ping read from the stream. Older unread pings are dropped so
+        # the ping is as close as it can be to the GNSS message it is paired
+        # with, get_pings gives every ping
         if not self.sonar_found:
             return
+        if self.streaming():
+            with self.stream_ready:
+                while not self.stream_unread:
+                    if self.stream_error is not None:
+                        raise self.stream_error
+                    self.stream_ready.wait(0.1)
+                self.time, self.distance = self.stream_unread.pop()
+                self.stream_counts['skipped'] += len(self.stream_unread)
+                self.stream_unread.clear()
+            return self.time, self.distance
         self.distance = self.myping.get_distance()
         self.distance['distance'] = self.distance['distance']/1000
         self.time = dt.datetime.utcnow().time()
@@ -117,16 +235,7 @@ class Sonar:
         #Function to turn the observation dictionary into a string for writing
         if not self.sonar_found:
             return 'No Sonar Found'
-        dist = self.distance['distance']
-        conf = self.distance['confidence']
-        dura = self.distance['transmit_duration']
-        star = self.distance['scan_start']
-        leng = self.distance['scan_length']
-        gain = self.distance['gain_setting']
-        
-        ping_string = str(self.time)+','+'$DEPTH,'+str(dist)+','+\
-            str(conf)+','+str(dura)+','+str(star)+','+str(leng)+','\
-            +str(gain)+','+str(ssp) + '\n'
+        ping_string = depth_to_string(self.time, self.distance, ssp)
         
         return ping_string
     
@@ -139,6 +248,10 @@ class Sonar:
         print('--------------------------------------------------------------')
         print(f'Setting sound speed to {sound_speed_ms} m/s on sonar head')
         print('--------------------------------------------------------------')
+        if self.streaming():
+            from brping import definitions
+            self.send_command(definitions.PING1D_SET_SPEED_OF_SOUND, sound_speed_mms)
+            return True
         self.myping.set_speed_of_sound(sound_speed_mms)
         return True
     
@@ -146,15 +259,170 @@ class Sonar:
         # Function to get the sound speed set onthe sonar
         if not self.sonar_found:
             return
-        sound_speed_mms = self.myping.get_speed_of_sound()
+        if self.streaming():
+            from brping import definitions
+            reply = self.stream_request(definitions.PING1D_SPEED_OF_SOUND)
+            if reply is None:
+                return
+            sound_speed_mms = {'speed_of_sound': reply[0]}
+        else:
+            sound_speed_mms = self.myping.get_speed_of_sound()
         sound_speed_ms = sound_speed_mms['speed_of_sound']/1000
         print('--------------------------------------------------------------')
         print(f'Sound speed is to {sound_speed_ms} m/s on sonar head')
         print('--------------------------------------------------------------')
         return sound_speed_ms
+
+    def start_stream(self, ping_interval=50, buffer_size=1000):
+        # Function to set the ping interval in ms and have the sonar stream
+        # distance messages on its own schedule, read and timestamped as they
+        # arrive by a thread
+        if not self.sonar_found or self.streaming():
+            return
+        from brping import definitions
+        self.myping.set_ping_interval(ping_interval, verify=False)
+        self.myping.set_ping_enable(1, verify=False)
+        self.myping.iodev.timeout = 0.1
+        self.myping.iodev.reset_input_buffer()
+        self.stream_unread = collections.deque(maxlen=buffer_size)
+        self.stream_latest = None
+        self.stream_replies = {}
+        self.stream_ready = threading.Condition()
+        self.stream_stop = threading.Event()
+        self.stream_counts = {'pings': 0, 'other': 0, 'overflow': 0, 'skipped': 0}
+        self.stream_error = None
+        self.stream_thread = threading.Thread(target=self.stream_loop, daemon=True)
+        self.stream_thread.start()
+        self.send_command(definitions.PING1D_CONTINUOUS_START,
+                          definitions.PING1D_DISTANCE)
+
+    def stop_stream(self):
+        # Function to stop the sonar streaming and the reader thread
+        if not self.streaming():
+            return
+        from brping import definitions
+        self.send_command(definitions.PING1D_CONTINUOUS_STOP,
+                          definitions.PING1D_DISTANCE)
+        self.stream_stop.set()
+        self.stream_thread.join()
+        self.stream_thread = None
+
+    def streaming(self):
+        # Function to check if the reader thread is running
+        return getattr(self, 'stream_thread', None) is not None
+
+    def stream_loop(self):
+        # Thread parsing Ping messages from the serial port, distances go in
+        # the ping buffer and anything else is kept as a reply. An exception
+        # stops the thread and is kept for send_ping and get_pings to raise
+        from brping import definitions
+        from brping import pingmessage
+        parser = pingmessage.PingParser()
+        try:
+            while not self.stream_stop.is_set():
+                chunk = self.myping.iodev.read(self.myping.iodev.in_waiting or 1)
+                if not chunk:
+                    continue
+                time = dt.datetime.utcnow().time()
+                for byte in chunk:
+                    if parser.parse_byte(byte) != pingmessage.PingParser.NEW_MESSAGE:
+                        continue
+                    msg = parser.rx_msg
+                    if msg.message_id == definitions.PING1D_DISTANCE:
+                        self.stream_ping(time, msg)
+                    else:
+                        with self.stream_ready:
+                            self.stream_replies[msg.message_id] = \
+                                [getattr(msg, name) for name in
+                                 getattr(msg, 'payload_field_names', ())]
+                            self.stream_counts['other'] += 1
+                            self.stream_ready.notify_all()
+        except Exception as error:
+            with self.stream_ready:
+                self.stream_error = error
+                self.stream_ready.notify_all()
+
+    def stream_ping(self, time, msg):
+        # Function to add a streamed distance message to the buffer, in the
+        # same form as send_ping
+        distance = {'distance': msg.distance/1000,
+                    'confidence': msg.confidence,
+                    'transmit_duration': msg.transmit_duration,
+                    'ping_number': msg.ping_number,
+                    'scan_start': msg.scan_start,
+                    'scan_length': msg.scan_length,
+                    'gain_setting': msg.gain_setting}
+        with self.stream_ready:
+            if len(self.stream_unread) == self.stream_unread.maxlen:
+                self.stream_counts['overflow'] += 1
+            self.stream_unread.append((time, distance))
+            self.stream_latest = (time, distance)
+            self.stream_counts['pings'] += 1
+            self.stream_ready.notify_all()
+
+    def send_command(self, message_id, *values):
+        # Function to write a Ping message without waiting for a reply, the
+        # values fill the payload fields in order
+        from brping import pingmessage
+        msg = pingmessage.PingMessage(message_id)
+        for name, value in zip(msg.payload_field_names, values):
+            setattr(msg, name, value)
+        msg.pack_msg_data()
+        self.myping.write(msg.msg_data)
+
+    def stream_request(self, message_id, timeout=0.5):
+        # Function to request a message while streaming, returns its payload
+        # values once the reader thread has it or None after timeout seconds
+        from brping import definitions
+        with self.stream_ready:
+            self.stream_replies.pop(message_id, None)
+        self.send_command(definitions.COMMON_GENERAL_REQUEST, message_id)
+        with self.stream_ready:
+            self.stream_ready.wait_for(lambda: message_id in self.stream_replies,
+                                       timeout)
+            return self.stream_replies.get(message_id)
+
+    def get_latest(self):
+        # Function to get the most recent streamed (time, distance), or None
+        if not self.streaming():
+            return
+        with self.stream_ready:
+            return self.stream_latest
+
+    def get_pings(self, timeout=None):
+        # Function to get every streamed (time, distance) since the last call,
+        # waiting up to timeout seconds for one if there are none
+        if not self.streaming():
+            return []
+        with self.stream_ready:
+            if timeout:
+                self.stream_ready.wait_for(lambda: self.stream_unread or
+                                           self.stream_error is not None, timeout)
+            if not self.stream_unread and self.stream_error is not None:
+                raise self.stream_error
+            pings = list(self.stream_unread)
+            self.stream_unread.clear()
+        return pings
         
 #-----------------------------------------------------------------------------
 
+#-----------------------------------------------------------------------------
+def depth_to_string(time, distance, ssp):
+    # Function to turn a timestamped sonar distance dictionary into a raw log line
+    dist = distance['distance']
+    conf = distance['confidence']
+    dura = distance['transmit_duration']
+    star = distance['scan_start']
+    leng = distance['scan_length']
+    gain = distance['gain_setting']
+    
+    ping_string = str(time)+','+'$DEPTH,'+str(dist)+','+\
+        str(conf)+','+str(dura)+','+str(star)+','+str(leng)+','\
+        +str(gain)+','+str(ssp) + '\n'
+    
+    return ping_string
+#-----------------------------------------------------------------------------
+
 #-----------------------------------------------------------------------------
 class Speed:
 # Class to manage all surface sound speed functions
@@ -164,6 +432,7 @@ class Speed:
         
     def connect_speed(self):
         # Function to connect to the surface svp
+        import serial
         try:
             self.svp_ser = serial.Serial(self.svp_com, self.svp_baud, timeout=2.5)
             self.svp_sio = io.TextIOWrapper(io.BufferedRWPair(self.svp_ser, self.svp_ser))
@@ -201,8 +470,14 @@ class Speed:
 
 #-----------------------------------------------------------------------------
 def take_observation(metadata, gnss_device, sonar_device, svp_device, 
-                     current_speed, update_speed, obs_numb, simple_log, raw_log):
-    if update_speed:
+                     current_speed, update_speed, obs_numb, simple_log, raw_log,
+                     console=None, svp_poller=None, timings=None):
+    if timings is not None:
+        cycle_start = perf_counter()
+    if svp_poller is not None:
+        if svp_poller.sonar_speed is not None:
+            current_speed = svp_poller.sonar_speed
+    elif update_speed:
         if obs_numb == 100:
             print('Updating sound speed from sound velocity probe')
             current_speed = svp_device.get_surface_sound_speed()
@@ -212,32 +487,513 @@ def take_observation(metadata, gnss_device, sonar_device, svp_device,
         else:
             obs_numb += 1
      
+    if timings is not None:
+        start = perf_counter()
     time, nmea, ping = gnss_device.get_nmea()
+    if timings is not None:
+        start = timings.lap('get_nmea', start)
         
     nmea_message = str(time) + ',' + str(nmea) + '\n'
     raw_log.write(nmea_message)
+    if timings is not None:
+        start = timings.lap('log_write', start)
     if ping:
+        nmea_time = time
             
-        time, sonar = sonar_device.send_ping()
+        # The poller sets the sound speed from its own thread, the lock keeps
+        # its exchange with the sonar apart from the ping
+        if svp_poller is None:
+            time, sonar = sonar_device.send_ping()
+        else:
+            with svp_poller.lock:
+                time, sonar = sonar_device.send_ping()
+        if timings is not None:
+            start = timings.lap('send_ping', start)
+            timings.add_age(nmea_time, time)
             
         sonar_message = sonar_device.ping_to_string(current_speed)
+        if timings is not None:
+            start = timings.lap('ping_to_string', start)
             
         raw_log.write(sonar_message)
-        nmea_message = nmea_message.split(',')
-        if nmea_message[1] == '$GNGGA':
-            waterline = metadata['Sonar'][2]
-            depth = sonar['distance']+waterline
-            depth = round(depth,3)
-            height = float(nmea_message[10])+float(nmea_message[12])-depth-metadata['GNSS'][2]
-            height = round(height,3)
-            simple_message = str(time)+','+str(nmea.latitude)+','+\
-                str(nmea.longitude)+','+str(depth)+','+\
-                str(height)+','+str(current_speed)+'\n'
-            print(simple_message)
+        if timings is not None:
+            start = timings.lap('log_write', start)
+        simple_message = sounding_to_string(metadata, time, nmea, sonar,
+                                            current_speed)
+        if timings is not None:
+            start = timings.lap('sounding_to_string', start)
+        if simple_message is not None:
+            if console is None:
+                print(simple_message)
+            else:
+                console.print(simple_message)
             simple_log.write(simple_message)
+            if timings is not None:
+                timings.lap('output', start)
+    if timings is not None:
+        timings.lap('cycle', cycle_start)
     return obs_numb, current_speed
 #-----------------------------------------------------------------------------
 
+#-----------------------------------------------------------------------------
+def sounding_to_string(metadata, time, nmea, sonar, current_speed):
+    # Function to georeference a sounding with a GGA message and turn it into
+    # a simple log line, returns None for any other NMEA message
+    nmea_message = str(nmea).split(',')
+    if nmea_message[0] != '$GNGGA':
+        return
+    waterline = metadata['Sonar'][2]
+    depth = sonar['distance']+waterline
+    depth = round(depth,3)
+    height = float(nmea_message[9])+float(nmea_message[11])-depth-metadata['GNSS'][2]
+    height = round(height,3)
+    simple_message = str(time)+','+str(nmea.latitude)+','+\
+        str(nmea.longitude)+','+str(depth)+','+\
+        str(height)+','+str(current_speed)+'\n'
+    return simple_message
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Timings:
+# Class to record how long each stage of the acquisition loop takes, and the
+# age of the GNSS fix each ping is georeferenced with, in fixed size log
+# spaced histograms. Negative values, such as a fix stamped after its ping,
+# have their own bins mirroring the positive ones. Summaries can be appended
+# to a metrics file every interval seconds
+    def __init__(self, metrics_file=None, interval=60.0, low=1e-6, high=100.0,
+                 bins_per_decade=20):
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self.low = low
+        self.bins_per_decade = bins_per_decade
+        self.bins = int(numpy.ceil(numpy.log10(high/low)*bins_per_decade)) + 1
+        self.edges = low*10**(numpy.arange(self.bins + 1)/bins_per_decade)
+        # Value standing for each bin, negative bins first
+        centres = numpy.sqrt(self.edges[:-1]*self.edges[1:])
+        self.centres = numpy.concatenate([-centres[::-1], centres])
+
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def add(self, stage, seconds):
+        # Function to count one duration in seconds against a stage, sizes
+        # below low go in the bin nearest zero and above high in the outermost
+        size = abs(seconds)
+        if size > self.low:
+            index = min(int(math.log10(size/self.low)*self.bins_per_decade),
+                        self.bins - 1)
+        else:
+            index = 0
+        if seconds < 0:
+            index = self.bins - 1 - index
+        else:
+            index = self.bins + index
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = {'counts': [0]*(2*self.bins), 'count': 0, 'sum': 0.0,
+                             'min': seconds, 'max': seconds}
+                self.histograms[stage] = histogram
+            histogram['counts'][index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            if seconds < histogram['min']:
+                histogram['min'] = seconds
+            elif seconds > histogram['max']:
+                histogram['max'] = seconds
+
+    def lap(self, stage, start):
+        # Function to count the time since start against a stage, returns
+        # the current time as the start of the next stage
+        now = perf_counter()
+        self.add(stage, now - start)
+        return now
+
+    def add_age(self, nmea_time, ping_time):
+        # Function to record the lag between an NMEA timestamp and the sonar
+        # timestamp it is paired with
+        self.add('gnss_to_ping_age', time_difference(nmea_time, ping_time))
+
+    def stats(self):
+        # Function to summarise every stage as count, mean, min, max and
+        # percentiles in seconds, percentiles are accurate to the bin width
+        with self.lock:
+            histograms = {stage: dict(histogram, counts=list(histogram['counts']))
+                          for stage, histogram in self.histograms.items()}
+        stats = {}
+        for stage, histogram in histograms.items():
+            summary = {'count': histogram['count'],
+                       'mean': histogram['sum']/histogram['count'],
+                       'min': histogram['min'], 'max': histogram['max']}
+            cumulative = numpy.cumsum(histogram['counts'])
+            for percentile in (50, 90, 99):
+                index = numpy.searchsorted(cumulative,
+                                           percentile/100*histogram['count'])
+                value = self.centres[index]
+                summary[f'p{percentile}'] = float(min(max(value, histogram['min']),
+                                                      histogram['max']))
+            stats[stage] = summary
+        return stats
+
+    def reset(self):
+        # Function to clear every histogram
+        with self.lock:
+            self.histograms = {}
+
+    def start(self):
+        # Function to start the thread writing summaries to the metrics file
+        if self.metrics_file is None:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.metrics_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Function to stop the metrics thread, writing a last summary
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            self.write_metrics()
+
+    def metrics_loop(self):
+        # Thread writing a summary every interval seconds
+        while not self.stopping.wait(self.interval):
+            self.write_metrics()
+
+    def write_metrics(self):
+        # Function to append the running summary of every stage to the
+        # metrics file, one line per stage with times in microseconds
+        time = dt.datetime.utcnow().time()
+        new_file = not os.path.exists(self.metrics_file)
+        with open(self.metrics_file, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(['Time', 'Stage', 'Count', 'Mean_us', 'Min_us',
+                                 'P50_us', 'P90_us', 'P99_us', 'Max_us'])
+            for stage, summary in self.stats().items():
+                writer.writerow([str(time), stage, summary['count']] +
+                                ['%.1f' % (summary[key]*1e6) for key in
+                                 ('mean', 'min', 'p50', 'p90', 'p99', 'max')])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class SVPPoller:
+# Class to read the surface SVP on its own thread, keeping a timestamped
+# series of raw and median smoothed sound speeds. The sonar is only updated
+# when the smoothed speed moves by more than threshold m/s
+    def __init__(self, svp_device, sonar_device=None, interval=10.0, window=5,
+                 threshold=0.5, history=10000, lock=None, callback=None):
+        self.svp_device = svp_device
+        self.sonar_device = sonar_device
+        self.interval = interval
+        self.threshold = threshold
+        self.lock = lock if lock is not None else threading.Lock()
+        self.callback = callback
+
+        self.recent = collections.deque(maxlen=window)
+        self.series = collections.deque(maxlen=history)
+        self.speed = None
+        self.sonar_speed = None
+        self.errors = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # Function to start the polling thread
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.poll_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Function to stop the polling thread
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def poll_loop(self):
+        # Thread reading the SVP every interval seconds
+        while not self.stopping.is_set():
+            self.poll()
+            self.stopping.wait(self.interval)
+
+    def poll(self):
+        # Function to take one SVP reading and update the smoothed speed
+        raw_speed = self.svp_device.get_surface_sound_speed()
+        time = dt.datetime.utcnow().time()
+        if raw_speed is None:
+            self.errors += 1
+            return
+        self.recent.append(raw_speed)
+        self.speed = float(numpy.median(self.recent))
+        self.series.append((time_to_seconds(time), raw_speed, self.speed))
+
+        if self.sonar_speed is not None and \
+                abs(self.speed - self.sonar_speed) < self.threshold:
+            return
+        if self.sonar_device is not None:
+            with self.lock:
+                self.sonar_device.set_sound_speed(self.speed)
+        self.sonar_speed = self.speed
+        if self.callback is not None:
+            self.callback(time, self.speed)
+
+    def get_series(self):
+        # Function to get the sound speed series as a structured array with
+        # times as float seconds after midnight
+        return numpy.array(list(self.series), dtype=[('time','f8'),
+                                                     ('raw','f8'),
+                                                     ('speed','f8')])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Acquisition:
+# Class to run the GNSS, sonar and SVP on their own threads, feeding
+# timestamped records through a bounded queue to a single logging thread
+    def __init__(self, metadata, gnss_device, sonar_device, svp_device,
+                 simple_log, raw_log, current_speed, update_speed,
+                 queue_size=1000, svp_interval=10.0, console=None, grid=None,
+                 timings=None, spike_filter=None, max_gga_age=1.0,
+                 retry_interval=1.0, max_errors=10, flag_log=None):
+        self.metadata = metadata
+        self.gnss_device = gnss_device
+        self.sonar_device = sonar_device
+        self.svp_device = svp_device
+        self.simple_log = simple_log
+        self.raw_log = raw_log
+        self.current_speed = current_speed
+        self.update_speed = update_speed
+        self.svp_interval = svp_interval
+        self.console = console
+        self.grid = grid
+        self.timings = timings
+        self.spike_filter = spike_filter
+        # The spike filter flags of every ping, in raw log order
+        self.flag_log = flag_log
+        # Soundings more than max_gga_age seconds from the last GGA are
+        # logged raw but not georeferenced, None pairs with any age
+        self.max_gga_age = max_gga_age
+        # A sensor thread retries after an exception until max_errors in a row
+        self.retry_interval = retry_interval
+        self.max_errors = max_errors
+
+        self.records = queue.Queue(maxsize=queue_size)
+        self.stopping = threading.Event()
+        self.producers_done = threading.Event()
+        self.sonar_lock = threading.Lock()
+        self.threads = []
+        self.log_thread = None
+        self.svp_poller = None
+        self.last_gga = None
+
+        self.received = {'GNSS': 0, 'Sonar': 0, 'SVP': 0}
+        self.dropped = {'GNSS': 0, 'Sonar': 0, 'SVP': 0}
+        self.errors = {'GNSS': 0, 'Sonar': 0, 'Log': 0}
+        self.failed = []
+        self.stale = 0
+        self.soundings = 0
+
+    def start(self):
+        # Function to start the sensor threads and the logging thread
+        self.stopping.clear()
+        self.producers_done.clear()
+        self.log_thread = threading.Thread(target=self.log_loop, daemon=True)
+        self.log_thread.start()
+        targets = []
+        if getattr(self.gnss_device, 'gps_found', False):
+            targets.append(self.gnss_loop)
+        if getattr(self.sonar_device, 'sonar_found', False):
+            targets.append(self.sonar_loop)
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        if self.update_speed and getattr(self.svp_device, 'svp_found', False):
+            self.svp_poller = SVPPoller(self.svp_device, self.sonar_device,
+                                        interval=self.svp_interval,
+                                        lock=self.sonar_lock,
+                                        callback=self.svp_update)
+            self.svp_poller.start()
+        if self.timings is not None:
+            self.timings.start()
+
+    def stop(self, timeout=5.0):
+        # Function to stop all threads, the logging thread empties the queue
+        # once the sensor threads have finished
+        self.stopping.set()
+        if self.svp_poller is not None:
+            self.svp_poller.stop()
+            self.svp_poller = None
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+        self.producers_done.set()
+        if self.log_thread is not None:
+            self.log_thread.join(timeout)
+            self.log_thread = None
+        if self.timings is not None:
+            self.timings.stop()
+
+    def stats(self):
+        # Function to report queue depth and record counters
+        stats = {}
+        stats['queue_depth'] = self.records.qsize()
+        stats['queue_size'] = self.records.maxsize
+        stats['received'] = dict(self.received)
+        stats['dropped'] = dict(self.dropped)
+        stats['errors'] = dict(self.errors)
+        stats['failed'] = list(self.failed)
+        stats['stale_gga'] = self.stale
+        stats['soundings'] = self.soundings
+        if self.timings is not None:
+            stats['timings'] = self.timings.stats()
+        if self.spike_filter is not None:
+            stats['flags'] = dict(self.spike_filter.counts)
+        return stats
+
+    def put(self, source, record):
+        # Function to queue a record without blocking the sensor thread, the
+        # queueing time is kept when timing so the wait can be measured
+        self.received[source] += 1
+        queued = None if self.timings is None else perf_counter()
+        try:
+            self.records.put_nowait((source, record, queued))
+        except queue.Full:
+            self.dropped[source] += 1
+
+    def sensor_error(self, source, errors):
+        # Function to report an exception on a sensor thread, returns False
+        # once there have been max_errors in a row and the sensor is given up,
+        # otherwise waits retry_interval seconds before the thread carries on
+        self.errors[source] += 1
+        print(source + ' error:')
+        traceback.print_exc()
+        if errors >= self.max_errors:
+            print(source + ' stopped after ' + str(errors) + ' errors in a row')
+            self.failed.append(source)
+            return False
+        self.stopping.wait(self.retry_interval)
+        return True
+
+    def gnss_loop(self):
+        # Thread reading NMEA messages at the receiver's output rate
+        timings = self.timings
+        errors = 0
+        while not self.stopping.is_set():
+            try:
+                if timings is None:
+                    time, nmea, ping = self.gnss_device.get_nmea()
+                else:
+                    start = perf_counter()
+                    time, nmea, ping = self.gnss_device.get_nmea()
+                    timings.lap('get_nmea', start)
+            except Exception:
+                errors += 1
+                if not self.sensor_error('GNSS', errors):
+                    return
+                continue
+            errors = 0
+            self.put('GNSS', (time, nmea))
+
+    def sonar_loop(self):
+        # Thread pinging the sonar as fast as it answers, or taking every ping
+        # as it arrives when the sonar is streaming. A streaming sonar reads
+        # on its own thread so the lock is not needed
+        timings = self.timings
+        streaming = getattr(self.sonar_device, 'streaming', lambda: False)()
+        errors = 0
+        while not self.stopping.is_set():
+            try:
+                if streaming:
+                    pings = self.sonar_device.get_pings(timeout=0.1)
+                else:
+                    with self.sonar_lock:
+                        if timings is None:
+                            pings = [self.sonar_device.send_ping()]
+                        else:
+                            start = perf_counter()
+                            pings = [self.sonar_device.send_ping()]
+                            timings.lap('send_ping', start)
+                pings = [(time, dict(sonar)) for time, sonar in pings]
+            except Exception:
+                errors += 1
+                if not self.sensor_error('Sonar', errors):
+                    return
+                continue
+            errors = 0
+            for ping in pings:
+                self.put('Sonar', ping)
+
+    def svp_update(self, time, speed):
+        # Callback of the SVP poller when it sets a new speed on the sonar
+        self.put('SVP', (time, speed))
+
+    def log_loop(self):
+        # Thread georeferencing soundings and writing both logs
+        timings = self.timings
+        while not self.producers_done.is_set() or not self.records.empty():
+            try:
+                source, record, queued = self.records.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if timings is not None:
+                start = perf_counter()
+                timings.add('queue_wait', start - queued)
+            try:
+                self.log_record(source, record)
+            except Exception:
+                # A bad record is reported and skipped, logging carries on
+                self.errors['Log'] += 1
+                print('Log error:')
+                traceback.print_exc()
+            if timings is not None:
+                timings.lap('log_' + source.lower(), start)
+
+    def log_record(self, source, record):
+        # Function to write one queued record to the logs, soundings are
+        # georeferenced with the last GGA when it is recent enough
+        if source == 'GNSS':
+            time, nmea = record
+            self.raw_log.write(str(time) + ',' + str(nmea) + '\n')
+            if str(nmea).startswith('$GNGGA'):
+                self.last_gga = record
+        elif source == 'Sonar':
+            time, sonar = record
+            self.raw_log.write(depth_to_string(time, sonar, self.current_speed))
+            flags = 0
+            if self.spike_filter is not None:
+                flags = self.spike_filter.flag(sonar)
+                if self.flag_log is not None:
+                    self.flag_log.write(str(time) + ',' + str(flags) + '\n')
+            if self.last_gga is None:
+                return
+            if self.timings is not None:
+                self.timings.add_age(self.last_gga[0], time)
+            if self.max_gga_age is not None and \
+                    abs(time_difference(self.last_gga[0], time)) > self.max_gga_age:
+                self.stale += 1
+                return
+            simple_message = sounding_to_string(self.metadata, time,
+                                                self.last_gga[1], sonar,
+                                                self.current_speed)
+            if simple_message is not None:
+                if self.console is None:
+                    print(simple_message)
+                else:
+                    self.console.print(simple_message)
+                self.simple_log.write(simple_message)
+                self.soundings += 1
+                # Flagged soundings are logged but kept out of the grid
+                if self.grid is not None and not flags:
+                    self.grid.add_simple_line(simple_message)
+        elif source == 'SVP':
+            time, speed = record
+            self.current_speed = speed
+#-----------------------------------------------------------------------------
+
 #########################################
 #########################################
 # Readers
@@ -247,20 +1003,43 @@ def take_observation(metadata, gnss_device, sonar_device, svp_device,
 #-----------------------------------------------------------------------------
 def generic_reader(filename, delimit, start, end):
     # Generic reader used to read all files
-    return_list = []        
-    with open(filename) as file:
+    return_list = list(iter_generic_reader(filename, delimit, start, end))
+    return return_list    
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def iter_generic_reader(filename, delimit, start, end):
+    # Generator version of the generic reader yielding rows as they are read,
+    # block compressed logs are decompressed as they are read and the
+    # segments of a log manifest are read one after another
+    manifest = read_log_manifest(filename)
+    if manifest is not None:
+        for segment in manifest['Segments']:
+            yield from iter_generic_reader(segment['Segment'], delimit, start, end)
+            if end is not None:
+                # Every segment repeats the same header
+                return
+        return
+
+    with open_log(filename) as file:
         csv_reader = csv.reader(file, delimiter=delimit)
         start_found = False
-        for row in csv_reader:
-            if row[0] != start and start_found == False:
-                pass
-            elif row[0] == start:
-                start_found = True                    
-            elif row[0] == end:                    
-                return return_list
-            else:
-                return_list.append(row) 
-    return return_list    
+        try:
+            for row in csv_reader:
+                if not row:
+                    pass
+                elif row[0] != start and start_found == False:
+                    pass
+                elif row[0] == start:
+                    start_found = True                    
+                elif row[0] == end:                    
+                    return
+                else:
+                    yield row
+        except (EOFError, gzip.BadGzipFile):
+            # A compressed log cut off mid block by a crash, everything up to
+            # the last complete block has been read
+            return
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
@@ -290,245 +1069,2552 @@ def read_config_file(filename):
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
-def read_raw_log(filename):
-    # Function to read raw logs using generic reader
+def read_raw_log(filename, start_time=None, end_time=None):
+    # Function to read raw logs using generic reader, optionally only between
+    # two times using the time index sidecar
     if not file_check(filename, '.csv'):
         return
     
     metadata = read_config_file(filename)
-    data_return = generic_reader(filename, ',', 'Header_End', None)
-    data = []
-    
-    for row in data_return:
-        
-        for i in range(len(row)):
-            try:
-                row[i] = float(row[i])
-            except:
-                pass
+    data = list(iter_raw_log(filename, start_time=start_time, end_time=end_time))
+
+    raw_log = {}
+    raw_log['Metadata'] = metadata
+    raw_log['Data'] = data
         
-        data_line = {}
-        if len(row) < 2:
-            pass
-        elif row[1] == '$DEPTH':
-            if len(row) == 9:
-                data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
-                data_line['type'] = row[1]
-                data_line['depth'] = row[2]/1000
-                data_line['confidence'] = row[3]
-                data_line['duration'] = row[4]
-                data_line['start'] = row[5]/1000
-                data_line['length'] = row[6]/1000
-                data_line['gain'] = row[7]
-                data_line['speed'] = row[8]
-                
-                data.append(data_line)
-       
-            
-        elif row[1].endswith('VTG'):
-            if len(row) == 11:
-                data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
-                data_line['type'] = 'VTG'    
-                data_line['tmg_true'] = row[2]    
-                data_line['true'] = row[3]    
-                data_line['tmg_mag'] = row[4]    
-                data_line['mag'] = row[5]    
-                data_line['speed_kt'] = row[6]    
-                data_line['knots'] = row[7]    
-                data_line['speed_km'] = row[8]    
-                data_line['km'] = row[9]    
-                data_line['checksum'] = row[10]    
-                
-                data.append(data_line)
+    return raw_log
+
+
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def iter_raw_log(filename, chunk_size=None, start_time=None, end_time=None):
+    # Generator yielding raw log records one at a time as they are read, or
+    # lists of up to chunk_size records if a chunk size is given
+    if not file_check(filename, '.csv'):
+        return
+
+    start, end = time_range_seconds(start_time, end_time)
+    midnight = dt.datetime(1900, 1, 1)
+    chunk = []
+    for row in iter_raw_log_rows(filename, start_time, end_time):
+        data_line = parse_raw_row(row)
+        if data_line is None:
+            continue
+        if start_time is not None or end_time is not None:
+            seconds = (data_line['time']-midnight).total_seconds()
+            if seconds < start or seconds > end:
+                continue
+        if chunk_size is None:
+            yield data_line
+            continue
+        chunk.append(data_line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+#-----------------------------------------------------------------------------
 
+#-----------------------------------------------------------------------------
+def parse_raw_row(row):
+    # Function to turn a single raw log row into a dictionary, or None if the
+    # row is not a recognised sentence
+    
+    for i in range(len(row)):
+        try:
+            row[i] = float(row[i])
+        except:
+            pass
+    
+    data_line = {}
+    if len(row) < 2:
+        pass
+    elif row[1] == '$DEPTH':
+        if len(row) == 9:
+            data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
+            data_line['type'] = row[1]
+            data_line['depth'] = row[2]
+            data_line['confidence'] = row[3]
+            data_line['duration'] = row[4]
+            data_line['start'] = row[5]/1000
+            data_line['length'] = row[6]/1000
+            data_line['gain'] = row[7]
+            data_line['speed'] = row[8]
             
+            return data_line
+   
+        
+    elif row[1].endswith('VTG'):
+        if len(row) == 11:
+            data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
+            data_line['type'] = 'VTG'    
+            data_line['tmg_true'] = row[2]    
+            data_line['true'] = row[3]    
+            data_line['tmg_mag'] = row[4]    
+            data_line['mag'] = row[5]    
+            data_line['speed_kt'] = row[6]    
+            data_line['knots'] = row[7]    
+            data_line['speed_km'] = row[8]    
+            data_line['km'] = row[9]    
+            data_line['checksum'] = row[10]    
             
-        elif row[1].endswith('RMC'):
-            if len(row) == 15:
-                data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
-                data_line['type'] = 'RMC'    
-                data_line['gps_time'] = row[2]    
-                data_line['status'] = row[3]    
-                data_line['lat'] = row[4]    
-                data_line['lat_hem'] = row[5]    
-                data_line['long'] = row[6]    
-                data_line['long_hem'] = row[7]    
-                data_line['speed_kt'] = row[8]    
-                data_line['tmg_true'] = row[9]    
-                data_line['date'] = row[10]    
-                data_line['mag_var'] = row[11]
-                data_line['checksum'] = row[12] 
-                data.append(data_line)
+            return data_line
 
         
-        elif row[1].endswith('GGA'):
-            if len(row) == 16:
-                data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
-                data_line['type'] = 'GGA'    
-                data_line['utc'] = row[2]    
-                data_line['lat'] = row[3]    
-                data_line['lat_hem'] = row[4]    
-                data_line['long'] = row[5]    
-                data_line['long_hem'] = row[6]    
-                data_line['quality'] = row[7]    
-                data_line['sv_visible'] = row[8]    
-                data_line['hdop'] = row[9]    
-                data_line['ortho_height'] = row[10]    
-                data_line['meters'] = row[11]
-                data_line['geoid_sep'] = row[12]
-                data_line['meters'] = row[13]
-                data_line['gps_age'] = row[14]
-                #data_line['ref_id'] = row[15]
-                data_line['checksum'] = row[15]
-                
-                data.append(data_line)
-            else:
-                pass 
         
-        elif row[1].endswith('GLL'):
-            if len(row) == 9:
-                data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
-                data_line['type'] = 'GLL'    
-                data_line['lat'] = row[2]    
-                data_line['lat_hem'] = row[3]    
-                data_line['long'] = row[4]    
-                data_line['lon_hem'] = row[5]    
-                data_line['utc'] = row[6]    
-                data_line['status'] = row[7]    
-                data_line['checksum'] = row[8]    
-                data.append(data_line)
-            else:
-                pass 
+    elif row[1].endswith('RMC'):
+        if len(row) == 15:
+            data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
+            data_line['type'] = 'RMC'    
+            data_line['gps_time'] = row[2]    
+            data_line['status'] = row[3]    
+            data_line['lat'] = row[4]    
+            data_line['lat_hem'] = row[5]    
+            data_line['long'] = row[6]    
+            data_line['long_hem'] = row[7]    
+            data_line['speed_kt'] = row[8]    
+            data_line['tmg_true'] = row[9]    
+            data_line['date'] = row[10]    
+            data_line['mag_var'] = row[11]
+            data_line['checksum'] = row[12] 
+            return data_line
+
+    
+    elif row[1].endswith('GGA'):
+        if len(row) == 16:
+            data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
+            data_line['type'] = 'GGA'    
+            data_line['utc'] = row[2]    
+            data_line['lat'] = row[3]    
+            data_line['lat_hem'] = row[4]    
+            data_line['long'] = row[5]    
+            data_line['long_hem'] = row[6]    
+            data_line['quality'] = row[7]    
+            data_line['sv_visible'] = row[8]    
+            data_line['hdop'] = row[9]    
+            data_line['ortho_height'] = row[10]    
+            data_line['meters'] = row[11]
+            data_line['geoid_sep'] = row[12]
+            data_line['meters'] = row[13]
+            data_line['gps_age'] = row[14]
+            #data_line['ref_id'] = row[15]
+            data_line['checksum'] = row[15]
             
-        '''
-        elif row[1].endswith('GSV'):
-            if len(row) == 13:
-                data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
-                data_line['type'] = row[1]    
-                data_line[''] = row[2]    
-                data_line[''] = row[3]    
-                data_line[''] = row[4]    
-                data_line[''] = row[5]    
-                data_line[''] = row[6]    
-                data_line[''] = row[7]    
-                data_line[''] = row[8]    
-                data_line[''] = row[9]    
-                data_line[''] = row[10]    
-                data_line[''] = row[11]
-                data_line[''] = row[12] 
-                data.append(data_line)
-            else:
-                pass 
-        '''        
+            return data_line
+        else:
+            pass 
+    
+    elif row[1].endswith('GLL'):
+        if len(row) == 9:
+            data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
+            data_line['type'] = 'GLL'    
+            data_line['lat'] = row[2]    
+            data_line['lat_hem'] = row[3]    
+            data_line['long'] = row[4]    
+            data_line['lon_hem'] = row[5]    
+            data_line['utc'] = row[6]    
+            data_line['status'] = row[7]    
+            data_line['checksum'] = row[8]    
+            return data_line
+        else:
+            pass 
+        
+    '''
+    elif row[1].endswith('GSV'):
+        if len(row) == 13:
+            data_line['time'] = dt.datetime.strptime(row[0], '%H:%M:%S.%f')
+            data_line['type'] = row[1]    
+            data_line[''] = row[2]    
+            data_line[''] = row[3]    
+            data_line[''] = row[4]    
+            data_line[''] = row[5]    
+            data_line[''] = row[6]    
+            data_line[''] = row[7]    
+            data_line[''] = row[8]    
+            data_line[''] = row[9]    
+            data_line[''] = row[10]    
+            data_line[''] = row[11]
+            data_line[''] = row[12] 
+            return data_line
+        else:
+            pass 
+    '''
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Column layout of each sentence type in the raw log as
+# (row length, [(field index, column name, numpy type), ...])
+RAW_LOG_FIELDS = {
+    'DEPTH': (9, [(0,'time','f8'), (2,'depth','f8'), (3,'confidence','f8'),
+                  (4,'duration','f8'), (5,'start','f8'), (6,'length','f8'),
+                  (7,'gain','f8'), (8,'speed','f8')]),
+    'VTG': (11, [(0,'time','f8'), (1,'sentence','S6'),
+                 (2,'tmg_true','f8'), (3,'true','S1'),
+                 (4,'tmg_mag','f8'), (5,'mag','S1'), (6,'speed_kt','f8'),
+                 (7,'knots','S1'), (8,'speed_km','f8'), (9,'km','S1'),
+                 (10,'checksum','S12')]),
+    'RMC': (15, [(0,'time','f8'), (1,'sentence','S6'),
+                 (2,'gps_time','f8'), (3,'status','S1'),
+                 (4,'lat','f8'), (5,'lat_hem','S1'), (6,'long','f8'),
+                 (7,'long_hem','S1'), (8,'speed_kt','f8'), (9,'tmg_true','f8'),
+                 (10,'date','S6'), (11,'mag_var','f8'), (12,'mag_hem','S1'),
+                 (13,'mode','S1'), (14,'checksum','S12')]),
+    'GGA': (16, [(0,'time','f8'), (1,'sentence','S6'),
+                 (2,'utc','f8'), (3,'lat','f8'),
+                 (4,'lat_hem','S1'), (5,'long','f8'), (6,'long_hem','S1'),
+                 (7,'quality','f8'), (8,'sv_visible','f8'), (9,'hdop','f8'),
+                 (10,'ortho_height','f8'), (11,'ortho_units','S1'),
+                 (12,'geoid_sep','f8'), (13,'geoid_units','S1'),
+                 (14,'gps_age','f8'), (15,'checksum','S12')]),
+    'GLL': (9, [(0,'time','f8'), (1,'sentence','S6'),
+                (2,'lat','f8'), (3,'lat_hem','S1'),
+                (4,'long','f8'), (5,'lon_hem','S1'), (6,'utc','f8'),
+                (7,'status','S1'), (8,'checksum','S12')]),
+    }
+
+# Number of rows of one sentence type parsed together before converting
+RAW_LOG_CHUNK = 100000
+
+# Number of bytes of raw log lines read from the file at a time
+RAW_LOG_BLOCK = 1 << 20
+
+# Lines longer than this are not a sentence and are skipped without parsing
+RAW_LINE_MAX = 512
+
+# Every sentence array also has a 'row' field, the position of each record in
+# the order the log was read, so the file order of the sentence types mixed
+# together can be rebuilt
+RAW_LOG_ROW = ('row', 'i8')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_raw_log_columns(filename, start_time=None, end_time=None,
+                         keep_text=False):
+    # Function to read raw logs into one numpy structured array per sentence
+    # type, with times as float seconds after midnight. keep_text adds a text
+    # field holding each line as logged so it can be written back unchanged
+    if not file_check(filename, '.csv'):
+        return
+
+    metadata = read_config_file(filename)
+    chunks = list(iter_raw_log_columns(filename, start_time=start_time,
+                                       end_time=end_time, keep_text=keep_text))
+
+    data = {}
+    for key in RAW_LOG_FIELDS:
+        empty = raw_log_array(key, 0, 'S1' if keep_text else None)
+        data[key] = numpy.concatenate([chunk[key] for chunk in chunks]+[empty])
 
     raw_log = {}
     raw_log['Metadata'] = metadata
     raw_log['Data'] = data
-        
+
     return raw_log
+#-----------------------------------------------------------------------------
 
+#-----------------------------------------------------------------------------
+def iter_raw_log_columns(filename, chunk_size=RAW_LOG_CHUNK, start_time=None,
+                         end_time=None, keep_text=False):
+    # Generator yielding the raw log as dictionaries of structured arrays,
+    # one dictionary per chunk_size body lines
+    if not file_check(filename, '.csv'):
+        return
 
+    row = 0
+    lines = []
+    for block in iter_raw_log_blocks(filename, start_time, end_time):
+        lines.extend(block)
+        while len(lines) >= chunk_size:
+            yield columns_in_range(lines_to_columns(lines[:chunk_size], row,
+                                                    keep_text),
+                                   start_time, end_time)
+            row += chunk_size
+            lines = lines[chunk_size:]
+    if lines:
+        yield columns_in_range(lines_to_columns(lines, row, keep_text),
+                               start_time, end_time)
 #-----------------------------------------------------------------------------
 
-#########################################
-#########################################
-# Writers
-#########################################
-#########################################
+#-----------------------------------------------------------------------------
+def iter_raw_log_rows(filename, start_time=None, end_time=None):
+    # Generator yielding the split body rows of a raw log, only reading the
+    # parts of the file the time index says can hold the time range if one
+    # is given
+    for block in iter_raw_log_blocks(filename, start_time, end_time):
+        lines = [line.decode(errors='replace') for line in block]
+        for row in csv.reader(lines):
+            if row:
+                yield row
+#-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
-def write_meta_header(filename, metadata):
-    # Function to write new files with survey metadata as the header
-    with open(filename, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([metadata['filetype']])
-        writer.writerow(['Header_Start'])
-        writer.writerow(metadata['Survey'])
-        writer.writerow(metadata['Geodetics'])
-        writer.writerow(metadata['Vessel'])
-        writer.writerow(metadata['GNSS'])
-        writer.writerow(metadata['Sonar'])
-        writer.writerow(metadata['SVP'])
-        writer.writerow(metadata['GNSS_Com'])
-        writer.writerow(metadata['Sonar_Com'])
-        writer.writerow(metadata['SVP_Com'])
-        if metadata['filetype'][0] == 'OSP_SIMPLE_LOG':
-            writer.writerow(['Time, Latitude, Longitude, Depth_Below_Water, Height_Ellipsoidal, Soundspeed'])
-        writer.writerow(['Header_End'])
-    print(metadata['filetype'][0]+' file created')    
-        
+def iter_raw_log_blocks(filename, start_time=None, end_time=None):
+    # Generator yielding the body lines of a raw log as lists of bytes, each
+    # about RAW_LOG_BLOCK bytes long, only reading the parts of the file the
+    # time index says can hold the time range if one is given
+    manifest = read_log_manifest(filename)
+    if manifest is not None:
+        for segment in manifest_segments(manifest, start_time, end_time):
+            yield from iter_raw_log_blocks(segment, start_time, end_time)
+        return
+
+    if start_time is None and end_time is None:
+        header_found = False
+        partial = b''
+        for data in iter_log_bytes(filename):
+            block = (partial + data).split(b'\n')
+            partial = block.pop()
+            if not header_found:
+                for i, line in enumerate(block):
+                    if line.rstrip(b'\r') == b'Header_End':
+                        header_found = True
+                        block = block[i+1:]
+                        break
+                else:
+                    partial = b'\n'.join(block + [partial])
+                    continue
+            yield block
+        if header_found and partial:
+            yield [partial]
+        return
+
+    index = read_raw_log_index(filename)
+    if index is None:
+        index = build_raw_log_index(filename)
+    start, end = time_range_seconds(start_time, end_time)
+
+    regions = []
+    for i, entry in enumerate(index['Buckets']):
+        if entry[0] > end or entry[0] + index['Bucket'] <= start:
+            continue
+        if i+1 < len(index['Buckets']):
+            stop = index['Buckets'][i+1][1]
+        else:
+            stop = index['Size']
+        if regions and regions[-1][1] == entry[1]:
+            regions[-1][1] = stop
+        else:
+            regions.append([entry[1], stop])
+
+    # Regions are read as whole lines a block at a time, a block can run a
+    # line past the end of the region so the lines after it are dropped
+    with open_log(filename, 'rb') as file:
+        for offset, stop in regions:
+            file.seek(offset)
+            while offset < stop:
+                try:
+                    block = file.readlines(min(RAW_LOG_BLOCK, stop - offset))
+                except (EOFError, gzip.BadGzipFile):
+                    return
+                if not block:
+                    break
+                ends = numpy.cumsum([len(line) for line in block]) + offset
+                block = block[:numpy.searchsorted(ends, stop) + 1]
+                offset = ends[len(block) - 1]
+                yield block
 #-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
-def write_hsx_body(raw_log):
-    # Function to write the body of a file in the HSX format
-    # UNFINISHED!!!!!!!!!!!!!!!!!!!!!!!!!
-    for obs in raw_log[1]:
-        if obs['type'] == 'GGA':
-            lat = 0
-            long = 0
-            line = 'RAW '+dt.datetime.strftime(obs['time'],
-                          '%H:%M:%S.%f')+' '+str(lat)+' '+str(long)+' '+\
-                          str(obs['ortho_height'])+'\n'
-            print(line)
-            
+def columns_in_range(columns, start_time, end_time):
+    # Function to keep only the rows of each structured array inside a time range
+    if start_time is None and end_time is None:
+        return columns
+    start, end = time_range_seconds(start_time, end_time)
+    for key, array in columns.items():
+        columns[key] = array[(array['time'] >= start) & (array['time'] <= end)]
+    return columns
 #-----------------------------------------------------------------------------
 
-#########################################
-#########################################
-# Miscelaneous applications
-#########################################
-#########################################
+#-----------------------------------------------------------------------------
+def time_range_seconds(start_time, end_time):
+    # Function to turn an optional start and end time into seconds after
+    # midnight, open ends become -inf and inf
+    start = -numpy.inf if start_time is None else time_to_seconds(start_time)
+    end = numpy.inf if end_time is None else time_to_seconds(end_time)
+    return start, end
+#-----------------------------------------------------------------------------
 
 #-----------------------------------------------------------------------------
-def file_check(filename, ending):
-    # Checks if the filename exist and if they end in .csv
-    if filename.endswith(ending):
-        return True
-    else:
-        print('File does not end in ".csv"')
-        return False
-    filexists = os.path.isfile(filename)
-    if not filexists:
-        print('File not found!')
-        return False
+def time_to_seconds(value):
+    # Function to convert a datetime, time, HH:MM:SS string or number of
+    # seconds to seconds after midnight
+    if isinstance(value, dt.datetime):
+        value = value.time()
+    if isinstance(value, dt.time):
+        return value.hour*3600 + value.minute*60 + value.second +\
+            value.microsecond/1000000
+    if isinstance(value, str) and ':' in value:
+        hours, minutes, seconds = value.split(':')
+        return int(hours)*3600 + int(minutes)*60 + float(seconds)
+    return float(value)
 #-----------------------------------------------------------------------------
 
-#-----------------------------------------------------------------------------        
-def compute_horizontal_offsets(logfile_offset, logfile_data):
-    # Function to compute offset from GNSS antenna to sonar for every sounding          ################## Update to take raw file or readable file
-    
-    offset_xy = ((logfile_offset[0])**2)+((logfile_offset[1])**2)
-    sonar_offset_distance = numpy.sqrt(offset_xy)
-            
-    num1 = logfile_offset[0]
-    num2 = logfile_offset[1]
+#-----------------------------------------------------------------------------
+def time_difference(start, end):
+    # Function to get the seconds from one time of day to another, taking the
+    # shorter way round midnight so the result is within +/- 12 hours
+    difference = (time_to_seconds(end) - time_to_seconds(start)) % 86400
+    if difference > 43200:
+        difference -= 86400
+    return difference
+#-----------------------------------------------------------------------------
 
-    if num2 == 0:
-        num2 = 0.0000000000001
+#-----------------------------------------------------------------------------
+def unwrap_days(times):
+    # Function to make seconds after midnight in log order carry on past
+    # midnight, a step back of more than 12 hours adds a day and a step
+    # forward of more than 12 hours takes one away. nan times are kept
+    times = numpy.array(times, dtype=float)
+    known = ~numpy.isnan(times)
+    if not known.any():
+        return times
+    steps = numpy.diff(times[known])
+    days = numpy.cumsum((steps < -43200).astype(int) - (steps > 43200))
+    times[known] += 86400*numpy.concatenate([[0], days])
+    return times
+#-----------------------------------------------------------------------------
 
-    bearing_raw = numpy.rad2deg(numpy.arctan(num1/num2))
+#-----------------------------------------------------------------------------
+def read_raw_log_index(filename):
+    # Function to read the time index sidecar of a raw log, returns None if
+    # there is no index or the log has changed size or modification time
+    # since it was built
+    index_filename = filename + RAW_INDEX_ENDING
+    if not os.path.isfile(index_filename):
+        return
 
-    if num1 >= 0 and num2 >= 0:
-        bearing = bearing_raw
-    elif num1 < 0 and num2 > 0:
-        bearing = 360 + bearing_raw
-    else:
-        bearing = 180 + bearing_raw
-    
-    bearing = numpy.round(bearing, 4)
-    
-    
-    sonar_position_list = []
-    for row in logfile_data:
-        lat = row['Lat']
-        long = row['Long']
-        course = row['Course']
-        
-        course_adjusted = course + bearing
-        if course_adjusted >=360:
-            course_adjusted = course_adjusted - 360
-        
+    with open(index_filename) as file:
+        csv_reader = csv.reader(file)
+        info = next(csv_reader)
+        columns = next(csv_reader)
+        buckets = [[float(row[0]), int(row[1])] + [int(x) for x in row[2:]]
+                   for row in csv_reader if row]
+    # The size on disk and modification time of the log are recorded after
+    # the indexed size, which for compressed logs is of the decompressed text.
+    # Indexes from before they were recorded are rebuilt
+    if len(info) < 5:
+        return
+    stat = os.stat(filename)
+    if int(info[3]) != stat.st_size or int(info[4]) != stat.st_mtime_ns:
+        return
+
+    index = {}
+    index['Bucket'] = float(info[1])
+    index['Size'] = int(info[2])
+    index['Types'] = columns[2:]
+    index['Buckets'] = buckets
+    return index
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_log_manifest(filename):
+    # Function to read the manifest of a rotated log, returns None if the
+    # file is not a manifest. Segment filenames are given from the current
+    # directory rather than the manifest
+    if not is_log_manifest(filename):
+        return
+
+    with open(filename) as file:
+        rows = [row for row in csv.reader(file) if row]
+    directory = os.path.dirname(filename)
+    segments = []
+    for row in rows[2:]:
+        segment = dict(zip(rows[1], row))
+        segment['Segment'] = os.path.join(directory, segment['Segment'])
+        segment['Records'] = int(segment['Records'])
+        segment['Bytes'] = int(segment['Bytes'])
+        segments.append(segment)
+
+    manifest = {}
+    manifest['Filetype'] = rows[0][1]
+    manifest['Segments'] = segments
+    return manifest
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_log_filetype(filename):
+    # Function to get the filetype on the first line of a log, such as
+    # OSP_RAW_LOG, or None if the file does not start with one
+    try:
+        with open_log(filename, 'rb') as file:
+            first = file.readline(100)
+    except (OSError, EOFError):
+        return
+    filetype = first.decode(errors='replace').strip().strip('[]\'"')
+    if not filetype.startswith('OSP_'):
+        return
+    return filetype
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def is_log_manifest(filename):
+    # Function to check if a file is the manifest of a rotated log
+    with open(filename, 'rb') as file:
+        return file.read(len(LOG_MANIFEST_MAGIC)) == LOG_MANIFEST_MAGIC.encode()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def manifest_segments(manifest, start_time=None, end_time=None):
+    # Function to list the segment filenames of a manifest that can hold
+    # records between two times. Segments with no records yet, or that run
+    # past midnight, are always listed
+    start, end = time_range_seconds(start_time, end_time)
+    segments = []
+    for segment in manifest['Segments']:
+        if segment['First_Time'] and segment['Last_Time']:
+            first = time_to_seconds(segment['First_Time'])
+            last = time_to_seconds(segment['Last_Time'])
+            if first <= last and (last < start or first > end):
+                continue
+        segments.append(segment['Segment'])
+    return segments
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def raw_row_type(row):
+    # Function to get the RAW_LOG_FIELDS key of a split raw log row, or None
+    # if it is not a recognised sentence of the expected length
+    if len(row) < 2:
+        return
+    if row[1] == '$DEPTH':
+        key = 'DEPTH'
+    else:
+        key = row[1][-3:]
+    if key not in RAW_LOG_FIELDS or len(row) != RAW_LOG_FIELDS[key][0]:
+        return
+    return key
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def lines_to_columns(lines, first_row=0, keep_text=False):
+    # Function to turn raw log body lines, as bytes, into one structured
+    # array per sentence type. The sentence of every line is found at once on
+    # a fixed width byte array, then each sentence type is parsed in one go.
+    # Lines that are not a recognised sentence are skipped
+    if len(lines) == 0:
+        return {key: raw_log_array(key, 0, 'S1' if keep_text else None)
+                for key in RAW_LOG_FIELDS}
+    lengths = numpy.fromiter(map(len, lines), dtype=numpy.int64, count=len(lines))
+    if (lengths > RAW_LINE_MAX).any():
+        lines = [b'' if len(line) > RAW_LINE_MAX else line for line in lines]
+    text = numpy.array(lines, dtype=bytes)
+    chars = text.view(numpy.uint8).reshape(len(text), -1)
+    commas = chars == ord(',')
+    count = commas.sum(axis=1)
+    blank = (commas[:, 1:] & commas[:, :-1]).any(axis=1)
+    first = numpy.argmax(commas, axis=1)
+    take = numpy.minimum(first[:, None] + numpy.arange(1, 8), chars.shape[1] - 1)
+    sentence = numpy.ascontiguousarray(
+        chars[numpy.arange(len(text))[:, None], take]).view('S7').ravel()
+    sentences, inverse = numpy.unique(sentence, return_inverse=True)
+    inverse = inverse.ravel()
+
+    keys = []
+    for name in sentences.tolist():
+        if name == b'$DEPTH,':
+            keys.append('DEPTH')
+        elif name[:1] == b'$' and name[6:] == b',':
+            keys.append(name[3:6].decode(errors='replace'))
+        else:
+            keys.append(None)
+
+    columns = {}
+    for key, (length, fields) in RAW_LOG_FIELDS.items():
+        selected = numpy.isin(inverse, [i for i, name in enumerate(keys) if name == key])
+        rows = numpy.flatnonzero(selected & (count == length - 1))
+        columns[key] = lines_to_array(key, text[rows], rows + first_row,
+                                      blank[rows].any(), keep_text)
+
+    # Scan window is logged in mm, depth is already in m from Sonar.send_ping
+    columns['DEPTH']['start'] /= 1000
+    columns['DEPTH']['length'] /= 1000
+
+    return columns
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def lines_to_array(key, lines, rows, blank=False, keep_text=False):
+    # Function to parse lines of one sentence type, all with the right number
+    # of fields, with numpy's text reader. Blank or bad numbers become nan,
+    # blank says there are blank fields so numbers are read as text first
+    length, fields = RAW_LOG_FIELDS[key]
+    array = raw_log_array(key, len(lines), lines.dtype if keep_text else None)
+    array['row'] = rows
+    if keep_text:
+        array['text'] = numpy.char.rstrip(lines, b'\r\n')
+    if len(lines) == 0:
+        return array
+
+    usecols = [index for index, name, kind in fields]
+    loaded = None
+    if not blank:
+        try:
+            loaded = numpy.loadtxt(lines, delimiter=',', comments=None, ndmin=1,
+                                   usecols=usecols, dtype=[
+                                       (name, 'S15' if index == 0 else kind)
+                                       for index, name, kind in fields])
+        except ValueError:
+            pass
+    if loaded is None:
+        # Blank or bad numbers, read as text and convert column by column
+        loaded = numpy.loadtxt(lines, delimiter=',', comments=None, ndmin=1,
+                               usecols=usecols, dtype=[
+                                   (name, 'S15' if index == 0 else
+                                    'S32' if kind == 'f8' else kind)
+                                   for index, name, kind in fields])
+    for index, name, kind in fields:
+        if index == 0:
+            array[name] = time_column(loaded[name])
+        elif kind == 'f8' and loaded.dtype[name].kind == 'S':
+            array[name] = float_column(loaded[name])
+        else:
+            array[name] = loaded[name]
+
+    return array
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def raw_log_array(key, size, text=None):
+    # Function to make a structured array for size records of one sentence
+    # type, in the read_raw_log_columns layout, text is the bytes dtype of
+    # the logged line if it is kept
+    dtype = [(name, kind) for _, name, kind in RAW_LOG_FIELDS[key][1]]
+    dtype.append(RAW_LOG_ROW)
+    if text is not None:
+        dtype.append(('text', text))
+    return numpy.zeros(size, dtype=dtype)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def rows_to_array(rows, fields):
+    # Function to turn a list of split raw log rows into a structured array
+    array = numpy.zeros(len(rows), dtype=[(name, kind) for _, name, kind in fields])
+    if not rows:
+        return array
+
+    columns = list(zip(*rows))
+    for index, name, kind in fields:
+        if index == 0:
+            array[name] = time_column(columns[index])
+        elif kind == 'f8':
+            array[name] = float_column(columns[index])
+        else:
+            array[name] = columns[index]
+
+    return array
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def float_column(values):
+    # Function to convert strings to floats, with blank or bad entries as nan
+    column = numpy.asarray(values)
+    if column.dtype.kind not in 'SU':
+        column = numpy.array(values, dtype=str)
+    blank = column.dtype.type()
+    try:
+        return numpy.where(column == blank, column.dtype.type('nan'),
+                           column).astype(numpy.float64)
+    except ValueError:
+        result = numpy.full(len(column), numpy.nan)
+        for i in range(len(column)):
+            try:
+                result[i] = float(column[i])
+            except ValueError:
+                pass
+        return result
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def time_column(values):
+    # Function to convert HH:MM:SS.ffffff strings to seconds after midnight
+    chars = numpy.array(values, dtype='S15').view(numpy.uint8).reshape(-1, 15)
+    digits = chars.astype(numpy.int64) - 48
+    bad = (digits < 0) | (digits > 9)
+    digits[bad] = 0
+
+    seconds = (digits[:,0]*10 + digits[:,1])*3600 +\
+        (digits[:,3]*10 + digits[:,4])*60 + digits[:,6]*10 + digits[:,7]
+    micro = digits[:,9:15] @ numpy.array([100000, 10000, 1000, 100, 10, 1])
+
+    times = seconds + micro/1000000
+    times[(chars[:,2] != ord(':')) | (chars[:,5] != ord(':')) |
+          bad[:, [0, 1, 3, 4, 6, 7]].any(axis=1)] = numpy.nan
+    return times
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def columns_to_raw_log(raw_columns):
+    # Function to build the read_raw_log list of dictionaries from the output
+    # of read_raw_log_columns
+    midnight = dt.datetime(1900, 1, 1)
+    data = []
+    for key, array in raw_columns['Data'].items():
+        names = array.dtype.names
+        sentence = '$DEPTH' if key == 'DEPTH' else key
+        for record in array.tolist():
+            data_line = dict(zip(names, record))
+            for name in names:
+                if isinstance(data_line[name], bytes):
+                    data_line[name] = data_line[name].decode()
+            if math.isnan(data_line['time']):
+                data_line['time'] = None
+            else:
+                data_line['time'] = midnight + dt.timedelta(seconds=data_line['time'])
+            data_line['type'] = sentence
+            data.append(data_line)
+    # File order where the arrays keep it, otherwise time order with records
+    # of unknown time last
+    if all('row' in array.dtype.names for array in raw_columns['Data'].values()):
+        data.sort(key=lambda data_line: data_line.pop('row'))
+    else:
+        data.sort(key=lambda data_line: (data_line['time'] is None,
+                                         data_line['time'] or midnight))
+
+    raw_log = {}
+    raw_log['Metadata'] = raw_columns['Metadata']
+    raw_log['Data'] = data
+
+    return raw_log
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Column layout of the simple log
+SIMPLE_LOG_FIELDS = [('time','f8'), ('lat','f8'), ('long','f8'), ('depth','f8'),
+                     ('height','f8'), ('speed','f8')]
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_simple_log_columns(filename):
+    # Function to read a simple log into a numpy structured array in the
+    # SIMPLE_LOG_FIELDS layout, with times as float seconds after midnight
+    if not file_check(filename, '.csv'):
+        return
+
+    metadata = read_config_file(filename)
+    rows = [row for row in iter_generic_reader(filename, ',', 'Header_End', None)
+            if len(row) == len(SIMPLE_LOG_FIELDS)]
+    data = rows_to_array(rows, [(i, name, kind) for i, (name, kind) in
+                                enumerate(SIMPLE_LOG_FIELDS)])
+
+    simple_log = {}
+    simple_log['Metadata'] = metadata
+    simple_log['Data'] = data
+
+    return simple_log
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def raw_log_to_columns(raw_log):
+    # Function to build the read_raw_log_columns layout from the read_raw_log
+    # list of dictionaries, fields read_raw_log does not keep are left blank
+    midnight = dt.datetime(1900, 1, 1)
+    data = {}
+    for key, (length, fields) in RAW_LOG_FIELDS.items():
+        sentence = '$DEPTH' if key == 'DEPTH' else key
+        rows = [i for i, data_line in enumerate(raw_log['Data'])
+                if data_line['type'] == sentence]
+        records = [raw_log['Data'][i] for i in rows]
+        array = raw_log_array(key, len(records))
+        array['row'] = rows
+        for index, name, kind in fields:
+            if index == 0:
+                array[name] = [(data_line['time']-midnight).total_seconds()
+                               for data_line in records]
+            elif records and name in records[0]:
+                values = [str(data_line[name]) for data_line in records]
+                if kind == 'f8':
+                    array[name] = float_column(values)
+                else:
+                    array[name] = values
+        data[key] = array
+
+    raw_columns = {}
+    raw_columns['Metadata'] = raw_log['Metadata']
+    raw_columns['Data'] = data
+
+    return raw_columns
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_raw_binary(filename):
+    # Function to open a binary raw log, the arrays are memory mapped from
+    # the file rather than read, in the same layout as read_raw_log_columns
+    if not file_check(filename, RAW_BINARY_ENDING):
+        return
+
+    with open(filename, 'rb') as file:
+        if file.read(len(RAW_BINARY_MAGIC)) != RAW_BINARY_MAGIC:
+            print('File is not an Open Sonar binary raw log!')
+            return
+        header_length = struct.unpack('<Q', file.read(8))[0]
+        header = json.loads(file.read(header_length).decode())
+    data_start = len(RAW_BINARY_MAGIC) + 8 + header_length
+
+    data = {}
+    for key, section in header['Sections'].items():
+        dtype = numpy.dtype([tuple(field) for field in section['dtype']])
+        if section['count'] == 0:
+            data[key] = numpy.zeros(0, dtype=dtype)
+        else:
+            data[key] = numpy.memmap(filename, dtype=dtype, mode='r',
+                                     offset=data_start+section['offset'],
+                                     shape=(section['count'],))
+
+    raw_log = {}
+    raw_log['Metadata'] = header['Metadata']
+    raw_log['Data'] = data
+
+    return raw_log
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class RawLogFollower:
+# Class to read a raw log that is still being written. The file offset and
+# any unfinished last line are kept between calls so each call only parses
+# the bytes appended since the last one
+    def __init__(self, filename):
+        self.filename = filename
+        self.metadata = None
+        self.offset = 0
+        self.partial = b''
+        self.header_found = False
+        self.decompressor = None
+        self.arrays = None
+        self.counts = None
+        self.rows_read = 0
+
+    def reset(self):
+        # Function to start again from the beginning of the file
+        self.metadata = None
+        self.offset = 0
+        self.partial = b''
+        self.header_found = False
+        self.decompressor = None
+        self.arrays = None
+        self.counts = None
+        self.rows_read = 0
+
+    def read_lines(self):
+        # Function to get the body lines, as bytes, appended since the last
+        # call, a shorter file than last time is taken as a new log
+        if not file_check(self.filename, '.csv'):
+            return []
+        if os.path.getsize(self.filename) < self.offset:
+            self.reset()
+        with open(self.filename, 'rb') as file:
+            file.seek(self.offset)
+            block = file.read()
+        if self.offset == 0 and block.startswith(COMPRESSED_LOG_MAGIC):
+            self.decompressor = zlib.decompressobj(31)
+        self.offset += len(block)
+        if self.decompressor is not None:
+            block = self.decompress(block)
+        lines = (self.partial + block).split(b'\n')
+        self.partial = lines.pop()
+        if not self.header_found:
+            for i, line in enumerate(lines):
+                if line.rstrip(b'\r') == b'Header_End':
+                    self.header_found = True
+                    self.metadata = read_config_file(self.filename)
+                    lines = lines[i+1:]
+                    break
+            else:
+                # Keep the header until Header_End has been written
+                self.partial = b'\n'.join(lines + [self.partial])
+                return []
+        lines = [line for line in lines if line.strip()]
+        self.rows_read += len(lines)
+        return lines
+
+    def read_rows(self):
+        # Function to get the split body rows appended since the last call
+        text = b'\n'.join(self.read_lines()).decode()
+        return [row for row in csv.reader(io.StringIO(text)) if row]
+
+    def decompress(self, data):
+        # Function to decompress the bytes of a block compressed log read
+        # since the last call, starting a new decompressor at each block
+        text = []
+        while data:
+            text.append(self.decompressor.decompress(data))
+            if not self.decompressor.eof:
+                break
+            data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(31)
+        return b''.join(text)
+
+    def read(self):
+        # Function to get the records appended since the last call in the
+        # form of read_raw_log data
+        records = []
+        for row in self.read_rows():
+            data_line = parse_raw_row(row)
+            if data_line is not None:
+                records.append(data_line)
+        return records
+
+    def read_columns(self):
+        # Function to get the records appended since the last call as one
+        # structured array per sentence type, as read_raw_log_columns data
+        first_row = self.rows_read
+        return lines_to_columns(self.read_lines(), first_row)
+
+    def update(self, raw_columns=None):
+        # Function to add the newly appended records to a columnar raw log.
+        # Without one the follower keeps its own, in arrays that grow by
+        # doubling so the cost of a call follows the new data only, and
+        # returns views of the rows read so far
+        new = self.read_columns()
+        if raw_columns is not None:
+            raw_columns['Metadata'] = self.metadata
+            for key in RAW_LOG_FIELDS:
+                raw_columns['Data'][key] = numpy.concatenate(
+                    [raw_columns['Data'][key], new[key]])
+            return raw_columns
+
+        if self.arrays is None:
+            self.arrays = {key: new[key][:0] for key in RAW_LOG_FIELDS}
+            self.counts = {key: 0 for key in RAW_LOG_FIELDS}
+        data = {}
+        for key in RAW_LOG_FIELDS:
+            count = self.counts[key] + len(new[key])
+            if count > len(self.arrays[key]):
+                grown = numpy.empty(max(2*count, 1024),
+                                    dtype=new[key].dtype)
+                grown[:self.counts[key]] = self.arrays[key][:self.counts[key]]
+                self.arrays[key] = grown
+            self.arrays[key][self.counts[key]:count] = new[key]
+            self.counts[key] = count
+            data[key] = self.arrays[key][:count]
+
+        raw_log = {}
+        raw_log['Metadata'] = self.metadata
+        raw_log['Data'] = data
+
+        return raw_log
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Writers
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+def write_meta_header(filename, metadata, compress=False):
+    # Function to write new files with survey metadata as the header, as the
+    # first block of a block compressed log if compress is set
+    with open_log(filename, 'w', compress) as file:
+        writer = csv.writer(file)
+        writer.writerow([metadata['filetype']])
+        writer.writerow(['Header_Start'])
+        writer.writerow(metadata['Survey'])
+        writer.writerow(metadata['Geodetics'])
+        writer.writerow(metadata['Vessel'])
+        writer.writerow(metadata['GNSS'])
+        writer.writerow(metadata['Sonar'])
+        writer.writerow(metadata['SVP'])
+        writer.writerow(metadata['GNSS_Com'])
+        writer.writerow(metadata['Sonar_Com'])
+        writer.writerow(metadata['SVP_Com'])
+        if metadata['filetype'][0] == 'OSP_SIMPLE_LOG':
+            writer.writerow(['Time, Latitude, Longitude, Depth_Below_Water, Height_Ellipsoidal, Soundspeed'])
+        elif metadata['filetype'][0] == 'OSP_FLAG_LOG':
+            writer.writerow(['Time, Flags'])
+        writer.writerow(['Header_End'])
+    print(metadata['filetype'][0]+' file created')    
+        
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Block compressed logs are a series of independently gzip compressed blocks
+# of about COMPRESSED_BLOCK_SIZE bytes of log text, which together make one
+# multi-member gzip file. They keep the .csv ending and are recognised by
+# the gzip magic at the start of the file
+COMPRESSED_LOG_MAGIC = b'\x1f\x8b'
+COMPRESSED_BLOCK_SIZE = 65536
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class BlockCompressedLog:
+# Class to write a log as gzip compressed blocks. Text is held in memory
+# until a block is full, so a crash loses at most the block being filled,
+# and flush only flushes the blocks already written
+    def __init__(self, filename, mode='a', block_size=COMPRESSED_BLOCK_SIZE,
+                 level=6):
+        self.file = open(filename, mode + 'b')
+        self.block_size = block_size
+        self.level = level
+        self.pending = []
+        self.pending_size = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def write(self, text):
+        # Function to add text to the block being filled
+        data = text.encode()
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= self.block_size:
+            self.write_block()
+        return len(text)
+
+    def write_block(self):
+        # Function to compress and write the block being filled
+        if not self.pending:
+            return
+        data = b''.join(self.pending)
+        block = gzip.compress(data, self.level, mtime=0)
+        self.file.write(block)
+        self.pending = []
+        self.pending_size = 0
+        self.bytes_in += len(data)
+        self.bytes_out += len(block)
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        # Function to write the last, partly filled, block and close the file
+        self.write_block()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def open_log(filename, mode='r', compress=False):
+    # Function to open a log. Logs opened to read, in text ('r') or binary
+    # ('rb'), are decompressed if they are block compressed. Logs opened to
+    # write ('w') or append ('a') are block compressed if compress is set
+    if mode.startswith('r'):
+        if is_compressed_log(filename):
+            return gzip.open(filename, mode if 'b' in mode else 'rt')
+        return open(filename, mode)
+    if compress:
+        return BlockCompressedLog(filename, mode)
+    return open(filename, mode, newline='')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def iter_log_bytes(filename, size=RAW_LOG_BLOCK):
+    # Generator yielding the contents of a log in pieces of about size bytes,
+    # decompressing block compressed logs. A compressed log cut off by a
+    # crash ends with as much of its last block as can be decompressed
+    with open(filename, 'rb') as file:
+        decompressor = None
+        if file.read(len(COMPRESSED_LOG_MAGIC)) == COMPRESSED_LOG_MAGIC:
+            decompressor = zlib.decompressobj(31)
+        file.seek(0)
+        while True:
+            data = file.read(size)
+            if not data:
+                return
+            if decompressor is None:
+                yield data
+                continue
+            pieces = []
+            try:
+                while data:
+                    pieces.append(decompressor.decompress(data))
+                    if not decompressor.eof:
+                        break
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(31)
+            except zlib.error:
+                yield b''.join(pieces)
+                return
+            yield b''.join(pieces)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def is_compressed_log(filename):
+    # Function to check if a log is block compressed
+    with open(filename, 'rb') as file:
+        return file.read(len(COMPRESSED_LOG_MAGIC)) == COMPRESSED_LOG_MAGIC
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# The time index sidecar of a raw log lists, in file order, the start of
+# each time bucket, its byte offset in the log and its sentence counts
+RAW_INDEX_ENDING = '.idx'
+RAW_INDEX_BUCKET = 60
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def build_raw_log_index(filename, bucket=RAW_INDEX_BUCKET):
+    # Function to scan a raw log once and write its time index sidecar
+    if not file_check(filename, '.csv'):
+        return
+
+    # The log is checked before scanning so a change while scanning leaves an
+    # index that does not match the log
+    stat = os.stat(filename)
+    buckets = []
+    current = None
+    with open_log(filename, 'rb') as file:
+        offset = 0
+        for line in file:
+            offset += len(line)
+            if line.startswith(b'Header_End'):
+                break
+        try:
+            for line in file:
+                try:
+                    seconds = int(line[0:2])*3600 + int(line[3:5])*60 + int(line[6:8])
+                except ValueError:
+                    offset += len(line)
+                    continue
+                start = seconds - seconds % bucket
+                if start != current:
+                    current = start
+                    buckets.append([start, offset] + [0]*len(RAW_LOG_FIELDS))
+                key = raw_row_type(line.decode(errors='replace').rstrip('\r\n').split(','))
+                if key is not None:
+                    buckets[-1][2 + list(RAW_LOG_FIELDS).index(key)] += 1
+                offset += len(line)
+        except (EOFError, gzip.BadGzipFile):
+            pass
+
+    info = ['OSP_RAW_INDEX', bucket, offset, stat.st_size, stat.st_mtime_ns]
+    with open(filename + RAW_INDEX_ENDING, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(info)
+        writer.writerow(['Bucket_Start', 'Offset'] + list(RAW_LOG_FIELDS))
+        writer.writerows(buckets)
+
+    index = {}
+    index['Bucket'] = float(bucket)
+    index['Size'] = offset
+    index['Types'] = list(RAW_LOG_FIELDS)
+    index['Buckets'] = buckets
+    return index
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# Binary raw logs start with RAW_BINARY_MAGIC, the length of a JSON header
+# holding the metadata and the offset, count and dtype of each sentence type,
+# then one block of fixed width records per sentence type
+RAW_BINARY_MAGIC = b'OSPRAWB1'
+RAW_BINARY_ENDING = '.osb'
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_raw_binary(filename, raw_columns):
+    # Function to write the output of read_raw_log_columns as a binary raw log
+    sections = {}
+    blocks = []
+    offset = 0
+    for key, array in raw_columns['Data'].items():
+        array = numpy.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        block = array.tobytes()
+        block += bytes(-len(block) % 8)
+        sections[key] = {'offset': offset, 'count': len(array),
+                         'dtype': [[name, array.dtype[name].str]
+                                   for name in array.dtype.names]}
+        blocks.append(block)
+        offset += len(block)
+
+    header = json.dumps({'Metadata': raw_columns['Metadata'],
+                         'Sections': sections}).encode()
+    header += b' '*(-len(header) % 8)
+
+    with open(filename, 'wb') as file:
+        file.write(RAW_BINARY_MAGIC)
+        file.write(struct.pack('<Q', len(header)))
+        file.write(header)
+        for block in blocks:
+            file.write(block)
+    print('OSP_RAW_BINARY file created')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_raw_log_columns(filename, raw_columns, compress=False):
+    # Function to write the output of read_raw_log_columns as a csv raw log,
+    # in the order the lines were read if the arrays have a row field and
+    # otherwise in time order
+    metadata = dict(raw_columns['Metadata'])
+    metadata['filetype'] = ['OSP_RAW_LOG']
+    write_meta_header(filename, metadata, compress)
+
+    arrays = raw_columns['Data']
+    field = 'row'
+    if not all('row' in array.dtype.names for array in arrays.values()):
+        field = 'time'
+    keys = []
+    lines = []
+    for key, array in arrays.items():
+        keys.append(numpy.asarray(array[field]))
+        lines.extend(columns_to_lines(key, array))
+    order = numpy.argsort(numpy.concatenate(keys+[numpy.zeros(0)]), kind='stable')
+
+    with open_log(filename, 'a', compress) as file:
+        for i in order:
+            file.write(lines[i])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def columns_to_lines(key, array):
+    # Function to turn one structured array of read_raw_log_columns back into
+    # raw log lines, the logged text is used as it is when it was kept
+    if 'text' in array.dtype.names:
+        return [line.decode(errors='replace') + '\n'
+                for line in array['text'].tolist()]
+    columns = []
+    for index, name, kind in RAW_LOG_FIELDS[key][1]:
+        values = numpy.asarray(array[name])
+        if index == 0:
+            columns.append(format_time_column(values))
+            if key == 'DEPTH':
+                columns.append(['$DEPTH']*len(values))
+            continue
+        if kind == 'f8':
+            if key == 'DEPTH' and name in ('start', 'length'):
+                values = values*1000
+            text = values.astype(str)
+            text[numpy.isnan(values)] = ''
+            values = text
+        columns.append(values.astype(str).tolist())
+
+    lines = [','.join(row)+'\n' for row in zip(*columns)]
+    return lines
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_simple_log_columns(filename, metadata, soundings, compress=False):
+    # Function to write an array in the SIMPLE_LOG_FIELDS layout as a simple log
+    metadata = dict(metadata)
+    metadata['filetype'] = ['OSP_SIMPLE_LOG']
+    write_meta_header(filename, metadata, compress)
+
+    times = format_time_column(soundings['time'])
+    with open_log(filename, 'a', compress) as file:
+        file.write(''.join(['%s,%.9f,%.9f,%.3f,%.3f,%s\n' % row for row in
+                            zip(times, soundings['lat'].tolist(),
+                                soundings['long'].tolist(),
+                                soundings['depth'].tolist(),
+                                soundings['height'].tolist(),
+                                soundings['speed'].tolist())]))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def format_time_column(times):
+    # Function to convert seconds after midnight to HH:MM:SS.ffffff strings
+    micro = numpy.round(numpy.nan_to_num(times)*1000000).astype(numpy.int64)
+    hours, micro = numpy.divmod(micro, 3600000000)
+    minutes, micro = numpy.divmod(micro, 60000000)
+    seconds, micro = numpy.divmod(micro, 1000000)
+    return ['%02d:%02d:%02d.%06d' % time for time in
+            zip(hours.tolist(), minutes.tolist(), seconds.tolist(), micro.tolist())]
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def raw_log_to_binary(filename, binary_filename):
+    # Function to convert a csv raw log to a binary raw log, keeping the text
+    # of every line so binary_to_raw_log gives back the same sentences
+    raw_columns = read_raw_log_columns(filename, keep_text=True)
+    if raw_columns is None:
+        return
+    write_raw_binary(binary_filename, raw_columns)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def binary_to_raw_log(binary_filename, filename):
+    # Function to convert a binary raw log back to a csv raw log
+    raw_columns = read_raw_binary(binary_filename)
+    if raw_columns is None:
+        return
+    write_raw_log_columns(filename, raw_columns)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class LogWriter:
+# Class to collect log lines in memory and write them to an open file from a
+# background thread, so callers never wait on the disk. An exception on the
+# thread stops the writing and is raised by the next write, flush or close
+    def __init__(self, file, flush_lines=1000, flush_interval=1.0,
+                 fsync_interval=5.0):
+        self.file = file
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+
+        self.pending = []
+        self.pending_ready = threading.Condition()
+        self.closing = False
+        self.flushing = False
+        self.error = None
+        self.last_fsync = dt.datetime.utcnow()
+        self.lines_queued = 0
+        self.lines_written = 0
+        self.flushes = 0
+
+        self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+
+    def write(self, line):
+        # Function to queue a line for writing
+        with self.pending_ready:
+            self.check_error()
+            self.pending.append(line)
+            self.lines_queued += 1
+            if len(self.pending) >= self.flush_lines:
+                self.pending_ready.notify_all()
+
+    def flush(self):
+        # Function to wait until every line queued so far has been written
+        with self.pending_ready:
+            queued = self.lines_queued
+            self.flushing = True
+            self.pending_ready.notify_all()
+            self.pending_ready.wait_for(lambda: self.lines_written >= queued or
+                                        self.error is not None)
+            self.check_error()
+
+    def check_error(self):
+        # Function to raise the exception that stopped the writing thread
+        if self.error is not None:
+            raise self.error
+
+    def flush_loop(self):
+        # Thread writing queued lines once flush_lines have built up, every
+        # flush_interval seconds or when asked to by flush
+        while True:
+            with self.pending_ready:
+                if not self.closing and not self.flushing and \
+                        len(self.pending) < self.flush_lines:
+                    self.pending_ready.wait(self.flush_interval)
+                lines = self.pending
+                self.pending = []
+                self.flushing = False
+                closing = self.closing
+            try:
+                if lines:
+                    self.write_lines(lines)
+            except Exception as error:
+                with self.pending_ready:
+                    self.error = error
+                    self.pending_ready.notify_all()
+                return
+            with self.pending_ready:
+                self.lines_written += len(lines)
+                self.pending_ready.notify_all()
+            if closing:
+                return
+
+    def write_lines(self, lines):
+        # Function to write a batch of lines, syncing to disk every
+        # fsync_interval seconds
+        self.file.write(''.join(lines))
+        self.file.flush()
+        self.flushes += 1
+        now = dt.datetime.utcnow()
+        if (now - self.last_fsync).total_seconds() >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.last_fsync = now
+
+    def close(self):
+        # Function to write everything still queued, sync and close the file
+        with self.pending_ready:
+            self.closing = True
+            self.pending_ready.notify_all()
+        self.thread.join()
+        if self.error is None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.check_error()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# The manifest of a rotated log starts with LOG_MANIFEST_MAGIC and the log
+# filetype, then lists each segment with when it was opened and closed, the
+# times of its first and last records, its record count and its size in
+# bytes of log text. Segments are named after the manifest
+LOG_MANIFEST_MAGIC = 'OSP_LOG_MANIFEST'
+LOG_MANIFEST_FIELDS = ['Segment', 'Opened', 'Closed', 'First_Time', 'Last_Time',
+                       'Records', 'Bytes']
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class RotatingLog:
+# Class to write a log as a series of segments, each starting with the
+# metadata header, rolling over to a new segment once the current one has
+# been open max_seconds or holds max_bytes of log text. The manifest at
+# filename is rewritten whenever a segment opens or closes, so readers can
+# open the whole session through it as one log and a closed segment can be
+# processed straight away, on_close is called with each closed segment
+    def __init__(self, filename, metadata, max_seconds=None, max_bytes=None,
+                 compress=False, on_close=None):
+        self.filename = filename
+        self.metadata = metadata
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.on_close = on_close
+        self.segments = []
+        self.partial = ''
+        self.file = None
+        self.opened = None
+        self.open_segment()
+
+    def open_segment(self):
+        # Function to start the next segment with the metadata header
+        root = os.path.splitext(self.filename)[0]
+        segment = '%s_%04d.csv' % (root, len(self.segments)+1)
+        write_meta_header(segment, self.metadata, self.compress)
+        self.file = open_log(segment, 'a', self.compress)
+        self.opened = dt.datetime.utcnow()
+        self.segments.append({'Segment': segment, 'Opened': self.opened.isoformat(),
+                              'Closed': '', 'First_Time': '', 'Last_Time': '',
+                              'Records': 0, 'Bytes': 0})
+        self.write_manifest()
+
+    def close_segment(self):
+        # Function to sync and close the current segment
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        segment = self.segments[-1]
+        segment['Closed'] = dt.datetime.utcnow().isoformat()
+        self.write_manifest()
+        if self.on_close is not None:
+            self.on_close(segment['Segment'])
+
+    def rollover_due(self, size):
+        # Function to check if the next line of size bytes belongs in a new
+        # segment, a segment always gets at least one line
+        segment = self.segments[-1]
+        if segment['Records'] == 0:
+            return False
+        if self.max_bytes is not None and segment['Bytes'] + size > self.max_bytes:
+            return True
+        if self.max_seconds is not None and \
+                (dt.datetime.utcnow() - self.opened).total_seconds() >= self.max_seconds:
+            return True
+        return False
+
+    def write(self, text):
+        # Function to write log text, segments only roll over between lines
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            line += '\n'
+            if self.rollover_due(len(line)):
+                self.close_segment()
+                self.open_segment()
+            self.file.write(line)
+            segment = self.segments[-1]
+            time = line.split(',', 1)[0]
+            if not segment['First_Time']:
+                segment['First_Time'] = time
+            segment['Last_Time'] = time
+            segment['Records'] += 1
+            segment['Bytes'] += len(line)
+        return len(text)
+
+    def write_manifest(self):
+        # Function to replace the manifest, writing a new file first so
+        # readers never see a partly written one
+        directory = os.path.dirname(self.filename)
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow([LOG_MANIFEST_MAGIC, self.metadata['filetype'][0]])
+            writer.writerow(LOG_MANIFEST_FIELDS)
+            for segment in self.segments:
+                row = dict(segment)
+                row['Segment'] = os.path.relpath(segment['Segment'], directory or '.')
+                writer.writerow([row[name] for name in LOG_MANIFEST_FIELDS])
+        os.replace(temporary, self.filename)
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        # Function to write any unfinished last line and close the segment,
+        # closing again does nothing
+        if self.file is None:
+            return
+        if self.partial:
+            self.write('\n')
+        self.close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Console:
+# Class to throttle console output to at most one message per interval,
+# messages in between are counted but not printed
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.last_print = None
+        self.skipped = 0
+
+    def print(self, message):
+        # Function to print a message if the interval has passed
+        now = dt.datetime.utcnow()
+        if self.last_print is not None and \
+                (now - self.last_print).total_seconds() < self.interval:
+            self.skipped += 1
+            return
+        self.last_print = now
+        print(message)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_hsx(filename, raw_log):
+    # Function to write a raw log to a HYPACK HSX file, takes the output of
+    # read_raw_log, read_raw_log_columns or read_raw_binary
+    with open(filename, 'w', newline='') as file:
+        write_hsx_header(file, raw_log['Metadata'])
+        write_hsx_body(raw_log, file)
+        file.write('EOL\n')
+    print('HSX file created')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def raw_log_to_hsx(filename, hsx_filename, chunk_size=RAW_LOG_CHUNK):
+    # Function to convert a csv raw log to HSX one chunk at a time, so the
+    # whole log is never held in memory
+    if not file_check(filename, '.csv'):
+        return
+    metadata = read_config_file(filename)
+    with open(hsx_filename, 'w', newline='') as file:
+        write_hsx_header(file, metadata)
+        for chunk in iter_raw_log_columns(filename, chunk_size):
+            write_hsx_body({'Metadata': metadata, 'Data': chunk}, file)
+        file.write('EOL\n')
+    print('HSX file created')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_hsx_header(file, metadata):
+    # Function to write the HSX header from the survey metadata
+    now = dt.datetime.utcnow()
+    gnss = metadata['GNSS']
+    sonar = metadata['Sonar']
+    lines = ['FTP NEW 2',
+             'HSX 9',
+             'VER 5.0',
+             f'INF "{metadata["Survey"][2]}" "{metadata["Vessel"][0]}" '
+             f'"{metadata["Survey"][0]}" "{metadata["Survey"][1]}" 0.00 0.00 0.00',
+             f'ELL WGS-84 {WGS84_A:.3f} {1/WGS84_F:.9f}',
+             'TND '+now.strftime('%H:%M:%S %m/%d/%y'),
+             'DEV 0 4 "'+gnss[0]+' '+gnss[1]+'"',
+             'DEV 1 32 "'+sonar[0]+' '+sonar[1]+'"',
+             f'OF2 0 0 {gnss[3]:.2f} {gnss[4]:.2f} {gnss[2]:.2f} 0.00 0.00 0.00 0.00',
+             f'OF2 1 0 {sonar[3]:.2f} {sonar[4]:.2f} {-sonar[2]:.2f} 0.00 0.00 0.00 0.00',
+             'EOH']
+    file.write('\n'.join(lines)+'\n')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_hsx_body(raw_log, file):
+    # Function to write the body of a file in the HSX format, GGA fixes as
+    # RAW records of device 0 and soundings as EC1 records of device 1. RAW
+    # positions are in HYPACK's signed ddmmss.sssss layout
+    data = raw_log['Data']
+    if isinstance(data, list):
+        data = raw_log_to_columns(raw_log)['Data']
+    gga = data['GGA']
+    depth = data['DEPTH']
+
+    lat = nmea_to_dd_array(gga['lat'], gga['lat_hem'])
+    long = nmea_to_dd_array(gga['long'], gga['long_hem'])
+    fixed = ~(numpy.isnan(gga['time']) | numpy.isnan(lat) | numpy.isnan(long))
+    gga, lat, long = gga[fixed], lat[fixed], long[fixed]
+    positions = []
+    for dd in (lat, long):
+        # Rounded to the written 10 microseconds first so seconds carry
+        seconds = numpy.round(numpy.abs(dd)*360000000).astype(numpy.int64)
+        degrees, seconds = numpy.divmod(seconds, 360000000)
+        minutes, seconds = numpy.divmod(seconds, 6000000)
+        positions.append(numpy.copysign(degrees*10000 + minutes*100 +
+                                        seconds/100000, dd))
+
+    raw = numpy.column_stack([gga['time'], positions[0], positions[1],
+                              gga['ortho_height'], gga['utc']])
+    raw_lines = (('RAW 0 %.3f 4 %.5f %.5f %.3f %.2f\n'*len(raw)) %
+                 tuple(raw.ravel().tolist())).splitlines(True)
+    ec1 = numpy.column_stack([depth['time'], depth['depth']])
+    depth_lines = (('EC1 1 %.3f %.3f\n'*len(ec1)) %
+                   tuple(ec1.ravel().tolist())).splitlines(True)
+
+    times = numpy.concatenate([gga['time'], depth['time']])
+    lines = raw_lines + depth_lines
+    file.write(''.join([lines[i] for i in numpy.argsort(times, kind='stable')]))
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Offline Processing
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+def process_survey(source, output_dir, worker=None, processes=None):
+    # Function to process every raw log in a directory or matching a glob
+    # pattern, one file per worker process. Output names follow the input
+    # names and a failure in one file does not stop the others
+    import concurrent.futures
+    if worker is None:
+        worker = process_raw_log
+    filenames = find_raw_logs(source)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Outputs keep the paths of the logs below the directory they share, so
+    # logs of the same name in different directories do not overwrite
+    if filenames:
+        base = os.path.commonpath([os.path.dirname(os.path.abspath(filename))
+                                   for filename in filenames])
+    directories = []
+    for filename in filenames:
+        directory = os.path.normpath(os.path.join(output_dir, os.path.relpath(
+            os.path.dirname(os.path.abspath(filename)), base)))
+        os.makedirs(directory, exist_ok=True)
+        directories.append(directory)
+
+    results = {}
+    total = len(filenames)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(run_worker, worker, filename, directory)
+                   for filename, directory in zip(filenames, directories)]
+        for done, future in enumerate(concurrent.futures.as_completed(futures)):
+            filename, output, error = future.result()
+            results[filename] = {'Output': output, 'Error': error}
+            if error is None:
+                print(f'[{done+1}/{total}] {filename} -> {output}')
+            else:
+                print(f'[{done+1}/{total}] {filename} FAILED')
+                print(error)
+
+    return {filename: results[filename] for filename in filenames}
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def find_raw_logs(source):
+    # Function to list the raw logs in a directory or matching a glob
+    # pattern, or the closed segments of a raw log manifest. Only files with
+    # an OSP_RAW_LOG header are listed, manifests are left out, and so are
+    # the segments a manifest lists as still being written
+    manifest = read_log_manifest(source) if os.path.isfile(source) else None
+    if manifest is not None:
+        if manifest['Filetype'] != 'OSP_RAW_LOG':
+            return []
+        return [segment['Segment'] for segment in manifest['Segments']
+                if segment['Closed']]
+    if os.path.isdir(source):
+        source = os.path.join(source, '*.csv')
+    filenames = []
+    still_open = set()
+    for filename in sorted(glob.glob(source)):
+        if not os.path.isfile(filename):
+            continue
+        manifest = read_log_manifest(filename)
+        if manifest is not None:
+            still_open.update(os.path.abspath(segment['Segment']) for segment
+                              in manifest['Segments'] if not segment['Closed'])
+        elif read_log_filetype(filename) == 'OSP_RAW_LOG':
+            filenames.append(filename)
+    return [filename for filename in filenames
+            if os.path.abspath(filename) not in still_open]
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def run_worker(worker, filename, output_dir):
+    # Function run in the worker process, catching any error so that it is
+    # reported against its file
+    try:
+        return filename, worker(filename, output_dir), None
+    except Exception:
+        return filename, None, traceback.format_exc()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def output_filename(filename, output_dir, suffix):
+    # Function to name an output file after the raw log it comes from
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(output_dir, name + suffix)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def process_raw_log(filename, output_dir):
+    # Default worker for process_survey, reads a raw log, georeferences every
+    # ping with compute_soundings, moves the positions from the GNSS antenna
+    # to the sonar with the course over ground and writes the soundings as a
+    # simple log
+    raw_columns = read_raw_log_columns(filename)
+    if raw_columns is None:
+        raise ValueError(f'Could not read {filename}')
+    metadata = raw_columns['Metadata']
+    soundings = compute_soundings(raw_columns)
+
+    course = course_over_ground(raw_columns, soundings['time'])
+    offset = [metadata['Sonar'][3]-metadata['GNSS'][3],
+              metadata['Sonar'][4]-metadata['GNSS'][4]]
+    soundings['lat'], soundings['long'] = compute_horizontal_offsets_array(
+        offset, soundings['lat'], soundings['long'], course)
+
+    output = output_filename(filename, output_dir, '_soundings.csv')
+    write_simple_log_columns(output, metadata, soundings)
+    return output
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def course_over_ground(raw_columns, times):
+    # Function to get the course over ground at each time from the last RMC
+    # or VTG with a course before it, nan before the first one
+    courses = [raw_columns['Data'][key] for key in ('RMC', 'VTG')]
+    course_time = numpy.concatenate([sentences['time'] for sentences in courses])
+    course = numpy.concatenate([sentences['tmg_true'] for sentences in courses])
+    known = ~numpy.isnan(course_time) & ~numpy.isnan(course)
+    course_time, course = course_time[known], course[known]
+    if len(course) == 0:
+        return numpy.full(len(times), numpy.nan)
+
+    order = numpy.argsort(course_time, kind='stable')
+    course_time, course = course_time[order], course[order]
+    previous = numpy.searchsorted(course_time, times, side='right') - 1
+    return numpy.where(previous >= 0, course[previous.clip(0)], numpy.nan)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def compute_soundings(raw_columns, max_gap=1.0):
+    # Function to georeference every ping of a raw log offline. Position and
+    # ellipsoidal height are interpolated from the GGA fixes (RMC if there
+    # are none) at each ping time, pings more than max_gap seconds from the
+    # nearest fix get nan. Sentences without a time or position, such as a GGA with no
+    # fix, are left out. Returns an array in the SIMPLE_LOG_FIELDS layout
+    metadata = raw_columns['Metadata']
+    depth = raw_columns['Data']['DEPTH']
+    for key in ('GGA', 'RMC'):
+        fixes = raw_columns['Data'][key]
+        fixes = fixes[~numpy.isnan(fixes['time']) & ~numpy.isnan(fixes['lat']) &
+                      ~numpy.isnan(fixes['long'])]
+        if len(fixes):
+            break
+
+    soundings = numpy.zeros(len(depth), dtype=SIMPLE_LOG_FIELDS)
+    soundings['time'] = depth['time']
+    soundings['depth'] = numpy.round(depth['depth'] + metadata['Sonar'][2], 3)
+    soundings['speed'] = depth['speed']
+    if len(fixes) == 0:
+        for name in ('lat', 'long', 'height'):
+            soundings[name] = numpy.nan
+        return soundings
+
+    # Times carry on past midnight in log order, so fixes on both sides of
+    # it are still in time order
+    log_order = numpy.argsort(numpy.concatenate([fixes['row'], depth['row']]),
+                              kind='stable')
+    times = numpy.concatenate([fixes['time'], depth['time']])
+    times[log_order] = unwrap_days(times[log_order])
+    fix_time, ping_time = times[:len(fixes)], times[len(fixes):]
+    order = numpy.argsort(fix_time, kind='stable')
+    fixes, fix_time = fixes[order], fix_time[order]
+    lat = nmea_to_dd_array(fixes['lat'], fixes['lat_hem'])
+    long = numpy.unwrap(nmea_to_dd_array(fixes['long'], fixes['long_hem']), period=360)
+    if 'ortho_height' in fixes.dtype.names:
+        height = fixes['ortho_height'] + fixes['geoid_sep']
+    else:
+        height = numpy.full(len(fixes), numpy.nan)
+
+    after = numpy.searchsorted(fix_time, ping_time).clip(1, len(fix_time)-1)
+    before = after - 1
+    if len(fix_time) == 1:
+        after = before = numpy.zeros(len(ping_time), dtype=int)
+    inside = (ping_time >= fix_time[0]) & (ping_time <= fix_time[-1])
+    nearest = numpy.minimum(numpy.abs(ping_time - fix_time[before]),
+                            numpy.abs(fix_time[after] - ping_time))
+    valid = inside & (nearest <= max_gap)
+
+    ping_lat = numpy.interp(ping_time, fix_time, lat)
+    ping_long = numpy.mod(numpy.interp(ping_time, fix_time, long) + 180, 360) - 180
+    ping_height = numpy.interp(ping_time, fix_time, height)
+
+    soundings['lat'] = numpy.where(valid, ping_lat, numpy.nan)
+    soundings['long'] = numpy.where(valid, ping_long, numpy.nan)
+    soundings['height'] = numpy.where(valid, numpy.round(
+        ping_height - soundings['depth'] - metadata['GNSS'][2], 3), numpy.nan)
+    return soundings
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def regenerate_simple_log(filename, output_dir):
+    # Function to rebuild the simple log of a raw log with compute_soundings,
+    # can be used as a process_survey worker
+    raw_columns = read_raw_log_columns(filename)
+    if raw_columns is None:
+        raise ValueError(f'Could not read {filename}')
+    soundings = compute_soundings(raw_columns)
+    output = output_filename(filename, output_dir, '_simple.csv')
+    write_simple_log_columns(output, raw_columns['Metadata'], soundings)
+    return output
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def correct_depths(depth, speed, profile, draft=0.0):
+    # Function to rescale sonar distances measured with the logged sound
+    # speeds to a corrected sound speed. The profile is either a single speed
+    # in m/s or a (depths, speeds) cast, in which case the one way travel time
+    # is followed down the cast from the transducer draft. Distances without
+    # a logged speed are returned unchanged
+    depth = numpy.asarray(depth, dtype=float)
+    speed = numpy.broadcast_to(numpy.asarray(speed, dtype=float), depth.shape)
+    travel = depth/speed
+
+    if numpy.ndim(profile) == 0:
+        corrected = travel*profile
+    else:
+        cast_depth = numpy.asarray(profile[0], dtype=float)
+        cast_speed = numpy.asarray(profile[1], dtype=float)
+        order = numpy.argsort(cast_depth)
+        cast_depth, cast_speed = cast_depth[order], cast_speed[order]
+        if cast_depth[0] > 0:
+            cast_depth = numpy.concatenate([[0.0], cast_depth])
+            cast_speed = numpy.concatenate([cast_speed[:1], cast_speed])
+        cast_time = numpy.concatenate([[0.0], numpy.cumsum(
+            numpy.diff(cast_depth)*0.5*(1/cast_speed[:-1]+1/cast_speed[1:]))])
+
+        def depth_at(time):
+            below = time > cast_time[-1]
+            result = numpy.interp(time, cast_time, cast_depth)
+            return numpy.where(below, cast_depth[-1] +
+                               (time-cast_time[-1])*cast_speed[-1], result)
+
+        def time_at(z):
+            below = z > cast_depth[-1]
+            result = numpy.interp(z, cast_depth, cast_time)
+            return numpy.where(below, cast_time[-1] +
+                               (z-cast_depth[-1])/cast_speed[-1], result)
+
+        corrected = depth_at(time_at(draft) + travel) - draft
+
+    return numpy.where(numpy.isnan(speed), depth, corrected)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def recorrect_raw_log(raw_columns, profile):
+    # Function to apply correct_depths to the $DEPTH records of a columnar raw
+    # log, using the Sonar waterline as the transducer draft. The speed column
+    # of the result holds the mean speed now applied to each ping
+    depth = raw_columns['Data']['DEPTH'].copy()
+    corrected = correct_depths(depth['depth'], depth['speed'], profile,
+                               draft=raw_columns['Metadata']['Sonar'][2])
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mean_speed = corrected/(depth['depth']/depth['speed'])
+    depth['speed'] = numpy.where(numpy.isnan(depth['speed']), numpy.nan, mean_speed)
+    depth['depth'] = corrected
+
+    recorrected = {}
+    recorrected['Metadata'] = raw_columns['Metadata']
+    recorrected['Data'] = dict(raw_columns['Data'])
+    recorrected['Data']['DEPTH'] = depth
+    return recorrected
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Filtering
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+# Bit flags the filters set on each sounding, nothing is removed and a
+# sounding with no flags set is good
+FLAG_INVALID = 1
+FLAG_CONFIDENCE = 2
+FLAG_SCAN_WINDOW = 4
+FLAG_SPIKE = 8
+
+# Column layout of the flag log written alongside the raw log by Acquisition
+FLAG_LOG_FIELDS = [('time','f8'), ('flags','u1')]
+
+# Scale from the median absolute deviation to the standard deviation of
+# normally distributed depths
+MAD_SCALE = 1.4826
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class SpikeFilter:
+# Class to flag soundings one at a time as they are acquired, keeping only
+# the last window depths. Flags agree with flag_depths with centered=False
+    def __init__(self, window=11, threshold=3.5, min_deviation=0.1,
+                 min_confidence=50):
+        self.threshold = threshold
+        self.min_deviation = min_deviation
+        self.min_confidence = min_confidence
+        self.recent = collections.deque(maxlen=window)
+        self.counts = {'soundings': 0, 'invalid': 0, 'confidence': 0,
+                       'scan_window': 0, 'spike': 0}
+
+    def flag(self, distance):
+        # Function to flag a sonar distance dictionary as returned by
+        # send_ping, with the depth in m and the scan window in mm
+        depth = distance['distance']
+        flags = 0
+        if not depth > 0:
+            flags |= FLAG_INVALID
+            depth = numpy.nan
+        if distance['confidence'] < self.min_confidence:
+            flags |= FLAG_CONFIDENCE
+        start = distance['scan_start']/1000
+        length = distance['scan_length']/1000
+        if not flags & FLAG_INVALID and length > 0 and \
+                (depth < start or depth > start + length):
+            flags |= FLAG_SCAN_WINDOW
+
+        self.recent.append(depth)
+        valid = sorted(value for value in self.recent if value == value)
+        if not flags & FLAG_INVALID and len(valid) >= 3:
+            median = sorted_median(valid)
+            mad = sorted_median(sorted(abs(value - median) for value in valid))
+            if abs(depth - median) > self.threshold*max(MAD_SCALE*mad,
+                                                        self.min_deviation):
+                flags |= FLAG_SPIKE
+
+        self.counts['soundings'] += 1
+        for name, flag in (('invalid', FLAG_INVALID), ('confidence', FLAG_CONFIDENCE),
+                           ('scan_window', FLAG_SCAN_WINDOW), ('spike', FLAG_SPIKE)):
+            if flags & flag:
+                self.counts[name] += 1
+        return flags
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def sorted_median(values):
+    # Function to get the median of a sorted list
+    middle = len(values)//2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle-1] + values[middle])/2
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def flag_depths(depth, window=11, threshold=3.5, min_deviation=0.1,
+                min_confidence=50, centered=True, chunk_size=RAW_LOG_CHUNK):
+    # Function to flag every ping of a $DEPTH structured array at once. A
+    # depth is a spike if it is more than threshold robust standard
+    # deviations (at least min_deviation m) from the median of the window
+    # around it, or of the window ending at it if centered is False
+    values = numpy.asarray(depth['depth'], dtype=float)
+    flags = numpy.zeros(len(values), dtype=numpy.uint8)
+    invalid = ~(values > 0)
+    flags[invalid] |= FLAG_INVALID
+    flags[depth['confidence'] < min_confidence] |= FLAG_CONFIDENCE
+    start = depth['start']
+    length = depth['length']
+    outside = (length > 0) & ((values < start) | (values > start + length))
+    flags[~invalid & outside] |= FLAG_SCAN_WINDOW
+
+    before = window//2 if centered else window - 1
+    padded = numpy.concatenate([numpy.full(before, numpy.nan),
+                                numpy.where(invalid, numpy.nan, values),
+                                numpy.full(window - 1 - before, numpy.nan)])
+    windows = numpy.lib.stride_tricks.sliding_window_view(padded, window)
+    for first in range(0, len(values), chunk_size):
+        last = min(first + chunk_size, len(values))
+        median, mad, count = window_median_mad(windows[first:last])
+        deviation = numpy.abs(values[first:last] - median)
+        limit = threshold*numpy.maximum(MAD_SCALE*mad, min_deviation)
+        spike = (count >= 3) & ~invalid[first:last] & (deviation > limit)
+        flags[first:last][spike] |= FLAG_SPIKE
+    return flags
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def window_median_mad(windows):
+    # Function to get the median, median absolute deviation and number of
+    # values of each row of a 2D array, ignoring nan
+    ordered = numpy.sort(windows, axis=1)
+    count = numpy.count_nonzero(~numpy.isnan(ordered), axis=1)
+    rows = numpy.arange(len(ordered))
+    low = ((count - 1)//2).clip(0)
+    high = count//2
+    with numpy.errstate(invalid='ignore'):
+        median = (ordered[rows, low] + ordered[rows, high])/2
+        deviations = numpy.sort(numpy.abs(ordered - median[:,None]), axis=1)
+        mad = (deviations[rows, low] + deviations[rows, high])/2
+    return median, mad, count
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_flag_log_columns(filename):
+    # Function to read a flag log written during acquisition into a numpy
+    # structured array in the FLAG_LOG_FIELDS layout, one row per $DEPTH
+    # record of the raw log in the same order as flag_raw_log
+    if not file_check(filename, '.csv'):
+        return
+
+    metadata = read_config_file(filename)
+    rows = [row for row in iter_generic_reader(filename, ',', 'Header_End', None)
+            if len(row) == len(FLAG_LOG_FIELDS)]
+    data = rows_to_array(rows, [(i, name, kind) for i, (name, kind) in
+                                enumerate(FLAG_LOG_FIELDS)])
+
+    flag_log = {}
+    flag_log['Metadata'] = metadata
+    flag_log['Data'] = data
+
+    return flag_log
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def flag_raw_log(raw_log, **kwargs):
+    # Function to flag the pings of the output of read_raw_log or
+    # read_raw_log_columns, takes the flag_depths options and returns one
+    # set of flags per $DEPTH record in file order
+    if isinstance(raw_log['Data'], list):
+        raw_log = raw_log_to_columns(raw_log)
+    return flag_depths(raw_log['Data']['DEPTH'], **kwargs)
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Gridding
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+class Grid:
+# Class to bin soundings into a fixed resolution grid in local metric
+# coordinates, keeping a running count, mean, min, max and variance per cell.
+# Cells are stored in square tiles that are only created where there is data
+    def __init__(self, resolution, origin=None, field='depth', tile_size=256):
+        self.resolution = float(resolution)
+        self.origin = origin
+        self.field = field
+        self.tile_size = tile_size
+        self.tiles = {}
+
+    def add(self, lat, long, value):
+        # Function to add soundings, takes scalars or arrays
+        lat = numpy.atleast_1d(numpy.asarray(lat, dtype=float))
+        long = numpy.atleast_1d(numpy.asarray(long, dtype=float))
+        value = numpy.atleast_1d(numpy.asarray(value, dtype=float))
+        keep = ~(numpy.isnan(lat) | numpy.isnan(long) | numpy.isnan(value))
+        lat, long, value = lat[keep], long[keep], value[keep]
+        if len(value) == 0:
+            return
+        if self.origin is None:
+            self.origin = (float(lat[0]), float(long[0]))
+
+        x, y = local_xy(lat, long, self.origin)
+        col = numpy.floor(x/self.resolution).astype(numpy.int64)
+        row = numpy.floor(y/self.resolution).astype(numpy.int64)
+        tile_col, cell_col = numpy.divmod(col, self.tile_size)
+        tile_row, cell_row = numpy.divmod(row, self.tile_size)
+        cell = cell_row*self.tile_size + cell_col
+
+        tile_keys = numpy.stack([tile_row, tile_col], axis=1)
+        tiles, tile_index = numpy.unique(tile_keys, axis=0, return_inverse=True)
+        tile_index = tile_index.ravel()
+        for i, (tr, tc) in enumerate(tiles.tolist()):
+            selected = tile_index == i
+            self.add_to_tile((tr, tc), cell[selected], value[selected])
+
+    def add_to_tile(self, key, cell, value):
+        # Function to merge a batch of soundings into one tile using the
+        # parallel form of Welford's algorithm
+        if key not in self.tiles:
+            size = self.tile_size**2
+            self.tiles[key] = {'count': numpy.zeros(size, dtype=numpy.int32),
+                               'mean': numpy.zeros(size),
+                               'm2': numpy.zeros(size),
+                               'min': numpy.full(size, numpy.inf),
+                               'max': numpy.full(size, -numpy.inf)}
+        tile = self.tiles[key]
+
+        cells, inverse = numpy.unique(cell, return_inverse=True)
+        count_b = numpy.bincount(inverse)
+        mean_b = numpy.bincount(inverse, weights=value)/count_b
+        m2_b = numpy.bincount(inverse, weights=(value-mean_b[inverse])**2)
+        min_b = numpy.full(len(cells), numpy.inf)
+        max_b = numpy.full(len(cells), -numpy.inf)
+        numpy.minimum.at(min_b, inverse, value)
+        numpy.maximum.at(max_b, inverse, value)
+
+        count_a = tile['count'][cells]
+        mean_a = tile['mean'][cells]
+        count = count_a + count_b
+        delta = mean_b - mean_a
+        tile['mean'][cells] = mean_a + delta*count_b/count
+        tile['m2'][cells] += m2_b + delta**2*count_a*count_b/count
+        tile['count'][cells] = count
+        tile['min'][cells] = numpy.minimum(tile['min'][cells], min_b)
+        tile['max'][cells] = numpy.maximum(tile['max'][cells], max_b)
+
+    def add_soundings(self, soundings):
+        # Function to add an array in the SIMPLE_LOG_FIELDS layout
+        self.add(soundings['lat'], soundings['long'], soundings[self.field])
+
+    def add_simple_line(self, line):
+        # Function to add one simple log line, as written during acquisition
+        fields = line.split(',')
+        column = [name for name, kind in SIMPLE_LOG_FIELDS].index(self.field)
+        try:
+            self.add(float(fields[1]), float(fields[2]), float(fields[column]))
+        except (ValueError, IndexError):
+            pass
+
+    def add_simple_log(self, filename):
+        # Function to add every sounding of a simple log file
+        simple_log = read_simple_log_columns(filename)
+        if simple_log is None:
+            return
+        self.add_soundings(simple_log['Data'])
+
+    def surface(self):
+        # Function to assemble the tiles into full 2D arrays of count, mean,
+        # min, max and standard deviation, with the cell centre coordinates
+        if not self.tiles:
+            return
+        keys = numpy.array(list(self.tiles))
+        row0, col0 = keys.min(axis=0)
+        row1, col1 = keys.max(axis=0) + 1
+        size = self.tile_size
+        shape = ((row1-row0)*size, (col1-col0)*size)
+
+        surface = {'count': numpy.zeros(shape, dtype=numpy.int32)}
+        for name in ('mean', 'min', 'max', 'std'):
+            surface[name] = numpy.full(shape, numpy.nan)
+        for (tr, tc), tile in self.tiles.items():
+            r = (tr-row0)*size
+            c = (tc-col0)*size
+            count = tile['count'].reshape(size, size)
+            filled = count > 0
+            window = (slice(r, r+size), slice(c, c+size))
+            surface['count'][window] = count
+            for name in ('mean', 'min', 'max'):
+                surface[name][window] = numpy.where(
+                    filled, tile[name].reshape(size, size), numpy.nan)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                surface['std'][window] = numpy.where(
+                    filled, numpy.sqrt(tile['m2'].reshape(size, size)/count), numpy.nan)
+
+        x = (numpy.arange(shape[1]) + col0*size + 0.5)*self.resolution
+        y = (numpy.arange(shape[0]) + row0*size + 0.5)*self.resolution
+        surface['x'] = x
+        surface['y'] = y
+        surface['lat'] = local_latlong(numpy.zeros_like(y), y, self.origin)[0]
+        surface['long'] = local_latlong(x, numpy.zeros_like(x), self.origin)[1]
+        return surface
+
+    def save(self, filename):
+        # Function to save the grid to a numpy .npz file, an empty grid with
+        # no origin yet is saved with a nan origin
+        origin = self.origin if self.origin is not None else (numpy.nan, numpy.nan)
+        arrays = {'info': numpy.array([self.resolution, origin[0], origin[1],
+                                       self.tile_size]),
+                  'field': numpy.array(self.field)}
+        for (tr, tc), tile in self.tiles.items():
+            for name, array in tile.items():
+                arrays[f'{tr}_{tc}_{name}'] = array
+        numpy.savez_compressed(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        # Function to load a grid saved with save
+        with numpy.load(filename) as arrays:
+            resolution, lat0, long0, tile_size = arrays['info'].tolist()
+            origin = None if math.isnan(lat0) else (lat0, long0)
+            grid = cls(resolution, origin, str(arrays['field']), int(tile_size))
+            for name in arrays.files:
+                if name in ('info', 'field'):
+                    continue
+                tr, tc, key = name.split('_', 2)
+                grid.tiles.setdefault((int(tr), int(tc)), {})[key] = arrays[name]
+        return grid
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def grid_simple_logs(source, resolution, field='depth'):
+    # Function to build a grid from every simple log in a directory or
+    # matching a glob pattern
+    grid = Grid(resolution, field=field)
+    for filename in find_raw_logs(source):
+        grid.add_simple_log(filename)
+    return grid
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Spatial Index
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+class SoundingIndex:
+# Class to index soundings from one or more survey lines on a grid hash in
+# local metric coordinates. Soundings are sorted by cell so each cell is one
+# contiguous slice, found with a binary search over the occupied cells.
+# Queries return positions into the arrays the index was built from. The
+# seabed height is indexed by default, as unlike the depth it does not
+# change with the water level between lines
+    def __init__(self, soundings=None, cell_size=5.0, origin=None, field='height'):
+        self.cell_size = float(cell_size)
+        self.origin = origin
+        self.field = field
+        self.lines = []
+        self.lat = numpy.empty(0)
+        self.long = numpy.empty(0)
+        self.time = numpy.empty(0)
+        self.value = numpy.empty(0)
+        self.line = numpy.empty(0, dtype=numpy.int32)
+        if soundings is not None:
+            if not isinstance(soundings, (list, tuple)):
+                soundings = [soundings]
+            for i, line in enumerate(soundings):
+                self.add_soundings(line, f'line {i}', build=False)
+        self.build()
+
+    def add(self, lat, long, value, time=None, name=None, build=True):
+        # Function to add the soundings of one survey line, takes arrays.
+        # Soundings with no position or value are dropped
+        lat = numpy.atleast_1d(numpy.asarray(lat, dtype=float))
+        long = numpy.atleast_1d(numpy.asarray(long, dtype=float))
+        value = numpy.atleast_1d(numpy.asarray(value, dtype=float))
+        if time is None:
+            time = numpy.full(len(value), numpy.nan)
+        time = numpy.atleast_1d(numpy.asarray(time, dtype=float))
+        keep = ~(numpy.isnan(lat) | numpy.isnan(long) | numpy.isnan(value))
+        if self.origin is None and keep.any():
+            self.origin = (float(lat[keep][0]), float(long[keep][0]))
+
+        self.lines.append(f'line {len(self.lines)}' if name is None else name)
+        self.lat = numpy.concatenate([self.lat, lat[keep]])
+        self.long = numpy.concatenate([self.long, long[keep]])
+        self.time = numpy.concatenate([self.time, time[keep]])
+        self.value = numpy.concatenate([self.value, value[keep]])
+        self.line = numpy.concatenate([
+            self.line, numpy.full(keep.sum(), len(self.lines)-1, dtype=numpy.int32)])
+        if build:
+            self.build()
+
+    def add_soundings(self, soundings, name=None, build=True):
+        # Function to add an array in the SIMPLE_LOG_FIELDS layout as one line
+        self.add(soundings['lat'], soundings['long'], soundings[self.field],
+                 soundings['time'], name, build)
+
+    def add_simple_log(self, filename, build=True):
+        # Function to add every sounding of a simple log file as one line
+        # named after the file
+        simple_log = read_simple_log_columns(filename)
+        if simple_log is None:
+            return
+        self.add_soundings(simple_log['Data'], filename, build)
+
+    def build(self):
+        # Function to sort the soundings by cell. Cell keys hold the row in
+        # the upper 32 bits, so the cells of one row are consecutive keys
+        if self.origin is None:
+            self.x = self.y = numpy.empty(0)
+        else:
+            self.x, self.y = local_xy(self.lat, self.long, self.origin)
+        key = self.cell_key(self.x, self.y)
+        self.order = numpy.argsort(key, kind='stable')
+        self.keys, self.starts = numpy.unique(key[self.order], return_index=True)
+        self.ends = numpy.append(self.starts[1:], len(key))
+
+    def cell_key(self, x, y):
+        # Function to find the cell key of local coordinates
+        col = numpy.floor(numpy.asarray(x)/self.cell_size).astype(numpy.int64)
+        row = numpy.floor(numpy.asarray(y)/self.cell_size).astype(numpy.int64)
+        return (row << 32) + col + 2**31
+
+    def cell_slices(self, keys):
+        # Function to find the start and end, in sorted order, of the
+        # soundings in each cell. Empty cells give an empty slice
+        if len(self.keys) == 0:
+            empty = numpy.zeros(len(keys), dtype=numpy.int64)
+            return empty, empty
+        i = numpy.minimum(numpy.searchsorted(self.keys, keys), len(self.keys)-1)
+        found = self.keys[i] == keys
+        return (numpy.where(found, self.starts[i], 0),
+                numpy.where(found, self.ends[i], 0))
+
+    def expand(self, owner, start, end):
+        # Function to expand slices of the sorted soundings into pairs of
+        # owner and sounding position
+        count = end - start
+        total = count.sum()
+        owner = numpy.repeat(owner, count)
+        offset = numpy.repeat(start - numpy.cumsum(count) + count, count)
+        return owner, self.order[numpy.arange(total) + offset]
+
+    def candidates(self, x, y, reach):
+        # Generator of pairs of query and sounding positions covering every
+        # sounding within reach cells of each query. When that spans more
+        # cells than are occupied every sounding is a candidate, given in
+        # chunks of queries to bound the memory
+        query = numpy.arange(len(x))
+        if (2*reach+1)**2 > len(self.keys):
+            step = max(1, 1000000//max(len(self.value), 1))
+            everything = numpy.arange(len(self.value))
+            for i in range(0, len(x), step):
+                chunk = query[i:i+step]
+                yield numpy.repeat(chunk, len(everything)), numpy.tile(everything, len(chunk))
+            return
+        key = self.cell_key(x, y)
+        for dr in range(-reach, reach+1):
+            for dc in range(-reach, reach+1):
+                yield self.expand(query, *self.cell_slices(key + (dr << 32) + dc))
+
+    def query_xy_radius(self, x, y, radius):
+        # Function to find every sounding within radius metres of each point
+        # given in local coordinates, returns matching arrays of query and
+        # sounding positions sorted by query
+        x = numpy.atleast_1d(numpy.asarray(x, dtype=float))
+        y = numpy.atleast_1d(numpy.asarray(y, dtype=float))
+        reach = int(numpy.ceil(radius/self.cell_size))
+        queries = [numpy.empty(0, dtype=numpy.int64)]
+        soundings = [numpy.empty(0, dtype=numpy.int64)]
+        for owner, sounding in self.candidates(x, y, reach):
+            near = ((self.x[sounding]-x[owner])**2 +
+                    (self.y[sounding]-y[owner])**2) <= radius**2
+            queries.append(owner[near])
+            soundings.append(sounding[near])
+        queries = numpy.concatenate(queries)
+        soundings = numpy.concatenate(soundings)
+        order = numpy.lexsort((soundings, queries))
+        return queries[order], soundings[order]
+
+    def query_radius(self, lat, long, radius):
+        # Function to find every sounding within radius metres of each
+        # position, returns matching arrays of query and sounding positions
+        x, y = local_xy(lat, long, self.origin)
+        return self.query_xy_radius(x, y, radius)
+
+    def query_nearest(self, lat, long, k=1):
+        # Function to find the k nearest soundings to each position, returns
+        # (n, k) arrays of sounding positions and distances in metres. Missing
+        # neighbours, when there are fewer than k soundings, are -1 and inf
+        x, y = local_xy(lat, long, self.origin)
+        x = numpy.atleast_1d(x)
+        y = numpy.atleast_1d(y)
+        nearest = numpy.full((len(x), k), -1, dtype=numpy.int64)
+        distance = numpy.full((len(x), k), numpy.inf)
+        if len(self.value) == 0:
+            return nearest, distance
+
+        # Search growing radii until each query has k soundings within the
+        # radius, those are then exactly the k nearest. Once the radius
+        # reaches the far corner of the soundings every query is done
+        far = numpy.hypot(numpy.maximum(numpy.abs(x-self.x.min()), numpy.abs(x-self.x.max())),
+                          numpy.maximum(numpy.abs(y-self.y.min()), numpy.abs(y-self.y.max())))
+        pending = numpy.arange(len(x))
+        radius = self.cell_size
+        while len(pending):
+            queries, soundings = self.query_xy_radius(x[pending], y[pending], radius)
+            found = numpy.bincount(queries, minlength=len(pending))
+            done = (found >= k) | (far[pending] <= radius)
+            keep = done[queries]
+            queries, soundings = queries[keep], soundings[keep]
+            d = numpy.hypot(self.x[soundings]-x[pending][queries],
+                            self.y[soundings]-y[pending][queries])
+            order = numpy.lexsort((d, queries))
+            queries, soundings, d = queries[order], soundings[order], d[order]
+            rank = numpy.arange(len(queries)) - numpy.searchsorted(queries, queries)
+            first = rank < k
+            nearest[pending[queries[first]], rank[first]] = soundings[first]
+            distance[pending[queries[first]], rank[first]] = d[first]
+            pending = pending[~done]
+            radius *= 2
+        return nearest, distance
+
+    def query_bbox(self, south, west, north, east):
+        # Function to find every sounding inside a lat/long box, returns the
+        # sorted sounding positions
+        x0, y0 = local_xy(south, west, self.origin)
+        x1, y1 = local_xy(north, east, self.origin)
+        row0, row1 = numpy.floor(numpy.array([y0, y1])/self.cell_size).astype(numpy.int64)
+        col0, col1 = numpy.floor(numpy.array([x0, x1])/self.cell_size).astype(numpy.int64)
+        rows = numpy.arange(row0, row1+1) << 32
+        first = numpy.searchsorted(self.keys, rows + col0 + 2**31)
+        last = numpy.searchsorted(self.keys, rows + col1 + 2**31, side='right')
+        cells = numpy.concatenate([numpy.arange(a, b) for a, b in zip(first, last)] +
+                                  [numpy.empty(0, dtype=numpy.int64)])
+        soundings = self.expand(cells, self.starts[cells], self.ends[cells])[1]
+        inside = ((self.x[soundings] >= x0) & (self.x[soundings] <= x1) &
+                  (self.y[soundings] >= y0) & (self.y[soundings] <= y1))
+        return numpy.sort(soundings[inside])
+
+    def save(self, filename):
+        # Function to save the index, with its sort, to a numpy .npz file, an
+        # empty index with no origin yet is saved with a nan origin
+        origin = self.origin if self.origin is not None else (numpy.nan, numpy.nan)
+        numpy.savez_compressed(
+            filename, info=numpy.array([self.cell_size, *origin]),
+            field=numpy.array(self.field), lines=numpy.array(self.lines, dtype=str),
+            lat=self.lat, long=self.long, time=self.time, value=self.value,
+            line=self.line, order=self.order, keys=self.keys, starts=self.starts)
+
+    @classmethod
+    def load(cls, filename):
+        # Function to load an index saved with save without sorting again
+        with numpy.load(filename) as arrays:
+            cell_size, lat0, long0 = arrays['info'].tolist()
+            origin = None if math.isnan(lat0) else (lat0, long0)
+            index = cls(cell_size=cell_size, origin=origin,
+                        field=str(arrays['field']))
+            index.lines = arrays['lines'].tolist()
+            for name in ('lat', 'long', 'time', 'value', 'line', 'order', 'keys', 'starts'):
+                setattr(index, name, arrays[name])
+        if index.origin is not None:
+            index.x, index.y = local_xy(index.lat, index.long, index.origin)
+        index.ends = numpy.append(index.starts[1:], len(index.order))
+        return index
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def index_simple_logs(source, cell_size=5.0, field='height'):
+    # Function to build a sounding index from every simple log in a
+    # directory or matching a glob pattern, one line per file
+    index = SoundingIndex(cell_size=cell_size, field=field)
+    for filename in find_raw_logs(source):
+        index.add_simple_log(filename, build=False)
+    index.build()
+    return index
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def crossline_report(index, cross_lines, main_lines=None, radius=1.0):
+    # Function to compare the soundings of each cross line with the mean of
+    # the main line soundings within radius metres, in the field the index
+    # holds, the seabed height unless it was built on another. Lines are
+    # given by their position in index.lines, main_lines defaults to every
+    # other line. Returns the difference at every compared sounding, and the
+    # count, mean, standard deviation, rms and largest absolute difference of
+    # each pair of cross and main line
+    cross_lines = numpy.atleast_1d(cross_lines)
+    if main_lines is None:
+        main_lines = numpy.setdiff1d(numpy.arange(len(index.lines)), cross_lines)
+    main_lines = numpy.atleast_1d(main_lines)
+
+    cross = numpy.flatnonzero(numpy.isin(index.line, cross_lines))
+    queries, soundings = index.query_xy_radius(index.x[cross], index.y[cross], radius)
+    on_main = numpy.isin(index.line[soundings], main_lines)
+    queries, soundings = cross[queries[on_main]], soundings[on_main]
+
+    # Mean of the main line soundings around each cross line sounding, kept
+    # apart for each main line
+    pair = queries.astype(numpy.int64)*len(index.lines) + index.line[soundings]
+    pairs, inverse = numpy.unique(pair, return_inverse=True)
+    inverse = inverse.ravel()
+    count = numpy.bincount(inverse)
+    main_value = numpy.bincount(inverse, weights=index.value[soundings])/count
+    sounding, main_line = numpy.divmod(pairs, len(index.lines))
+
+    differences = numpy.zeros(len(pairs), dtype=[
+        ('sounding', 'i8'), ('cross_line', 'i4'), ('main_line', 'i4'),
+        ('time', 'f8'), ('lat', 'f8'), ('long', 'f8'), ('cross_value', 'f8'),
+        ('main_value', 'f8'), ('main_count', 'i4'), ('difference', 'f8')])
+    differences['sounding'] = sounding
+    differences['cross_line'] = index.line[sounding]
+    differences['main_line'] = main_line
+    differences['time'] = index.time[sounding]
+    differences['lat'] = index.lat[sounding]
+    differences['long'] = index.long[sounding]
+    differences['cross_value'] = index.value[sounding]
+    differences['main_value'] = main_value
+    differences['main_count'] = count
+    differences['difference'] = index.value[sounding] - main_value
+
+    line_pair = differences['cross_line'].astype(numpy.int64)*len(index.lines) + main_line
+    line_pairs, inverse = numpy.unique(line_pair, return_inverse=True)
+    inverse = inverse.ravel()
+    difference = differences['difference']
+    summary = numpy.zeros(len(line_pairs), dtype=[
+        ('cross_line', 'i4'), ('main_line', 'i4'), ('count', 'i8'),
+        ('mean', 'f8'), ('std', 'f8'), ('rms', 'f8'), ('max_abs', 'f8')])
+    summary['cross_line'], summary['main_line'] = numpy.divmod(line_pairs, len(index.lines))
+    summary['count'] = numpy.bincount(inverse)
+    summary['mean'] = numpy.bincount(inverse, weights=difference)/summary['count']
+    summary['rms'] = numpy.sqrt(numpy.bincount(inverse, weights=difference**2)/summary['count'])
+    summary['std'] = numpy.sqrt(numpy.maximum(summary['rms']**2 - summary['mean']**2, 0))
+    max_abs = numpy.zeros(len(line_pairs))
+    numpy.maximum.at(max_abs, inverse, numpy.abs(difference))
+    summary['max_abs'] = max_abs
+
+    report = {}
+    report['Metadata'] = {'lines': list(index.lines), 'field': index.field,
+                          'radius': radius}
+    report['Data'] = {'differences': differences, 'summary': summary}
+    return report
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_crossline_report(filename, report):
+    # Function to write the summary of a crossline report as a csv file
+    lines = report['Metadata']['lines']
+    with open(filename, 'w') as file:
+        file.write('cross_line,main_line,count,mean,std,rms,max_abs\n')
+        for row in report['Data']['summary']:
+            file.write('%s,%s,%d,%.3f,%.3f,%.3f,%.3f\n' % (
+                lines[row['cross_line']], lines[row['main_line']], row['count'],
+                row['mean'], row['std'], row['rms'], row['max_abs']))
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Miscelaneous applications
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+def file_check(filename, ending):
+    # Checks if the filename exist and if they end in .csv
+    if filename.endswith(ending):
+        return True
+    else:
+        print('File does not end in "'+ending+'"')
+        return False
+    filexists = os.path.isfile(filename)
+    if not filexists:
+        print('File not found!')
+        return False
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------        
+def compute_horizontal_offsets(logfile_offset, logfile_data):
+    # Function to compute offset from GNSS antenna to sonar for every sounding          ################## Update to take raw file or readable file
+    import geopy.distance
+    
+    sonar_offset_distance, bearing = offset_distance_bearing(logfile_offset)
+    
+    
+    sonar_position_list = []
+    for row in logfile_data:
+        lat = row['Lat']
+        long = row['Long']
+        course = row['Course']
+        
+        course_adjusted = course + bearing
+        if course_adjusted >=360:
+            course_adjusted = course_adjusted - 360
+        
+        # With no lever arm the course does not matter, and may be unknown
+        if sonar_offset_distance == 0:
+            sonar_position_list.append([lat,long])
+            continue
         
         sonar_position = geopy.distance.distance(meters=sonar_offset_distance
                             ).destination((lat,long), bearing=course_adjusted)
@@ -539,6 +3625,110 @@ def compute_horizontal_offsets(logfile_offset, logfile_data):
     return sonar_position_list
 #-----------------------------------------------------------------------------
 
+#-----------------------------------------------------------------------------
+def compute_horizontal_offsets_array(logfile_offset, lat, long, course):
+    # Function to compute the sonar position for arrays of GNSS positions and
+    # courses at once, returns arrays of sonar latitude and longitude
+    sonar_offset_distance, bearing = offset_distance_bearing(logfile_offset)
+
+    course_adjusted = numpy.mod(numpy.asarray(course, dtype=float) + bearing, 360)
+
+    sonar_lat, sonar_long = geodesic_destination(lat, long, course_adjusted,
+                                                 sonar_offset_distance)
+    return sonar_lat, sonar_long
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def offset_distance_bearing(logfile_offset):
+    # Function to turn the x/y offset from GNSS antenna to sonar into a
+    # distance and a bearing relative to the vessel heading
+    offset_xy = ((logfile_offset[0])**2)+((logfile_offset[1])**2)
+    sonar_offset_distance = numpy.sqrt(offset_xy)
+            
+    num1 = logfile_offset[0]
+    num2 = logfile_offset[1]
+
+    if num2 == 0:
+        num2 = 0.0000000000001
+
+    bearing_raw = numpy.rad2deg(numpy.arctan(num1/num2))
+
+    if num1 >= 0 and num2 >= 0:
+        bearing = bearing_raw
+    elif num1 < 0 and num2 > 0:
+        bearing = 360 + bearing_raw
+    else:
+        bearing = 180 + bearing_raw
+    
+    bearing = numpy.round(bearing, 4)
+
+    return sonar_offset_distance, bearing
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1/298.257223563
+WGS84_B = WGS84_A*(1-WGS84_F)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def geodesic_destination(lat, long, bearing, distance):
+    # Function to compute destination points on the WGS84 ellipsoid for arrays
+    # of start points, bearings and distances (metres) using Vincenty's direct
+    # formula, agrees with geopy to well under a millimetre. A zero distance
+    # gives the start point whatever the bearing, even nan
+    phi1 = numpy.deg2rad(numpy.asarray(lat, dtype=float))
+    alpha1 = numpy.deg2rad(numpy.asarray(bearing, dtype=float))
+    distance = numpy.asarray(distance, dtype=float)
+    a, b, f = WGS84_A, WGS84_B, WGS84_F
+
+    sin_alpha1 = numpy.sin(alpha1)
+    cos_alpha1 = numpy.cos(alpha1)
+    tan_u1 = (1-f)*numpy.tan(phi1)
+    cos_u1 = 1/numpy.sqrt(1+tan_u1**2)
+    sin_u1 = tan_u1*cos_u1
+    sigma1 = numpy.arctan2(tan_u1, cos_alpha1)
+    sin_alpha = cos_u1*sin_alpha1
+    cos_sq_alpha = 1-sin_alpha**2
+    u_sq = cos_sq_alpha*(a**2-b**2)/b**2
+    big_a = 1+u_sq/16384*(4096+u_sq*(-768+u_sq*(320-175*u_sq)))
+    big_b = u_sq/1024*(256+u_sq*(-128+u_sq*(74-47*u_sq)))
+
+    sigma = distance/(b*big_a)
+    for i in range(20):
+        cos_2sigma_m = numpy.cos(2*sigma1+sigma)
+        sin_sigma = numpy.sin(sigma)
+        cos_sigma = numpy.cos(sigma)
+        delta_sigma = big_b*sin_sigma*(cos_2sigma_m+big_b/4*(
+            cos_sigma*(-1+2*cos_2sigma_m**2)-big_b/6*cos_2sigma_m*
+            (-3+4*sin_sigma**2)*(-3+4*cos_2sigma_m**2)))
+        sigma_new = distance/(b*big_a)+delta_sigma
+        converged = numpy.all(numpy.abs(sigma_new-sigma) < 1e-12)
+        sigma = sigma_new
+        if converged:
+            break
+
+    cos_2sigma_m = numpy.cos(2*sigma1+sigma)
+    sin_sigma = numpy.sin(sigma)
+    cos_sigma = numpy.cos(sigma)
+    tmp = sin_u1*sin_sigma-cos_u1*cos_sigma*cos_alpha1
+    phi2 = numpy.arctan2(sin_u1*cos_sigma+cos_u1*sin_sigma*cos_alpha1,
+                         (1-f)*numpy.sqrt(sin_alpha**2+tmp**2))
+    lam = numpy.arctan2(sin_sigma*sin_alpha1,
+                        cos_u1*cos_sigma-sin_u1*sin_sigma*cos_alpha1)
+    c = f/16*cos_sq_alpha*(4+f*(4-3*cos_sq_alpha))
+    big_l = lam-(1-c)*f*sin_alpha*(sigma+c*sin_sigma*(
+        cos_2sigma_m+c*cos_sigma*(-1+2*cos_2sigma_m**2)))
+
+    dest_lat = numpy.rad2deg(phi2)
+    dest_long = numpy.mod(numpy.asarray(long, dtype=float)+numpy.rad2deg(big_l)+180, 360)-180
+    still = distance == 0
+    dest_lat = numpy.where(still, numpy.asarray(lat, dtype=float), dest_lat)
+    dest_long = numpy.where(still, numpy.asarray(long, dtype=float), dest_long)
+    return dest_lat, dest_long
+#-----------------------------------------------------------------------------
+
 #-----------------------------------------------------------------------------
 def remove_null_string(start_list, replacement):
     # Function that removes null values from a list and replaces with a value
@@ -615,4 +3805,143 @@ def dms_to_dd(dms):
         dd = -dd
     
     return dd
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def dms_to_dd_array(dms):
+    # Takes an array of dms strings and converts to decimal degrees. Accepts
+    # [-]ddmmss[.s] and [-]dddmmss[.s] or any of :,°'" and spaces between
+    # degrees, minutes and seconds, with an optional N/S/E/W at the end.
+    # Malformed entries become nan
+    chars = numpy.char.strip(numpy.asarray(dms, dtype=str))
+    count = len(chars)
+    if count == 0:
+        return numpy.zeros(0)
+    codes = chars.view(numpy.uint32).reshape(count, -1)
+    length = numpy.char.str_len(chars)
+    rows = numpy.arange(count)
+
+    negative = codes[:,0] == ord('-')
+    last = codes[rows, (length - 1).clip(0)]
+    south_west = (last == ord('S')) | (last == ord('W'))
+    hemisphere = south_west | (last == ord('N')) | (last == ord('E'))
+    start = negative.astype(numpy.int64)
+    end = length - hemisphere
+
+    # Character classes 1 digit, 2 decimal point, 3 delimiter, 0 anything else
+    table = numpy.zeros(257, dtype=numpy.uint8)
+    table[ord('0'):ord('9')+1] = 1
+    table[ord('.')] = 2
+    table[[ord(c) for c in ':,°\'" ']] = 3
+    kinds = table[numpy.minimum(codes, 256)].T.copy()
+    numbers = codes.T.astype(numpy.int8) - 48
+
+    # Read the body a column at a time into up to three numbers, a new number
+    # starting at the first digit or point after one or more delimiters
+    parts = numpy.zeros((count, 4))
+    part_digits = numpy.zeros((count, 4), dtype=numpy.int64)
+    part_fraction = numpy.zeros((count, 4), dtype=bool)
+    field = numpy.zeros(count, dtype=numpy.int64)
+    value = numpy.zeros(count)
+    digits = numpy.zeros(count, dtype=numpy.int64)
+    scale = numpy.zeros(count)
+    gap = numpy.zeros(count, dtype=bool)
+    bad = negative & hemisphere
+    for j in range(len(kinds)):
+        inside = (j >= start) & (j < end)
+        kind = numpy.where(inside, kinds[j], 3)
+        bad |= kind == 0
+        new = gap & ((kind == 1) | (kind == 2))
+        if new.any():
+            closing = field[new]
+            parts[new, closing] = value[new]
+            part_digits[new, closing] = digits[new]
+            part_fraction[new, closing] = scale[new] > 0
+            field[new] = numpy.minimum(closing + 1, 3)
+            value[new] = 0
+            digits[new] = 0
+            scale[new] = 0
+        gap = (gap | (inside & (kind == 3))) & ~new
+
+        dot = kind == 2
+        bad |= dot & (scale > 0)
+        scale[dot] = 1
+        digit = (kind == 1).astype(numpy.float64)
+        whole = scale == 0
+        number = numbers[j]
+        value = numpy.where(whole, value*(1 + 9*digit) + digit*number,
+                            value + digit*number*scale/10)
+        digits += (whole & (digit > 0))
+        scale = numpy.where(whole, scale, scale/(1 + 9*digit))
+    parts[rows, field] = value
+    part_digits[rows, field] = digits
+    part_fraction[rows, field] = scale > 0
+
+    # Without delimiters the whole part is dddmmss
+    undelimited = numpy.floor(parts[:,0])
+    degrees = numpy.floor(undelimited/10000)
+    minutes = numpy.floor(undelimited/100) % 100
+    seconds = parts[:,0] - degrees*10000 - minutes*100
+    delimited = field > 0
+    bad |= ~delimited & ((part_digits[:,0] < 5) | (part_digits[:,0] > 7))
+    bad |= delimited & ((field != 2) | (part_digits[:,:3] == 0).any(axis=1) |
+                        part_fraction[:,0] | part_fraction[:,1])
+    degrees = numpy.where(delimited, parts[:,0], degrees)
+    minutes = numpy.where(delimited, parts[:,1], minutes)
+    seconds = numpy.where(delimited, parts[:,2], seconds)
+
+    bad |= (minutes >= 60) | (seconds >= 60) | (degrees > 180)
+    dd = degrees + minutes/60 + seconds/3600
+    dd = numpy.where(negative | south_west, -dd, dd)
+    return numpy.where(bad, numpy.nan, dd)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def nmea_to_dd_array(value, hemisphere):
+    # Takes arrays of NMEA ddmm.mmmm values, as numbers or strings, and
+    # N/S/E/W hemispheres and converts to decimal degrees. Blank or malformed
+    # values, minutes of 60 or more, degrees out of range for the hemisphere
+    # and missing or unknown hemispheres become nan
+    value = numpy.asarray(value)
+    if value.dtype.kind in 'USO':
+        value = float_column(numpy.char.strip(value.astype(str)))
+    value = value.astype(float)
+    hemisphere = numpy.char.strip(numpy.asarray(hemisphere).astype('S1'))
+    degrees = numpy.floor(value/100)
+    minutes = value - degrees*100
+    dd = degrees + minutes/60
+    negative = (hemisphere == b'S') | (hemisphere == b'W')
+    latitude = negative | (hemisphere == b'N')
+    longitude = (hemisphere == b'E') | (hemisphere == b'W')
+    good = (value >= 0) & (minutes < 60) & \
+        ((latitude & (dd <= 90)) | (longitude & (dd <= 180)))
+    dd = numpy.where(negative, -dd, dd)
+    return numpy.where(good, dd, numpy.nan)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def local_xy(lat, long, origin):
+    # Takes arrays of lat and long and converts to east/north metres from the
+    # origin on a plane tangent to the WGS84 ellipsoid
+    lat0 = numpy.deg2rad(origin[0])
+    e2 = WGS84_F*(2-WGS84_F)
+    meridian = WGS84_A*(1-e2)/(1-e2*numpy.sin(lat0)**2)**1.5
+    normal = WGS84_A/numpy.sqrt(1-e2*numpy.sin(lat0)**2)
+    dlong = numpy.mod(numpy.asarray(long, dtype=float) - origin[1] + 180, 360) - 180
+    x = numpy.deg2rad(dlong)*normal*numpy.cos(lat0)
+    y = numpy.deg2rad(numpy.asarray(lat, dtype=float) - origin[0])*meridian
+    return x, y
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def local_latlong(x, y, origin):
+    # Takes arrays of east/north metres from the origin and converts back to
+    # lat and long, the inverse of local_xy
+    lat0 = numpy.deg2rad(origin[0])
+    e2 = WGS84_F*(2-WGS84_F)
+    meridian = WGS84_A*(1-e2)/(1-e2*numpy.sin(lat0)**2)**1.5
+    normal = WGS84_A/numpy.sqrt(1-e2*numpy.sin(lat0)**2)
+    lat = origin[0] + numpy.rad2deg(numpy.asarray(y, dtype=float)/meridian)
+    long = origin[1] + numpy.rad2deg(numpy.asarray(x, dtype=float)/(normal*numpy.cos(lat0)))
+    return lat, long
 #-----------------------------------------------------------------------------
\ No newline at end of file
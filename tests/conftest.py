@@ -0,0 +1,76 @@
+##############################################################################
+# Shared fixtures for the Open Sonar Library tests
+##############################################################################
+
+import functools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import osplib
+
+METADATA = {'filetype': ['OSP_RAW_LOG'],
+            'Survey': ['Test', '2022-01-17', 'GC'],
+            'Geodetics': [4326, 0],
+            'Vessel': ['Boat'],
+            'GNSS': ['Emlid', 'RS2', 0.1, 0.2, 0.3, 0.0],
+            'Sonar': ['BR', 'Ping', 0.4, 0.5, 0.2, 0.0],
+            'SVP': ['Valeport', 'Mini', 0],
+            'GNSS_Com': ['COM', '/dev/ttyUSB0', 115200],
+            'Sonar_Com': ['COM', '/dev/ttyUSB1', 115200],
+            'SVP_Com': ['COM', '/dev/ttyUSB2', 9600]}
+
+#-----------------------------------------------------------------------------
+def nmea(body):
+    # Function to add the checksum to an NMEA sentence body
+    checksum = functools.reduce(lambda a, b: a ^ b, body.encode(), 0)
+    return '$%s*%02X' % (body, checksum)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def epoch_lines(time, utc, lat, long, course=45.0, depth=3.06, quality=4):
+    # Function to make the raw log lines of one GNSS epoch and its ping,
+    # lat and long as NMEA ddmm.mmmmmm text
+    return [
+        '%s,%s' % (time, nmea('GNGGA,%s,%s,N,%s,W,%d,12,0.8,10.561,M,-20.123,M,1.0,0000'
+                              % (utc, lat, long, quality))),
+        '%s,$DEPTH,%s,100,50,0,10000,2,1.485' % (time, depth),
+        '%s,%s' % (time, nmea('GNRMC,%s,A,%s,N,%s,W,3.2,%.1f,170122,,,D,V'
+                              % (utc, lat, long, course))),
+        '%s,%s' % (time, nmea('GNVTG,%.1f,T,,M,3.2,N,5.9,K,D' % course)),
+        '%s,%s' % (time, nmea('GNGLL,%s,N,%s,W,%s,A,D' % (lat, long, utc))),
+    ]
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def survey_lines(count=20, start=14*3600):
+    # Function to make the body of a raw log heading north east at about
+    # 1.6 m/s, one epoch every 0.2 s
+    lines = []
+    for i in range(count):
+        seconds = (start + 0.2*i) % 86400
+        time = '%02d:%02d:%09.6f' % (seconds//3600, seconds % 3600//60, seconds % 60)
+        utc = '%02d%02d%05.2f' % (seconds//3600, seconds % 3600//60, seconds % 60)
+        lat = '4530.%06d' % (123456 + 2*i)
+        long = '06330.%06d' % (654321 - 2*i)
+        lines.extend(epoch_lines(time, utc, lat, long, depth=3.06 + 0.01*i))
+    return lines
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_log(filename, lines, filetype='OSP_RAW_LOG', compress=False):
+    # Function to write a log with the test metadata header
+    metadata = dict(METADATA)
+    metadata['filetype'] = [filetype]
+    osplib.write_meta_header(filename, metadata, compress)
+    with osplib.open_log(filename, 'a', compress) as file:
+        file.write(''.join(line + '\n' for line in lines))
+    return filename
+#-----------------------------------------------------------------------------
+
+@pytest.fixture
+def raw_file(tmp_path):
+    return write_log(str(tmp_path / 'raw.csv'), survey_lines())
@@ -0,0 +1,221 @@
+import datetime as dt
+import io
+import time
+
+import numpy
+import pytest
+
+pynmea2 = pytest.importorskip('pynmea2')
+
+import osp_benchmark
+import osplib
+from conftest import METADATA, nmea
+
+
+PING = {'distance': 3.06, 'confidence': 100, 'transmit_duration': 50,
+        'scan_start': 0, 'scan_length': 10000, 'gain_setting': 2}
+
+
+class FakeGNSS:
+    # Hands out the same GGA stamped with a fixed time
+    def __init__(self, time):
+        self.gps_found = True
+        self.time = time
+        self.message = pynmea2.parse(nmea(
+            'GNGGA,140000.00,4530.123456,N,06330.654321,W,4,12,0.8,10.0,M,-20.0,M,1.0,0000'))
+
+    def get_nmea(self):
+        time.sleep(0.001)
+        return self.time, self.message, True
+
+
+class FakeSonar:
+    # Answers pings from a list of distances, None standing for a lost reply
+    def __init__(self, time, distances):
+        self.sonar_found = True
+        self.time = time
+        self.distances = list(distances)
+
+    def send_ping(self):
+        time.sleep(0.001)
+        distance = self.distances.pop(0) if self.distances else 3.06
+        if distance is None:
+            return None
+        return self.time, dict(PING, distance=distance)
+
+
+class Console:
+    # Collects what would be printed to the screen
+    def __init__(self):
+        self.lines = []
+
+    def print(self, line):
+        self.lines.append(line)
+
+
+def run(acquisition, seconds=0.3):
+    acquisition.start()
+    time.sleep(seconds)
+    acquisition.stop()
+    return acquisition.stats()
+
+
+def make_acquisition(gnss, sonar, **kwargs):
+    return osplib.Acquisition(METADATA, gnss, sonar, None, io.StringIO(),
+                              io.StringIO(), 1500.0, False,
+                              console=Console(), **kwargs)
+
+
+def test_time_difference_wraps_midnight():
+    assert osplib.time_difference('23:59:59', '00:00:01') == 2
+    assert osplib.time_difference('00:00:01', '23:59:59') == -2
+
+
+def test_sonar_errors_are_reported_and_retried(capsys):
+    now = dt.time(14, 0, 0)
+    acquisition = make_acquisition(FakeGNSS(now), FakeSonar(now, [None, None]),
+                                   retry_interval=0.01)
+    stats = run(acquisition)
+    assert stats['errors']['Sonar'] == 2
+    assert stats['failed'] == []
+    assert stats['received']['Sonar'] > 0
+    assert stats['soundings'] > 0
+    assert 'TypeError' in capsys.readouterr().err
+
+
+def test_sensor_given_up_after_max_errors():
+    now = dt.time(14, 0, 0)
+    acquisition = make_acquisition(FakeGNSS(now), FakeSonar(now, [None]*10),
+                                   retry_interval=0.01, max_errors=3)
+    stats = run(acquisition)
+    assert stats['errors']['Sonar'] == 3
+    assert stats['failed'] == ['Sonar']
+    assert stats['received']['Sonar'] == 0
+    # The GNSS carries on without the sonar
+    assert stats['received']['GNSS'] > 0
+
+
+def test_stale_gga_is_not_paired():
+    gnss = FakeGNSS(dt.time(14, 0, 0))
+    sonar = FakeSonar(dt.time(14, 0, 5), [])
+    acquisition = make_acquisition(gnss, sonar, max_gga_age=1.0)
+    stats = run(acquisition)
+    assert stats['soundings'] == 0
+    assert stats['stale_gga'] > 0
+    assert acquisition.raw_log.getvalue().count('$DEPTH') == stats['received']['Sonar']
+
+    acquisition = make_acquisition(gnss, sonar, max_gga_age=None)
+    stats = run(acquisition)
+    assert stats['soundings'] > 0
+    assert stats['stale_gga'] == 0
+
+
+def test_timings_keep_negative_ages():
+    timings = osplib.Timings()
+    for ping in ('14:00:00.100', '14:00:00.200', '13:59:57', '13:59:57', '13:59:57'):
+        timings.add_age('14:00:00', ping)
+    stats = timings.stats()['gnss_to_ping_age']
+    assert stats['count'] == 5
+    assert stats['min'] == pytest.approx(-3.0)
+    assert stats['max'] == pytest.approx(0.2)
+    # Percentiles are within a bin width, 20 bins a decade
+    assert stats['p50'] == pytest.approx(-3.0, rel=0.13)
+    assert stats['p90'] == pytest.approx(0.2, rel=0.13)
+
+
+def test_sonar_logging_timed_before_a_gga():
+    now = dt.time(14, 0, 0)
+    gnss = FakeGNSS(now)
+    gnss.gps_found = False
+    acquisition = make_acquisition(gnss, FakeSonar(now, []),
+                                   timings=osplib.Timings())
+    stats = run(acquisition, 0.1)
+    assert stats['soundings'] == 0
+    assert stats['timings']['log_sonar']['count'] == stats['received']['Sonar'] > 0
+
+
+def test_flag_log_matches_flag_raw_log(tmp_path):
+    now = dt.time(14, 0, 0)
+    distances = [3.0, 3.1, 3.0, 3.05, 9.0, 3.1, 0.0, 3.0, 3.02, 3.1, 3.0, 3.05]*5
+    acquisition = make_acquisition(FakeGNSS(now), FakeSonar(now, distances),
+                                   spike_filter=osplib.SpikeFilter(window=5),
+                                   flag_log=io.StringIO())
+    run(acquisition)
+
+    metadata = dict(METADATA)
+    files = {}
+    for filetype, log in (('OSP_RAW_LOG', acquisition.raw_log),
+                          ('OSP_FLAG_LOG', acquisition.flag_log)):
+        files[filetype] = str(tmp_path / (filetype + '.csv'))
+        metadata['filetype'] = [filetype]
+        osplib.write_meta_header(files[filetype], metadata)
+        with open(files[filetype], 'a') as file:
+            file.write(log.getvalue())
+
+    flags = osplib.read_flag_log_columns(files['OSP_FLAG_LOG'])['Data']
+    raw_log = osplib.read_raw_log_columns(files['OSP_RAW_LOG'])
+    assert len(flags) == len(raw_log['Data']['DEPTH']) > len(distances)
+    numpy.testing.assert_array_equal(flags['time'], raw_log['Data']['DEPTH']['time'])
+    offline = osplib.flag_raw_log(raw_log, window=5, centered=False)
+    numpy.testing.assert_array_equal(flags['flags'], offline)
+    assert numpy.count_nonzero(offline & osplib.FLAG_SPIKE) == 5
+    assert numpy.count_nonzero(offline & osplib.FLAG_INVALID) == 5
+
+
+class CheckedSonar(osp_benchmark.ReplaySonar):
+    # Replayed sonar noting any sound speed set while a ping is under way
+    def __init__(self):
+        super().__init__()
+        self.pinging = False
+        self.overlaps = 0
+        self.speeds = []
+
+    def send_ping(self):
+        self.pinging = True
+        time.sleep(0.002)
+        self.pinging = False
+        return super().send_ping()
+
+    def set_sound_speed(self, soundspeed):
+        self.overlaps += self.pinging
+        self.speeds.append(soundspeed)
+        time.sleep(0.001)
+        return super().set_sound_speed(soundspeed)
+
+
+def test_svp_poller_smooths_and_sets_changed_speeds():
+    sonar = osp_benchmark.ReplaySonar()
+    updates = []
+    poller = osplib.SVPPoller(osp_benchmark.ReplaySVP(
+        [1480.0, 1480.2, 1490.0, None, 1480.1, 1485.0, 1486.0]), sonar,
+        window=3, threshold=0.5, callback=lambda time, speed: updates.append(speed))
+    for i in range(7):
+        poller.poll()
+    assert poller.errors == 1
+    series = poller.get_series()
+    assert series['raw'].tolist() == [1480.0, 1480.2, 1490.0, 1480.1, 1485.0, 1486.0]
+    assert series['speed'].tolist() == [1480.0, 1480.1, 1480.2, 1480.2, 1485.0, 1485.0]
+    # Only moves of at least threshold m/s reach the sonar
+    assert updates == [1480.0, 1485.0]
+    assert sonar.sound_speed == poller.sonar_speed == 1485.0
+
+
+def test_take_observation_shares_the_sonar_with_the_poller():
+    sentences = [nmea('GNGGA,140000.00,4530.123456,N,06330.654321,W,4,12,0.8,'
+                      '10.0,M,-20.0,M,1.0,0000')]
+    sonar = CheckedSonar()
+    poller = osplib.SVPPoller(osp_benchmark.ReplaySVP([1480.0, 1500.0]), sonar,
+                              interval=0.0005, window=1)
+    poller.start()
+    obs_numb, speed = 0, 1485.0
+    try:
+        for i in range(100):
+            obs_numb, speed = osplib.take_observation(
+                METADATA, osp_benchmark.ReplayGNSS(sentences), sonar, None, speed,
+                False, obs_numb, io.StringIO(), io.StringIO(), console=Console(),
+                svp_poller=poller)
+    finally:
+        poller.stop()
+    assert len(sonar.speeds) > 20
+    assert sonar.overlaps == 0
+    assert speed in (1480.0, 1500.0)
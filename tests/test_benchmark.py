@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+
+import numpy
+import pytest
+
+pynmea2 = pytest.importorskip('pynmea2')
+
+import osp_benchmark
+import osplib
+
+
+def test_nmea_format_carries_minutes_into_degrees():
+    formatted = osp_benchmark.nmea_format(numpy.array([45.99999999999, -63.5, -0.25]), 3)
+    assert formatted == [('04600.000000', 'E'), ('06330.000000', 'W'),
+                         ('00015.000000', 'W')]
+    assert osp_benchmark.nmea_format(numpy.array([-9.999999999]), 2) == \
+        [('1000.000000', 'S')]
+
+
+def test_synthetic_raw_log_reads_back(tmp_path):
+    raw_file = str(tmp_path / 'raw.csv')
+    osp_benchmark.write_synthetic_raw_log(raw_file, 700, chunk_size=30)
+    columns = osplib.read_raw_log_columns(raw_file)['Data']
+    assert sum(len(array) for array in columns.values()) == 700
+    assert len(columns['GGA']) == 100 and len(columns['DEPTH']) == 300
+
+    track = osp_benchmark.synthetic_track(100)
+    lat = osplib.nmea_to_dd_array(columns['GGA']['lat'], columns['GGA']['lat_hem'])
+    numpy.testing.assert_allclose(lat, track['lat'], atol=1e-8)
+    # Checksums are right
+    with open(raw_file) as file:
+        for line in file.read().splitlines()[-7:]:
+            if '$GN' in line:
+                pynmea2.parse(line.split(',', 1)[1], check=True)
+
+
+def test_measure_reports_latency():
+    result = osp_benchmark.measure(lambda: sum(range(1000)), 1000, repeats=4)
+    for key in ('rows_per_s', 'peak_mb', 'p50_us', 'p90_us', 'p99_us', 'max_us'):
+        assert result[key] >= 0
+    assert result['p50_us'] <= result['max_us']
+
+
+def test_import_loads_no_sensor_libraries():
+    code = ('import sys, osplib; print(",".join(m for m in '
+            '("serial", "brping", "pynmea2", "geopy") if m in sys.modules))')
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=directory,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
+
+
+def test_import_within_budget():
+    result = osp_benchmark.benchmark_import(repeats=3)
+    assert result['loaded'] == []
+    assert 0 < result['import_ms'] < osp_benchmark.IMPORT_BUDGET_MS
@@ -0,0 +1,54 @@
+import numpy
+import pytest
+
+import osplib
+
+geopy = pytest.importorskip('geopy')
+
+
+def positions():
+    rng = numpy.random.default_rng(3)
+    lat = rng.uniform(-80, 80, 200)
+    long = rng.uniform(-180, 180, 200)
+    course = rng.uniform(0, 360, 200)
+    return lat, long, course
+
+
+@pytest.mark.parametrize('offset', [[0.2, 0.5], [-1.5, 3.0], [2.0, -0.7], [-0.3, -0.4]])
+def test_offsets_array_matches_geopy(offset):
+    lat, long, course = positions()
+    rows = [{'Lat': a, 'Long': b, 'Course': c} for a, b, c in
+            zip(lat.tolist(), long.tolist(), course.tolist())]
+    expected = numpy.array(osplib.compute_horizontal_offsets(offset, rows))
+    sonar_lat, sonar_long = osplib.compute_horizontal_offsets_array(offset, lat, long, course)
+
+    import geopy.distance
+    for i in range(len(rows)):
+        assert geopy.distance.geodesic((sonar_lat[i], sonar_long[i]),
+                                       tuple(expected[i])).meters < 1e-6
+
+
+def test_geodesic_destination_matches_geopy_over_long_distances():
+    import geopy.distance
+    lat, long, course = positions()
+    distance = numpy.geomspace(0.01, 1e6, len(lat))
+    dest_lat, dest_long = osplib.geodesic_destination(lat, long, course, distance)
+    for i in range(0, len(lat), 10):
+        point = geopy.distance.geodesic(meters=distance[i]).destination(
+            (lat[i], long[i]), bearing=course[i])
+        assert geopy.distance.geodesic((dest_lat[i], dest_long[i]),
+                                       (point.latitude, point.longitude)).meters < 1e-4
+
+
+def test_zero_lever_arm_with_unknown_course():
+    lat, long = osplib.compute_horizontal_offsets_array(
+        [0, 0], [45.5, 45.6], [-63.5, -63.4], [numpy.nan, 10.0])
+    assert lat.tolist() == [45.5, 45.6]
+    assert long.tolist() == [-63.5, -63.4]
+    rows = [{'Lat': 45.5, 'Long': -63.5, 'Course': numpy.nan}]
+    assert osplib.compute_horizontal_offsets([0, 0], rows) == [[45.5, -63.5]]
+
+
+def test_unknown_course_with_lever_arm_is_nan():
+    lat, long = osplib.compute_horizontal_offsets_array([0.2, 0.5], [45.5], [-63.5], [numpy.nan])
+    assert numpy.isnan(lat).all() and numpy.isnan(long).all()
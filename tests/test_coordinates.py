@@ -0,0 +1,68 @@
+import numpy
+import pytest
+
+import osplib
+from conftest import nmea
+
+
+DMS = ['453007', '-453007', '0633039', '-0633039', '45:30:07', '-45:30:07',
+       '063:30:39', '-063:30:39', '45,30,07', '45°30°07', '000000', '1795959']
+
+
+def test_dms_array_matches_scalar():
+    numpy.testing.assert_allclose(osplib.dms_to_dd_array(DMS),
+                                  [osplib.dms_to_dd(dms) for dms in DMS])
+
+
+def test_dms_array_hemispheres():
+    dd = osplib.dms_to_dd_array(['453007N', '453007S', '0633039E', '0633039W',
+                                 '45 30 07 S', '063°30\'39"W'])
+    expected = [osplib.dms_to_dd('453007'), -osplib.dms_to_dd('453007'),
+                osplib.dms_to_dd('0633039'), -osplib.dms_to_dd('0633039')]
+    numpy.testing.assert_allclose(dd, expected + [expected[1], expected[3]])
+
+
+def test_dms_array_minutes_and_seconds_near_60():
+    dd = osplib.dms_to_dd_array(['455959', '45:59:59.99', '456000', '455960',
+                                 '45:60:00', '45:59:60'])
+    numpy.testing.assert_allclose(dd[:2], [osplib.dms_to_dd('455959'),
+                                           45 + 59/60 + 59.99/3600])
+    assert numpy.isnan(dd[2:]).all()
+
+
+def test_dms_array_bad_entries_are_nan():
+    dd = osplib.dms_to_dd_array(['', ' ', 'abc', '45:3x:07', '-453007S', '4530',
+                                 '45:30', '45.5:30:07', '1815959', '453007'])
+    assert numpy.isnan(dd[:-1]).all()
+    assert dd[-1] == osplib.dms_to_dd('453007')
+    assert osplib.dms_to_dd_array([]).shape == (0,)
+
+
+def scalar_nmea(value, hemisphere):
+    # The conversion pynmea2 makes for the GGA of one position
+    pynmea2 = pytest.importorskip('pynmea2')
+    if hemisphere in 'NS':
+        body = 'GNGGA,140000.00,%s,%s,06330.0,W,4,12,0.8,10.0,M,-20.0,M,1.0,0000'
+        return pynmea2.parse(nmea(body % (value, hemisphere))).latitude
+    body = 'GNGGA,140000.00,4530.0,N,%s,%s,4,12,0.8,10.0,M,-20.0,M,1.0,0000'
+    return pynmea2.parse(nmea(body % (value, hemisphere))).longitude
+
+
+def test_nmea_array_matches_scalar_with_mixed_hemispheres():
+    values = ['4530.123456', '4530.123456', '06330.654321', '06330.654321',
+              '0000.000001', '8959.999999', '17959.999999', '4559.999999']
+    hemispheres = ['N', 'S', 'E', 'W', 'S', 'N', 'W', 'S']
+    expected = [scalar_nmea(*pair) for pair in zip(values, hemispheres)]
+    numpy.testing.assert_allclose(osplib.nmea_to_dd_array(values, hemispheres), expected)
+    # Numbers, as read_raw_log_columns gives them, and bytes hemispheres
+    numpy.testing.assert_allclose(osplib.nmea_to_dd_array(
+        numpy.array(values, dtype=float), numpy.array(hemispheres, dtype='S1')), expected)
+
+
+def test_nmea_array_bad_values_are_nan():
+    dd = osplib.nmea_to_dd_array(['4560.0', '4599.9', '', 'abc', '-4530.0', '9100.0',
+                                  '18100.0', '4530.0', '4530.0', '4530.0'],
+                                 ['N', 'N', 'N', 'N', 'N', 'S', 'E', '', 'X', 'N'])
+    assert numpy.isnan(dd[:-1]).all()
+    assert dd[-1] == 45.5
+    assert osplib.nmea_to_dd_array([], []).shape == (0,)
@@ -0,0 +1,259 @@
+import os
+import time
+
+import numpy
+import pytest
+
+import osplib
+from conftest import METADATA, survey_lines, write_log
+
+
+def body_lines(filename):
+    with osplib.open_log(filename) as file:
+        lines = file.read().splitlines()
+    return lines[lines.index('Header_End') + 1:]
+
+
+def test_binary_round_trip_keeps_the_logged_text(tmp_path):
+    # Crosses midnight, with leading zeros, integer fields and checksums
+    lines = survey_lines(count=10, start=86400 - 1)
+    raw_file = write_log(str(tmp_path / 'raw.csv'), lines)
+    binary_file = str(tmp_path / 'raw.osb')
+    copy_file = str(tmp_path / 'copy.csv')
+
+    osplib.raw_log_to_binary(raw_file, binary_file)
+    osplib.binary_to_raw_log(binary_file, copy_file)
+    assert body_lines(copy_file) == lines
+    assert osplib.read_config_file(copy_file) == osplib.read_config_file(raw_file)
+
+    binary = osplib.read_raw_binary(binary_file)
+    columns = osplib.read_raw_log_columns(raw_file)
+    for key, array in columns['Data'].items():
+        for name in array.dtype.names:
+            numpy.testing.assert_array_equal(binary['Data'][key][name], array[name])
+
+
+def test_columns_written_in_file_order(tmp_path):
+    lines = survey_lines(count=10, start=86400 - 1)
+    raw_file = write_log(str(tmp_path / 'raw.csv'), lines)
+    copy_file = str(tmp_path / 'copy.csv')
+
+    osplib.write_raw_log_columns(copy_file, osplib.read_raw_log_columns(raw_file))
+    copy = body_lines(copy_file)
+    assert [line.split(',')[:2] for line in copy] == \
+        [line.split(',')[:2] for line in lines]
+
+
+def hsx_records(filename, record):
+    with open(filename) as file:
+        return [line.split() for line in file if line.startswith(record + ' ')]
+
+
+def test_hsx_from_every_reader_matches(raw_file, tmp_path):
+    outputs = []
+    for name, raw_log in [('dict', osplib.read_raw_log(raw_file)),
+                          ('columns', osplib.read_raw_log_columns(raw_file))]:
+        outputs.append(str(tmp_path / (name + '.hsx')))
+        osplib.write_hsx(outputs[-1], raw_log)
+    outputs.append(str(tmp_path / 'stream.hsx'))
+    osplib.raw_log_to_hsx(raw_file, outputs[-1], chunk_size=7)
+
+    soundings = [hsx_records(output, 'EC1') for output in outputs]
+    assert soundings[0] == soundings[1] == soundings[2]
+    assert [float(record[3]) for record in soundings[0]] == \
+        pytest.approx(3.06 + 0.01*numpy.arange(20))
+    fixes = [hsx_records(output, 'RAW') for output in outputs]
+    assert fixes[0] == fixes[1] == fixes[2]
+    assert len(fixes[0]) == 20
+    # 45 30.123456 N 063 30.654321 W as signed ddmmss.sssss
+    assert fixes[0][0][2:6] == ['50400.000', '4', '453007.40736', '-633039.25926']
+    assert fixes[0][1][4:6] == ['453007.40748', '-633039.25914']
+
+
+def compressed_copy(tmp_path, lines, name='gz.csv'):
+    return write_log(str(tmp_path / name), lines, compress=True)
+
+
+def test_compressed_log_reads_like_plain(tmp_path):
+    lines = survey_lines(count=200)
+    plain_file = write_log(str(tmp_path / 'plain.csv'), lines)
+    compressed_file = compressed_copy(tmp_path, lines)
+    assert osplib.is_compressed_log(compressed_file)
+    assert not osplib.is_compressed_log(plain_file)
+    assert os.path.getsize(compressed_file) < os.path.getsize(plain_file)
+
+    assert osplib.read_config_file(compressed_file) == osplib.read_config_file(plain_file)
+    assert body_lines(compressed_file) == lines
+    plain = osplib.read_raw_log_columns(plain_file)['Data']
+    compressed = osplib.read_raw_log_columns(compressed_file)['Data']
+    for key, array in plain.items():
+        for name in array.dtype.names:
+            numpy.testing.assert_array_equal(compressed[key][name], array[name])
+    assert osplib.read_raw_log(compressed_file)['Data'] == \
+        osplib.read_raw_log(plain_file)['Data']
+
+
+def test_compressed_log_time_range_uses_the_index(tmp_path):
+    lines = []
+    for i in range(60):
+        lines.extend(survey_lines(count=1, start=14*3600 + 20*i))
+    compressed_file = compressed_copy(tmp_path, lines)
+    osplib.build_raw_log_index(compressed_file)
+    assert osplib.read_raw_log_index(compressed_file) is not None
+
+    columns = osplib.read_raw_log_columns(compressed_file, '14:05:00', '14:09:59')
+    assert len(columns['Data']['GGA']) == 15
+    assert columns['Data']['GGA']['time'][0] == 14*3600 + 300
+
+
+def test_truncated_compressed_log_keeps_finished_blocks(tmp_path):
+    lines = survey_lines(count=2000)
+    compressed_file = str(tmp_path / 'gz.csv')
+    metadata = dict(METADATA)
+    osplib.write_meta_header(compressed_file, metadata, compress=True)
+    with osplib.BlockCompressedLog(compressed_file, block_size=4096) as file:
+        for line in lines:
+            file.write(line + '\n')
+    with open(compressed_file, 'r+b') as file:
+        file.truncate(os.path.getsize(compressed_file) - 1000)
+
+    columns = osplib.read_raw_log_columns(compressed_file)['Data']
+    read = sum(len(array) for array in columns.values())
+    # Only the lines of the cut block, at most about 4 kB, are lost
+    assert len(lines) - 100 < read < len(lines)
+    assert len(list(osplib.iter_raw_log_rows(compressed_file))) == read
+
+
+def test_follower_reads_compressed_blocks_as_written(tmp_path):
+    lines = survey_lines(count=200)
+    compressed_file = str(tmp_path / 'gz.csv')
+    osplib.write_meta_header(compressed_file, dict(METADATA), compress=True)
+    follower = osplib.RawLogFollower(compressed_file)
+
+    log = osplib.BlockCompressedLog(compressed_file, block_size=2048)
+    read = []
+    for line in lines:
+        log.write(line + '\n')
+        log.flush()
+        read.extend(follower.read_lines())
+    # Lines still in the block being filled are not on disk yet
+    assert 0 < len(read) < len(lines)
+    log.close()
+    read.extend(follower.read_lines())
+    assert [line.decode().rstrip('\r') for line in read] == lines
+    assert follower.metadata == osplib.read_config_file(compressed_file)
+
+
+def rotated_log(directory, lines, compress=False):
+    metadata = dict(METADATA)
+    log = osplib.RotatingLog(str(directory / 'session.csv'), metadata,
+                             max_bytes=2000, compress=compress)
+    for line in lines:
+        log.write(line + '\n')
+    return log
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_rotated_log_reads_as_one_log(tmp_path, compress):
+    lines = survey_lines(count=40)
+    closed = []
+    log = rotated_log(tmp_path, lines, compress)
+    log.on_close = closed.append
+    log.close()
+    log.close()
+
+    manifest = osplib.read_log_manifest(log.filename)
+    segments = [segment['Segment'] for segment in manifest['Segments']]
+    assert len(segments) > 3 and closed == segments[-1:]
+    assert all(segment['Closed'] for segment in manifest['Segments'])
+    assert sum(segment['Records'] for segment in manifest['Segments']) == len(lines)
+    assert [line for segment in segments for line in body_lines(segment)] == lines
+
+    columns = osplib.read_raw_log_columns(log.filename)['Data']
+    assert len(columns['GGA']) == len(columns['DEPTH']) == 40
+    assert len(list(osplib.iter_raw_log_rows(log.filename))) == len(lines)
+    # Only the segments holding the time range are read
+    assert len(osplib.manifest_segments(manifest, '14:00:07', '14:00:07.5')) < len(segments)
+    columns = osplib.read_raw_log_columns(log.filename, '14:00:07', '14:00:07.5')
+    assert columns['Data']['GGA']['time'].tolist() == \
+        pytest.approx([14*3600 + 7, 14*3600 + 7.2, 14*3600 + 7.4])
+
+
+def test_find_raw_logs_leaves_out_open_segments(tmp_path):
+    write_log(str(tmp_path / 'other.csv'), survey_lines(count=2))
+    log = rotated_log(tmp_path, survey_lines(count=40))
+    segments = [segment['Segment'] for segment in log.segments]
+    assert osplib.find_raw_logs(str(tmp_path)) == \
+        [str(tmp_path / 'other.csv')] + segments[:-1]
+    assert osplib.find_raw_logs(log.filename) == segments[:-1]
+    log.close()
+    assert osplib.find_raw_logs(str(tmp_path)) == [str(tmp_path / 'other.csv')] + segments
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_log_writer_keeps_order_and_flushes_on_close(tmp_path):
+    lines = ['%d\n' % i for i in range(2500)]
+    filename = str(tmp_path / 'log.csv')
+    writer = osplib.LogWriter(open(filename, 'w'), flush_lines=100,
+                              flush_interval=60.0)
+    for line in lines[:-10]:
+        writer.write(line)
+    # Batches of flush_lines are written without waiting for the interval
+    assert wait_for(lambda: writer.lines_written >= 2400)
+    for line in lines[-10:]:
+        writer.write(line)
+    writer.close()
+    assert writer.file.closed
+    with open(filename) as file:
+        assert file.read() == ''.join(lines)
+
+
+def test_log_writer_flushes_every_interval_and_on_flush(tmp_path):
+    filename = str(tmp_path / 'log.csv')
+    writer = osplib.LogWriter(open(filename, 'w'), flush_lines=1000,
+                              flush_interval=0.05)
+    writer.write('a\n')
+    assert wait_for(lambda: writer.lines_written == 1)
+    with open(filename) as file:
+        assert file.read() == 'a\n'
+
+    writer.flush_interval = 60.0
+    time.sleep(0.1)
+    writer.write('b\n')
+    writer.flush()
+    with open(filename) as file:
+        assert file.read() == 'a\nb\n'
+    writer.close()
+
+
+class FullFile:
+    # File that fails to write as a full disk would
+    closed = False
+
+    def write(self, text):
+        raise OSError(28, 'No space left on device')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_log_writer_raises_the_write_error():
+    writer = osplib.LogWriter(FullFile(), flush_lines=2)
+    writer.write('a\n')
+    writer.write('b\n')
+    with pytest.raises(OSError):
+        writer.flush()
+    with pytest.raises(OSError):
+        writer.write('c\n')
+    with pytest.raises(OSError):
+        writer.close()
+    assert writer.file.closed
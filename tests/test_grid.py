@@ -0,0 +1,85 @@
+import numpy
+import pytest
+
+import osplib
+
+
+def test_grid_statistics_per_cell():
+    grid = osplib.Grid(1.0, origin=(45.5, -63.5), tile_size=4)
+    lat, long = osplib.local_latlong(numpy.array([0.2, 0.7, 10.5]),
+                                     numpy.array([0.4, 0.1, 10.5]), grid.origin)
+    grid.add(lat, long, [2.0, 4.0, 7.0])
+    grid.add(lat[:1], long[:1], [6.0])
+    surface = grid.surface()
+
+    filled = surface['count'] > 0
+    assert sorted(surface['count'][filled].tolist()) == [1, 3]
+    cell = surface['count'] == 3
+    assert surface['mean'][cell] == 4.0
+    assert surface['min'][cell] == 2.0 and surface['max'][cell] == 6.0
+    numpy.testing.assert_allclose(surface['std'][cell], numpy.std([2.0, 4.0, 6.0]))
+
+
+def test_grid_save_and_load(tmp_path):
+    grid = osplib.Grid(2.0, field='height', tile_size=8)
+    grid.add([45.5, 45.5001], [-63.5, -63.5001], [1.0, 2.0])
+    grid.save(str(tmp_path / 'grid.npz'))
+    loaded = osplib.Grid.load(str(tmp_path / 'grid.npz'))
+    assert loaded.origin == grid.origin and loaded.field == 'height'
+    for name, array in grid.surface().items():
+        numpy.testing.assert_array_equal(loaded.surface()[name], array)
+
+
+def test_empty_grid_save_and_load(tmp_path):
+    grid = osplib.Grid(1.0)
+    grid.save(str(tmp_path / 'grid.npz'))
+    loaded = osplib.Grid.load(str(tmp_path / 'grid.npz'))
+    assert loaded.origin is None and loaded.tiles == {}
+    assert loaded.surface() is None
+    loaded.add(45.5, -63.5, 3.0)
+    assert loaded.origin == (45.5, -63.5)
+
+
+def line_soundings(x, y, seabed, water_level):
+    # Soundings along a line in local metres around the test origin, the
+    # depth changes with the water level but the seabed height does not
+    soundings = numpy.zeros(len(x), dtype=osplib.SIMPLE_LOG_FIELDS)
+    soundings['lat'], soundings['long'] = osplib.local_latlong(
+        numpy.asarray(x, dtype=float), numpy.asarray(y, dtype=float), (45.5, -63.5))
+    soundings['height'] = seabed
+    soundings['depth'] = water_level - seabed
+    soundings['time'] = numpy.arange(len(x))
+    return soundings
+
+
+def test_crossline_report_uses_heights():
+    steps = numpy.arange(-20, 21, 0.5)
+    main = line_soundings(steps, numpy.zeros_like(steps), -10.0, 0.0)
+    # Run at a higher tide, the depths are 0.8 m more
+    cross = line_soundings(numpy.zeros_like(steps), steps, -10.02, 0.8)
+    index = osplib.SoundingIndex([main, cross], cell_size=2.0)
+    assert index.field == 'height'
+
+    summary = osplib.crossline_report(index, 1, radius=1.0)['Data']['summary']
+    assert len(summary) == 1 and summary['count'][0] > 0
+    assert summary['mean'][0] == pytest.approx(-0.02)
+
+    depths = osplib.SoundingIndex([main, cross], cell_size=2.0, field='depth')
+    summary = osplib.crossline_report(depths, 1, radius=1.0)['Data']['summary']
+    assert summary['mean'][0] == pytest.approx(0.82)
+
+
+def test_sounding_index_save_and_load(tmp_path):
+    steps = numpy.arange(-20, 21, 0.5)
+    index = osplib.SoundingIndex(line_soundings(steps, steps, -10.0, 0.0))
+    index.save(str(tmp_path / 'index.npz'))
+    loaded = osplib.SoundingIndex.load(str(tmp_path / 'index.npz'))
+    assert loaded.origin == index.origin
+    numpy.testing.assert_array_equal(loaded.query_radius(45.5, -63.5, 3.0),
+                                     index.query_radius(45.5, -63.5, 3.0))
+
+    empty = osplib.SoundingIndex()
+    empty.save(str(tmp_path / 'empty.npz'))
+    loaded = osplib.SoundingIndex.load(str(tmp_path / 'empty.npz'))
+    assert loaded.origin is None and loaded.lines == []
+    assert len(loaded.value) == 0
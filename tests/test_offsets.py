@@ -0,0 +1,23 @@
+import numpy
+
+import osplib
+
+
+# Sonar positions given by compute_horizontal_offsets, with geopy, for each
+# lever arm, antenna position and course
+GEOPY_OFFSETS = [
+    ([0.2, 0.5], 45.5, -63.5, 30.0, 45.500002996294, -63.499994585267),
+    ([-1.5, 3.0], -33.9, 151.2, 275.5, -33.900010868670, 151.199966160035),
+    ([2.0, -0.7], 64.1, -21.9, 180.0, 64.100006279195, -21.900041019946),
+    ([-0.3, -0.4], 0.0, 179.99999, 90.0, 0.000002713109, 179.999986406739),
+    ([0.25, 1.1], -77.8, 166.7, 359.9, -77.799990143324, 166.700010511804),
+]
+
+
+def test_offsets_array_matches_geopy_output():
+    for offset, lat, long, course, sonar_lat, sonar_long in GEOPY_OFFSETS:
+        lat_array, long_array = osplib.compute_horizontal_offsets_array(
+            offset, numpy.array([lat]*3), numpy.array([long]*3), numpy.array([course]*3))
+        # 1e-9 degrees is about 0.1 mm
+        numpy.testing.assert_allclose(lat_array, sonar_lat, rtol=0, atol=1e-9)
+        numpy.testing.assert_allclose(long_array, sonar_long, rtol=0, atol=1e-9)
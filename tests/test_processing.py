@@ -0,0 +1,153 @@
+import numpy
+import pytest
+
+import osplib
+from conftest import nmea, survey_lines, write_log
+
+
+def test_process_raw_log_writes_soundings(tmp_path):
+    raw_file = write_log(str(tmp_path / 'raw.csv'), survey_lines())
+    (tmp_path / 'out').mkdir()
+    output = osplib.process_raw_log(raw_file, str(tmp_path / 'out'))
+    assert output.endswith('raw_soundings.csv')
+
+    soundings = osplib.read_simple_log_columns(output)['Data']
+    raw_columns = osplib.read_raw_log_columns(raw_file)
+    antenna = osplib.compute_soundings(raw_columns)
+    assert len(soundings) == len(raw_columns['Data']['DEPTH']) == 20
+    numpy.testing.assert_allclose(soundings['depth'], antenna['depth'])
+    numpy.testing.assert_allclose(soundings['height'], antenna['height'])
+    # Every ping has a course, so the lever arm is applied to every ping
+    assert not numpy.isnan(soundings['lat']).any()
+    assert (numpy.abs(soundings['lat'] - antenna['lat']) > 1e-7).all()
+
+
+def test_course_falls_back_to_vtg(tmp_path):
+    lines = [line for line in survey_lines() if 'RMC' not in line]
+    raw_columns = osplib.read_raw_log_columns(
+        write_log(str(tmp_path / 'raw.csv'), lines))
+    times = raw_columns['Data']['DEPTH']['time']
+    course = osplib.course_over_ground(raw_columns, numpy.concatenate([[0.0], times]))
+    assert numpy.isnan(course[0])
+    numpy.testing.assert_allclose(course[1:], 45.0)
+
+
+def test_process_survey_reports_each_file(tmp_path):
+    source = tmp_path / 'raw'
+    source.mkdir()
+    write_log(str(source / 'a.csv'), survey_lines())
+    # A raw log cut off in its header
+    (source / 'b.csv').write_text("['OSP_RAW_LOG']\nHeader_Start\n")
+    results = osplib.process_survey(str(source), str(tmp_path / 'out'), processes=2)
+    assert list(results) == [str(source / 'a.csv'), str(source / 'b.csv')]
+    assert results[str(source / 'a.csv')]['Error'] is None
+    assert results[str(source / 'b.csv')]['Output'] is None
+    assert results[str(source / 'b.csv')]['Error'] is not None
+
+
+def test_process_survey_takes_raw_logs_only(tmp_path):
+    for day in ('day1', 'day2'):
+        (tmp_path / day).mkdir()
+        write_log(str(tmp_path / day / 'line.csv'), survey_lines())
+    write_log(str(tmp_path / 'day1' / 'simple.csv'), [], filetype='OSP_SIMPLE_LOG')
+    write_log(str(tmp_path / 'day1' / 'flags.csv'), [], filetype='OSP_FLAG_LOG')
+    (tmp_path / 'day1' / 'config.csv').write_text('Survey,Test\n')
+    (tmp_path / 'day1' / 'empty.csv').write_text('')
+    assert osplib.find_raw_logs(str(tmp_path / 'day1')) == \
+        [str(tmp_path / 'day1' / 'line.csv')]
+
+    results = osplib.process_survey(str(tmp_path / '*' / '*.csv'),
+                                    str(tmp_path / 'out'), processes=1)
+    assert [result['Output'] for result in results.values()] == \
+        [str(tmp_path / 'out' / day / 'line_soundings.csv') for day in ('day1', 'day2')]
+    for result in results.values():
+        assert len(osplib.read_simple_log_columns(result['Output'])['Data']) == 20
+
+
+def test_soundings_skip_fixes_without_a_position(tmp_path):
+    lines = survey_lines()
+    # A GGA with no fix in the middle, and a line with a bad time
+    lines[50] = lines[50].split(',')[0] + ',' + nmea('GNGGA,140002.00,,,,,0,00,99.9,,,,,,')
+    lines.insert(30, 'xx:xx:xx.xxxxxx,' + lines[30].split(',', 1)[1])
+    raw_columns = osplib.read_raw_log_columns(write_log(str(tmp_path / 'raw.csv'), lines))
+    assert len(raw_columns['Data']['GGA']) == 21
+
+    soundings = osplib.compute_soundings(raw_columns)
+    assert len(soundings) == 20
+    assert not numpy.isnan(soundings['lat']).any()
+    assert not numpy.isnan(soundings['long']).any()
+    assert not numpy.isnan(soundings['height']).any()
+    numpy.testing.assert_allclose(numpy.diff(soundings['long']), 2e-6/60, rtol=1e-3)
+
+
+def test_correct_depths_for_a_speed_and_a_cast():
+    depth = numpy.array([15.0, 30.0, 30.0])
+    speed = numpy.array([1500.0, 1500.0, numpy.nan])
+    numpy.testing.assert_allclose(osplib.correct_depths(depth, speed, 1450.0),
+                                  [14.5, 29.0, 30.0])
+    # A cast of one speed is the same as that speed, from any draft
+    numpy.testing.assert_allclose(
+        osplib.correct_depths(depth, speed, ([1.0, 50.0], [1450.0, 1450.0]), draft=0.5),
+        [14.5, 29.0, 30.0])
+
+    # Layers of 1450 m/s then 1450 to 1550 m/s, below the cast at 1550 m/s
+    cast = ([0.0, 10.0, 20.0], [1450.0, 1450.0, 1550.0])
+    cast_time = 10/1450 + 10*0.5*(1/1450 + 1/1550)
+    corrected = osplib.correct_depths(depth[:2], speed[:2], cast)
+    assert corrected[0] == pytest.approx(
+        10 + 10*(0.01 - 10/1450)/(cast_time - 10/1450))
+    assert corrected[1] == pytest.approx(20 + (0.02 - cast_time)*1550)
+
+
+def test_recorrect_raw_log_applies_the_profile(tmp_path):
+    osp_benchmark = pytest.importorskip('osp_benchmark')
+    raw_file = str(tmp_path / 'raw.csv')
+    osp_benchmark.write_synthetic_raw_log(raw_file, 700)
+    raw_columns = osplib.read_raw_log_columns(raw_file)
+    logged = raw_columns['Data']['DEPTH'].copy()
+
+    recorrected = osplib.recorrect_raw_log(raw_columns, 1450.0)
+    depth = recorrected['Data']['DEPTH']
+    numpy.testing.assert_allclose(depth['depth'], logged['depth']*1450/logged['speed'])
+    numpy.testing.assert_allclose(depth['speed'], 1450.0)
+    assert recorrected['Data']['GGA'] is raw_columns['Data']['GGA']
+    # The log read is left as it was
+    assert raw_columns['Data']['DEPTH'].tobytes() == logged.tobytes()
+
+    # Through a cast of one speed, from the Sonar waterline
+    cast = osplib.recorrect_raw_log(raw_columns, ([0.0, 100.0], [1450.0, 1450.0]))
+    numpy.testing.assert_allclose(cast['Data']['DEPTH']['depth'], depth['depth'])
+    numpy.testing.assert_allclose(cast['Data']['DEPTH']['speed'], 1450.0)
+
+
+def test_soundings_across_midnight(tmp_path):
+    # Ten epochs either side of midnight, heading north east
+    raw_file = write_log(str(tmp_path / 'raw.csv'), survey_lines(count=20, start=86400 - 2))
+    raw_columns = osplib.read_raw_log_columns(raw_file)
+    soundings = osplib.compute_soundings(raw_columns)
+    assert len(soundings) == 20
+    assert soundings['time'][9] > 86399 and soundings['time'][10] < 1
+    assert not numpy.isnan(soundings['lat']).any()
+    numpy.testing.assert_allclose(numpy.diff(soundings['lat']), 2e-6/60, rtol=1e-3)
+    numpy.testing.assert_allclose(numpy.diff(soundings['long']), 2e-6/60, rtol=1e-3)
+
+
+def test_soundings_near_a_fix_across_a_gap(tmp_path):
+    # No GGA from 1.0 s to 2.8 s, fixes at 0.8 s and 3.0 s
+    lines = survey_lines(count=20)
+    gaps = [line for line in lines[25:75] if 'GGA' in line]
+    lines = [line for line in lines if line not in gaps]
+    raw_columns = osplib.read_raw_log_columns(write_log(str(tmp_path / 'raw.csv'), lines))
+    soundings = osplib.compute_soundings(raw_columns, max_gap=0.5)
+    # Pings up to 0.4 s from a fix are kept
+    kept = ~numpy.isnan(soundings['lat'])
+    assert kept.tolist() == [True]*7 + [False]*6 + [True]*7
+    numpy.testing.assert_allclose(numpy.diff(soundings['lat'][kept][5:9]),
+                                  [2e-6/60, 7*2e-6/60, 2e-6/60], rtol=1e-3)
+
+
+def test_unwrap_days():
+    times = [86399.0, numpy.nan, 0.5, 86399.9, 1.0, 86399.5]
+    numpy.testing.assert_array_equal(
+        osplib.unwrap_days(times), [86399.0, numpy.nan, 86400.5, 86399.9, 86401.0, 86399.5])
+    assert osplib.unwrap_days([]).shape == (0,)
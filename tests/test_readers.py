@@ -0,0 +1,182 @@
+import math
+import os
+
+import numpy
+
+import osplib
+from conftest import survey_lines, write_log
+
+
+def test_columns_match_read_raw_log(raw_file):
+    raw_log = osplib.read_raw_log(raw_file)
+    columns = osplib.read_raw_log_columns(raw_file)
+    assert columns['Metadata'] == raw_log['Metadata']
+
+    gga = [line for line in raw_log['Data'] if line['type'] == 'GGA']
+    assert len(columns['Data']['GGA']) == len(gga) == 20
+    numpy.testing.assert_allclose(columns['Data']['GGA']['lat'],
+                                  [float(line['lat']) for line in gga])
+    numpy.testing.assert_allclose(columns['Data']['GGA']['long'],
+                                  [float(line['long']) for line in gga])
+    depths = [line for line in raw_log['Data'] if line['type'] == '$DEPTH']
+    numpy.testing.assert_allclose(columns['Data']['DEPTH']['depth'],
+                                  [line['depth'] for line in depths])
+    assert columns['Data']['GGA']['time'][1] == 14*3600 + 0.2
+
+
+def test_columns_skip_bad_lines_and_blank_numbers(tmp_path):
+    lines = survey_lines(4)
+    lines[1] = lines[1].replace('$DEPTH,3.06', '$DEPTH,abc')
+    lines.insert(3, '')
+    lines.insert(4, lines[2][:30])
+    lines.insert(5, 'x'*2000)
+    lines.insert(6, lines[0] + ',extra')
+    filename = write_log(str(tmp_path / 'raw.csv'), lines)
+
+    data = osplib.read_raw_log_columns(filename)['Data']
+    assert len(data['GGA']) == 4
+    assert len(data['RMC']) == 4
+    assert math.isnan(data['DEPTH']['depth'][0])
+    assert data['DEPTH']['depth'][1] == 3.07
+    assert numpy.isnan(data['RMC']['mag_var']).all()
+
+
+def test_columns_keep_file_order(raw_file):
+    data = osplib.read_raw_log_columns(raw_file)['Data']
+    rows = numpy.concatenate([array['row'] for array in data.values()])
+    assert sorted(rows.tolist()) == list(range(100))
+    assert data['GGA']['row'].tolist() == list(range(0, 100, 5))
+    assert data['DEPTH']['row'].tolist() == list(range(1, 100, 5))
+
+
+def test_columns_chunks_match_whole_read(raw_file):
+    whole = osplib.read_raw_log_columns(raw_file)['Data']
+    chunks = list(osplib.iter_raw_log_columns(raw_file, chunk_size=7))
+    assert len(chunks) == 15
+    for key, array in whole.items():
+        joined = numpy.concatenate([chunk[key] for chunk in chunks])
+        assert joined.tobytes() == array.tobytes()
+
+
+def test_columns_to_raw_log_with_nan_time(raw_file):
+    columns = osplib.read_raw_log_columns(raw_file)
+    columns['Data']['GGA']['time'][3] = numpy.nan
+    raw_log = osplib.columns_to_raw_log(columns)
+    assert len(raw_log['Data']) == 100
+    assert raw_log['Data'][15]['type'] == 'GGA'
+    assert raw_log['Data'][15]['time'] is None
+    assert [line['type'] for line in raw_log['Data'][:5]] == \
+        ['GGA', '$DEPTH', 'RMC', 'VTG', 'GLL']
+
+
+def test_iter_raw_log_streams_same_records(raw_file):
+    raw_log = osplib.read_raw_log(raw_file)
+    assert list(osplib.iter_raw_log(raw_file)) == raw_log['Data']
+    chunks = list(osplib.iter_raw_log(raw_file, chunk_size=30))
+    assert [len(chunk) for chunk in chunks] == [30, 30, 30, 10]
+    assert sum(chunks, []) == raw_log['Data']
+
+
+def test_readers_skip_blank_rows(tmp_path):
+    lines = survey_lines(3)
+    lines.insert(2, '')
+    lines.insert(6, '')
+    filename = write_log(str(tmp_path / 'raw.csv'), lines)
+
+    rows = osplib.generic_reader(filename, ',', 'Header_End', None)
+    assert len(rows) == 15
+    assert all(rows)
+    assert len(osplib.read_raw_log(filename)['Data']) == 15
+    assert len(list(osplib.iter_raw_log_rows(filename))) == 15
+    assert osplib.read_config_file(filename)['GNSS_Com'] == ['COM', '/dev/ttyUSB0', 115200]
+
+
+def test_time_range_read_streams_index_regions(tmp_path, monkeypatch):
+    # Epochs every 20 s over about half an hour, so there are many buckets
+    lines = []
+    for i in range(90):
+        lines.extend(survey_lines(count=1, start=14*3600 + 20*i))
+    raw_file = write_log(str(tmp_path / 'raw.csv'), lines)
+    assert osplib.build_raw_log_index(raw_file) is not None
+    monkeypatch.setattr(osplib, 'RAW_LOG_BLOCK', 200)
+
+    blocks = list(osplib.iter_raw_log_blocks(raw_file, '14:10:00', '14:20:00'))
+    assert max(sum(map(len, block)) for block in blocks) < 400
+    times = [line[:8].decode() for block in blocks for line in block]
+    assert times[0] == '14:10:00' and times[-1] == '14:20:40'
+
+    columns = osplib.read_raw_log_columns(raw_file, '14:10:00', '14:20:00')
+    every = osplib.read_raw_log_columns(raw_file)
+    for key, array in every['Data'].items():
+        inside = (array['time'] >= 14*3600 + 600) & (array['time'] <= 14*3600 + 1200)
+        # Rows count from the start of what was read
+        for name in array.dtype.names[:-1]:
+            numpy.testing.assert_array_equal(columns['Data'][key][name],
+                                             array[inside][name])
+
+
+def test_index_rebuilt_after_log_changes(tmp_path):
+    raw_file = write_log(str(tmp_path / 'raw.csv'), survey_lines())
+    osplib.build_raw_log_index(raw_file)
+    assert osplib.read_raw_log_index(raw_file) is not None
+
+    # Same size, different contents and modification time
+    with open(raw_file, 'r+b') as file:
+        file.seek(-3, 2)
+        file.write(b'XX\n')
+    stat = os.stat(raw_file)
+    os.utime(raw_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert os.path.getsize(raw_file) == stat.st_size
+    assert osplib.read_raw_log_index(raw_file) is None
+
+
+def test_read_raw_log_depths_in_metres(raw_file):
+    raw_log = osplib.read_raw_log(raw_file)
+    depths = [line for line in raw_log['Data'] if line['type'] == '$DEPTH']
+    numpy.testing.assert_allclose([line['depth'] for line in depths],
+                                  3.06 + 0.01*numpy.arange(20))
+    # The scan window is logged in mm
+    assert depths[0]['length'] == 10.0
+
+
+def test_follower_columns_match_finished_log(tmp_path):
+    # The log is written in random sized chunks that split lines and the
+    # header, with polls that find nothing new in between
+    lines = survey_lines(count=50)
+    filename = str(tmp_path / 'raw.csv')
+    write_log(filename, [])
+    with open(filename, 'rb') as file:
+        header = file.read()
+    data = header + b''.join(line.encode() + b'\n' for line in lines)
+    open(filename, 'wb').close()
+
+    own = osplib.RawLogFollower(filename)
+    given = osplib.RawLogFollower(filename)
+    raw_columns = {'Metadata': None,
+                   'Data': {key: osplib.raw_log_array(key, 0)
+                            for key in osplib.RAW_LOG_FIELDS}}
+    random = numpy.random.default_rng(3)
+    offset = 0
+    while offset < len(data):
+        size = int(random.integers(1, 400))
+        with open(filename, 'ab') as file:
+            file.write(data[offset:offset + size])
+        offset += size
+        for i in range(2):
+            followed = own.update()
+            given.update(raw_columns)
+
+    finished = osplib.read_raw_log_columns(filename)
+    for columns in (followed, raw_columns):
+        assert columns['Metadata'] == finished['Metadata']
+        for key, array in finished['Data'].items():
+            assert columns['Data'][key].tobytes() == array.tobytes()
+    assert len(followed['Data']['GGA']) == 50
+
+
+def test_follower_update_with_nothing_new(raw_file):
+    follower = osplib.RawLogFollower(raw_file)
+    assert len(follower.update()['Data']['GGA']) == 20
+    assert len(follower.update()['Data']['GGA']) == 20
+    columns = follower.read_columns()
+    assert all(len(array) == 0 for array in columns.values())
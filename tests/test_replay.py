@@ -0,0 +1,95 @@
+import os
+import select
+import struct
+import time
+
+import pytest
+
+pytest.importorskip('brping')
+if not hasattr(os, 'openpty'):
+    pytest.skip('pseudo-terminals are not available', allow_module_level=True)
+
+from brping import definitions, pingmessage
+
+import osp_replay
+from conftest import survey_lines, write_log
+
+
+def distance_frame(distance, number):
+    msg = pingmessage.PingMessage(definitions.PING1D_DISTANCE,
+                                  payload_dict=osp_replay.PING1D_PAYLOADS)
+    for name, value in zip(msg.payload_field_names,
+                           (distance, 100, 50, number, 0, 10000, 2)):
+        setattr(msg, name, value)
+    msg.pack_msg_data()
+    return bytes(msg.msg_data)
+
+
+def test_ping_frames_round_trip_through_the_parser():
+    frames = [distance_frame(3060 + i, i) for i in range(3)]
+    corrupt = bytearray(frames[1])
+    corrupt[10] ^= 0xFF
+    data = b'noise' + frames[0] + bytes(corrupt) + b'B' + frames[1] + frames[2]
+
+    parser = osp_replay.PingFrameParser()
+    messages = []
+    # Bytes arrive a few at a time, splitting frames anywhere
+    for i in range(0, len(data), 7):
+        messages.extend(parser.parse(data[i:i + 7]))
+    assert parser.errors == 1
+    assert [message_id for message_id, payload in messages] == \
+        [definitions.PING1D_DISTANCE]*3
+    for (message_id, payload), frame, number in zip(messages, frames, range(3)):
+        assert payload == frame[8:-2]
+        assert struct.unpack('<IHHI', payload[:12]) == (3060 + number, 100, 50, number)
+
+
+def read_port(port, until, timeout=5.0):
+    # Reads a pseudo-terminal until it has sent until lines, noting when
+    # each line arrived
+    lines = []
+    partial = b''
+    end = time.perf_counter() + timeout
+    while len(lines) < until and time.perf_counter() < end:
+        if not select.select([port.slave], [], [], 0.05)[0]:
+            continue
+        data = partial + os.read(port.slave, 4096)
+        now = time.perf_counter()
+        *complete, partial = data.split(b'\r\n')
+        lines.extend((now, line.decode()) for line in complete)
+    return lines
+
+
+def test_replay_sends_sentences_in_log_time(tmp_path):
+    # Ten epochs 0.2 s apart over midnight, replayed at ten times speed
+    lines = survey_lines(count=10, start=86400 - 1)
+    raw_file = write_log(str(tmp_path / 'raw.csv'), lines)
+    replay = osp_replay.Replay(raw_file, speed=10.0)
+    replay.start()
+    try:
+        received = read_port(replay.gnss_port, 40)
+        assert replay.finished.wait(5.0)
+
+        # The sonar answers a request with the last logged depth
+        request = pingmessage.PingMessage(definitions.COMMON_GENERAL_REQUEST)
+        request.requested_id = definitions.PING1D_DISTANCE
+        request.pack_msg_data()
+        os.write(replay.sonar_port.slave, bytes(request.msg_data))
+        parser = osp_replay.PingFrameParser()
+        messages = []
+        end = time.perf_counter() + 5.0
+        while not messages and time.perf_counter() < end:
+            if select.select([replay.sonar_port.slave], [], [], 0.05)[0]:
+                messages = parser.parse(os.read(replay.sonar_port.slave, 4096))
+    finally:
+        replay.stop()
+
+    sentences = [line.split(',', 1)[1] for line in lines if '$DEPTH' not in line]
+    assert [line for now, line in received] == sentences
+    # Epochs are sent 0.02 s apart in wall time, and in order
+    epochs = [now for now, line in received[::4]]
+    assert all(later >= earlier for earlier, later in zip(epochs, epochs[1:]))
+    assert epochs[-1] - epochs[0] > 0.9*9*0.02
+    assert replay.stats()['depths'] == 10
+    assert messages[0][0] == definitions.PING1D_DISTANCE
+    assert struct.unpack('<I', messages[0][1][:4])[0] == 3150
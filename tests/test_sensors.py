@@ -0,0 +1,189 @@
+import datetime as dt
+import queue
+import threading
+import time
+
+import pytest
+
+pynmea2 = pytest.importorskip('pynmea2')
+
+import osplib
+from conftest import METADATA, nmea
+
+
+class FakePort:
+    # Serial port reading the given chunks, then raising once they run out
+    def __init__(self, chunks, error=None):
+        self.chunks = list(chunks)
+        self.error = error
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size):
+        if self.chunks:
+            return self.chunks.pop(0)
+        if self.error is not None:
+            raise self.error
+        return b''
+
+    def close(self):
+        pass
+
+
+def streaming_gnss(port):
+    gnss = osplib.GNSS(METADATA)
+    gnss.gps_ser = port
+    gnss.gps_found = True
+    gnss.start_stream()
+    return gnss
+
+
+def call_with_timeout(function, timeout=5.0):
+    # Runs function on a thread, returning its result or exception
+    result = {}
+
+    def target():
+        try:
+            result['value'] = function()
+        except Exception as error:
+            result['error'] = error
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'call blocked'
+    return result
+
+
+def test_gnss_stream_raises_the_reader_error():
+    gga = nmea('GNGGA,140000.00,4530.123456,N,06330.654321,W,4,12,0.8,10.0,M,-20.0,M,1.0,0000')
+    gnss = streaming_gnss(FakePort([(gga + '\r\n').encode()],
+                                   OSError('port closed')))
+    result = call_with_timeout(gnss.get_nmea)
+    assert result['value'][1].sentence_type == 'GGA'
+    result = call_with_timeout(gnss.get_nmea)
+    assert isinstance(result['error'], OSError)
+    gnss.stop_stream()
+    assert not gnss.streaming()
+
+
+class QueuePort:
+    # Serial port reading whatever has been put on its queue
+    def __init__(self):
+        self.chunks = queue.Queue()
+        self.timeout = None
+        self.error = None
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size):
+        if self.error is not None:
+            raise self.error
+        try:
+            return self.chunks.get(timeout=0.01)
+        except queue.Empty:
+            return b''
+
+    def reset_input_buffer(self):
+        pass
+
+
+class FakePing1D:
+    # Ping1D taking the commands needed to stream, distances are put on the
+    # port with send_distance
+    def __init__(self):
+        self.iodev = QueuePort()
+        self.written = []
+
+    def set_ping_interval(self, interval, verify=True):
+        pass
+
+    def set_ping_enable(self, enable, verify=True):
+        pass
+
+    def write(self, data):
+        self.written.append(data)
+
+    def send_distance(self, distance, number):
+        from brping import definitions, pingmessage
+        msg = pingmessage.PingMessage(definitions.PING1D_DISTANCE)
+        for name, value in zip(msg.payload_field_names,
+                               (int(distance*1000), 100, 50, number, 0, 10000, 2)):
+            setattr(msg, name, value)
+        msg.pack_msg_data()
+        self.iodev.chunks.put(bytes(msg.msg_data))
+
+
+def streaming_sonar():
+    pytest.importorskip('brping')
+    sonar = osplib.Sonar(METADATA)
+    sonar.myping = FakePing1D()
+    sonar.sonar_found = True
+    sonar.start_stream()
+    return sonar
+
+
+def seconds_now():
+    return osplib.time_to_seconds(dt.datetime.utcnow().time())
+
+
+def test_streamed_ping_age_stays_bounded():
+    # Pings at 20 Hz paired with GNSS messages at 5 Hz
+    sonar = streaming_sonar()
+    stopping = threading.Event()
+
+    def pinger():
+        number = 0
+        while not stopping.is_set():
+            sonar.myping.send_distance(3.0 + number/1000, number)
+            number += 1
+            time.sleep(0.05)
+    thread = threading.Thread(target=pinger, daemon=True)
+    thread.start()
+    ages = []
+    try:
+        for i in range(10):
+            time.sleep(0.2)
+            ping_time, distance = sonar.send_ping()
+            ages.append(seconds_now() - osplib.time_to_seconds(ping_time))
+    finally:
+        stopping.set()
+        thread.join()
+    sonar.stop_stream()
+    assert max(ages) < 0.15
+    assert sonar.stream_counts['skipped'] > 10
+
+
+def test_get_pings_gives_every_ping_and_raises_reader_error():
+    sonar = streaming_sonar()
+    for number in range(5):
+        sonar.myping.send_distance(3.0, number)
+    pings = []
+    while len(pings) < 5:
+        pings.extend(sonar.get_pings(timeout=1.0))
+    assert [ping['ping_number'] for ping_time, ping in pings] == list(range(5))
+    assert pings[0][1]['distance'] == 3.0
+
+    sonar.myping.iodev.error = OSError('port closed')
+    result = call_with_timeout(lambda: sonar.get_pings(timeout=1.0))
+    assert isinstance(result['error'], OSError)
+    result = call_with_timeout(sonar.send_ping)
+    assert isinstance(result['error'], OSError)
+
+
+def test_acquisition_logs_every_streamed_ping():
+    import io
+    sonar = streaming_sonar()
+    acquisition = osplib.Acquisition(METADATA, None, sonar, None, io.StringIO(),
+                                     io.StringIO(), 1500.0, False)
+    acquisition.start()
+    for number in range(20):
+        sonar.myping.send_distance(3.0, number)
+    time.sleep(0.3)
+    acquisition.stop()
+    sonar.stop_stream()
+    assert acquisition.stats()['received']['Sonar'] == 20
+    assert acquisition.raw_log.getvalue().count('$DEPTH') == 20